@@ -0,0 +1,132 @@
+"""
+Structured access logging off the request path
+
+Request threads only put LogRecords on an in-process queue; a QueueListener
+thread formats them as JSON lines and does the I/O. Per-request timings
+(database, S3) are collected in a thread-local while the request runs.
+"""
+import atexit
+import json
+import logging
+import queue
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener
+
+_timings = threading.local()
+
+
+class JSONFormatter(logging.Formatter):
+    """Format a record as one JSON object, merging the `fields` passed via extra"""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record, '%Y-%m-%dT%H:%M:%S'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class QueueAccessHandler(QueueHandler):
+    """
+    Queue records for a background listener that writes JSON lines to stderr
+    and, if `filename` is given, to that file
+    """
+
+    def __init__(self, filename=None):
+        super().__init__(queue.SimpleQueue())
+        formatter = JSONFormatter()
+        targets = [logging.StreamHandler(sys.stderr)]
+        if filename:
+            targets.append(logging.FileHandler(filename))
+        for target in targets:
+            target.setFormatter(formatter)
+        self.listener = QueueListener(self.queue, *targets, respect_handler_level=False)
+        self.listener.start()
+        atexit.register(self.listener.stop)
+
+    def prepare(self, record):
+        # The queue never leaves the process, so the record can be passed through
+        # unformatted; the listener thread does all the formatting
+        return record
+
+
+def start_request_timings():
+    """Reset the current thread's timing counters for a new request"""
+    _timings.values = {}
+
+
+def get_request_timings():
+    return getattr(_timings, 'values', None)
+
+
+def finish_request_timings():
+    """Return the current request's timings and stop collecting on this thread"""
+    values = get_request_timings() or {}
+    _timings.values = None
+    return values
+
+
+def add_timing(name, seconds):
+    """Add one timed operation (e.g. a query or an S3 call) to the current request"""
+    values = get_request_timings()
+    if values is None:
+        return
+    total, count = values.get(name, (0.0, 0))
+    values[name] = (total + seconds, count + 1)
+
+
+@contextmanager
+def timed(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_timing(name, time.perf_counter() - start)
+
+
+def db_timing_wrapper(execute, sql, params, many, context):
+    """connection.execute_wrapper hook timing every query of the request"""
+    with timed('db'):
+        return execute(sql, params, many, context)
+
+
+def instrument_boto3_client(client):
+    """
+    Time every API call a boto3 client makes as 's3' (presigning makes no call)
+    and record its latency per operation in core.metrics
+    """
+    from .metrics import S3_LATENCY
+
+    state = threading.local()
+
+    def before_call(**kwargs):
+        state.start = time.perf_counter()
+
+    def finish(event_name, outcome):
+        start = getattr(state, 'start', None)
+        if start is not None:
+            elapsed = time.perf_counter() - start
+            add_timing('s3', elapsed)
+            # event_name is e.g. 'after-call.s3.PutObject'
+            S3_LATENCY.labels(event_name.rsplit('.', 1)[-1], outcome).observe(elapsed)
+            state.start = None
+
+    def after_call(event_name, http_response=None, **kwargs):
+        failed = http_response is not None and http_response.status_code >= 400
+        finish(event_name, 'error' if failed else 'ok')
+
+    def after_call_error(event_name, **kwargs):
+        finish(event_name, 'error')
+
+    client.meta.events.register('before-call', before_call)
+    client.meta.events.register('after-call', after_call)
+    client.meta.events.register('after-call-error', after_call_error)
+    return client
@@ -0,0 +1,266 @@
+"""
+Batched audit trail (core.models.AccessLog)
+
+Views call record_access(); the event goes onto a bounded in-process queue
+and a background thread writes the queue out with bulk_create every
+AUDIT_FLUSH_INTERVAL seconds, or as soon as AUDIT_BATCH_SIZE events are
+waiting. When the queue is full (the database is slow or down) new events
+are dropped and counted rather than blocking the request; the counts are
+exported as scoremate_audit_events_total and drops are logged at most once
+per DROP_WARNING_INTERVAL seconds.
+
+access_logs is a Postgres table partitioned by month on created_at, so
+retention is a DROP of whole partitions instead of a large DELETE. The
+daily cleanup_access_log_partitions task creates upcoming partitions and
+drops expired ones. Rows that landed in access_logs_default (rows copied by
+the partitioning migration, or a month the task missed) are moved into their
+own monthly partitions by the same run, so the default partition stays empty
+and those rows expire like any others.
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import date
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, connection, transaction
+from django.utils import timezone
+
+from .metrics import AUDIT_EVENTS
+from .ratelimit import client_ip
+
+logger = logging.getLogger(__name__)
+
+PARTITION_PREFIX = 'access_logs_p'
+DEFAULT_PARTITION = 'access_logs_default'
+DROP_WARNING_INTERVAL = 60
+
+
+class AuditBuffer:
+    """Bounded queue of pending AccessLog rows with a lazily started flusher thread"""
+
+    def __init__(self, maxsize, batch_size, interval):
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.queue = queue.Queue(self.maxsize)
+        self.counters = {'recorded': 0, 'dropped': 0, 'written': 0, 'failed': 0}
+        self._drops_unreported = 0
+        self._last_drop_warning = None
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = os.getpid()
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+        AUDIT_EVENTS.labels(name).inc(amount)
+
+    def _warn_dropped(self):
+        """Log drops without flooding the log while the buffer stays full"""
+        now = time.monotonic()
+        with self._lock:
+            self._drops_unreported += 1
+            if self._last_drop_warning is not None and now - self._last_drop_warning < DROP_WARNING_INTERVAL:
+                return
+            dropped, self._drops_unreported = self._drops_unreported, 0
+            self._last_drop_warning = now
+        logger.warning(f"Audit buffer full ({self.maxsize} events): dropped {dropped} events")
+
+    def stats(self):
+        """Counters since process start, plus the current queue depth"""
+        with self._lock:
+            return dict(self.counters, pending=self.queue.qsize())
+
+    def put(self, event):
+        """Queue one event; returns False (and counts a drop) if the buffer is full"""
+        if self._pid != os.getpid():
+            # Forked worker: the parent's queue and thread did not come along
+            self._reset()
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            self._count('dropped')
+            self._warn_dropped()
+            return False
+        self._count('recorded')
+        if self.queue.qsize() >= self.batch_size:
+            self._wake.set()
+        if settings.AUDIT_BACKGROUND_FLUSH:
+            self._ensure_thread()
+        return True
+
+    def drain(self, limit):
+        events = []
+        while len(events) < limit:
+            try:
+                events.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return events
+
+    def clear(self):
+        self.drain(self.queue.qsize())
+
+    def flush(self):
+        """Write every queued event in batches; returns the number of rows written"""
+        from .models import AccessLog
+
+        written = 0
+        while True:
+            events = self.drain(self.batch_size)
+            if not events:
+                break
+            try:
+                AccessLog.objects.bulk_create([AccessLog(**event) for event in events])
+            except DatabaseError as exc:
+                # The batch is lost; keep going so one bad row can't wedge the buffer
+                self._count('failed', len(events))
+                logger.warning(f"Failed to write {len(events)} audit events: {exc}")
+                continue
+            written += len(events)
+        if written:
+            self._count('written', written)
+        return written
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='audit-flusher', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Audit flusher failed")
+            finally:
+                close_old_connections()
+
+
+audit_buffer = AuditBuffer(
+    maxsize=settings.AUDIT_BUFFER_SIZE,
+    batch_size=settings.AUDIT_BATCH_SIZE,
+    interval=settings.AUDIT_FLUSH_INTERVAL,
+)
+atexit.register(audit_buffer.flush)
+
+
+def record_access(request, action, target_type, target_id=None, user=None, **meta):
+    """
+    Queue an audit event for the request's user (or `user`, e.g. at login)
+
+    Never touches the database; returns False if the event was dropped.
+    """
+    if not settings.AUDIT_LOG_ENABLED:
+        return False
+    user = user or request.user
+    if not (user and user.is_authenticated):
+        return False
+    return audit_buffer.put({
+        'user_id': user.id,
+        'action': action,
+        'target_type': target_type,
+        'target_id': target_id,
+        'meta_json': meta,
+        'ip_address': client_ip(request),
+        'user_agent': request.META.get('HTTP_USER_AGENT', ''),
+        'created_at': timezone.now(),
+    })
+
+
+def _month_start(day, offset=0):
+    month = day.year * 12 + day.month - 1 + offset
+    return date(month // 12, month % 12 + 1, 1)
+
+
+def _default_partition_months(cursor):
+    """Month starts of the rows sitting in the default partition"""
+    cursor.execute("SELECT to_regclass(%s)", [DEFAULT_PARTITION])
+    if cursor.fetchone()[0] is None:
+        return set()
+    cursor.execute(f"SELECT DISTINCT date_trunc('month', created_at)::date FROM {DEFAULT_PARTITION}")
+    return {row[0] for row in cursor.fetchall()}
+
+
+def _adopt_default_rows(cursor, name, start, end):
+    """
+    Create partition `name` for rows already in the default partition: Postgres
+    refuses a new partition whose range has rows in the default one, so the
+    table is filled first and attached afterwards
+    """
+    cursor.execute(f"CREATE TABLE {name} (LIKE access_logs INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+    cursor.execute(
+        f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE created_at >= %s AND created_at < %s "
+        f"RETURNING *) INSERT INTO {name} SELECT * FROM moved",
+        [start, end],
+    )
+    cursor.execute(
+        f"ALTER TABLE access_logs ATTACH PARTITION {name} "
+        f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+    )
+
+
+def ensure_partitions(months_ahead=None, today=None):
+    """
+    Create the monthly partitions from this month through `months_ahead` months
+    ahead, and one for every month with rows in the default partition
+    """
+    if connection.vendor != 'postgresql':
+        return []
+    months_ahead = settings.AUDIT_PARTITIONS_AHEAD if months_ahead is None else months_ahead
+    today = today or timezone.now().date()
+    created = []
+    with transaction.atomic(), connection.cursor() as cursor:
+        stray = _default_partition_months(cursor)
+        months = {_month_start(today, offset) for offset in range(months_ahead + 1)} | stray
+        for start in sorted(months):
+            end = _month_start(start, 1)
+            name = f"{PARTITION_PREFIX}{start:%Y%m}"
+            cursor.execute("SELECT to_regclass(%s)", [name])
+            if cursor.fetchone()[0] is not None:
+                continue
+            if start in stray:
+                _adopt_default_rows(cursor, name, start, end)
+            else:
+                cursor.execute(
+                    f"CREATE TABLE {name} PARTITION OF access_logs "
+                    f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+                )
+            created.append(name)
+    return created
+
+
+def prune_partitions(retention_months=None, today=None):
+    """Drop monthly partitions that ended more than `retention_months` months ago"""
+    if connection.vendor != 'postgresql':
+        return []
+    retention_months = settings.AUDIT_RETENTION_MONTHS if retention_months is None else retention_months
+    cutoff = f"{PARTITION_PREFIX}{_month_start(today or timezone.now().date(), -retention_months):%Y%m}"
+    dropped = []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = 'access_logs' AND c.relname LIKE %s",
+            [f"{PARTITION_PREFIX}%"],
+        )
+        for (name,) in cursor.fetchall():
+            # Names sort by month, so anything before the cutoff month has expired
+            if name < cutoff:
+                cursor.execute(f"DROP TABLE {name}")
+                dropped.append(name)
+    return sorted(dropped)
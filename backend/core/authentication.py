@@ -0,0 +1,148 @@
+"""
+JWT authentication with cached user lookups
+
+simplejwt's JWTAuthentication loads the User row on every request. Here users
+are resolved from a small in-process LRU (USER_CACHE_LOCAL_TTL seconds), then
+the shared cache (USER_CACHE_TIMEOUT seconds), and only then Postgres. Cached
+entries are dropped by core.signals whenever the user row is saved, and carry
+the user's token_version so bumping it revokes every token issued before.
+
+Only the saving process drops its LRU entry, so other processes may serve a
+copy up to USER_CACHE_LOCAL_TTL seconds old: never save request.user without
+update_fields, and change counters with F() (User.adjust_used_quota).
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .metrics import record_cache
+from .models import User
+
+TOKEN_VERSION_CLAIM = 'ver'
+
+
+class LocalLRU:
+    """A small thread-safe LRU with per-entry expiry"""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+local_user_cache = LocalLRU(settings.USER_CACHE_LOCAL_SIZE)
+
+
+def _user_key(user_id):
+    return f"auth_user:v2:{user_id}"  # v1 entries held positional values
+
+
+def _cached_fields():
+    # The password hash stays out of the cache; it is loaded on access like any deferred field
+    return [f.attname for f in User._meta.concrete_fields if f.attname != 'password']
+
+
+def get_cached_user(user_id):
+    """Return the user with this id from the caches or the database, or None"""
+    key = _user_key(user_id)
+    fields = _cached_fields()
+
+    values = local_user_cache.get(key)
+    if values is not None:
+        record_cache('auth_user', 'local_hit')
+    else:
+        values = cache.get(key)
+        if values is not None:
+            record_cache('auth_user', 'hit')
+        else:
+            record_cache('auth_user', 'miss')
+            values = User.objects.filter(pk=user_id).values(*fields).first()
+            if values is None:
+                return None
+            cache.set(key, values, timeout=settings.USER_CACHE_TIMEOUT)
+        local_user_cache.set(key, values, settings.USER_CACHE_LOCAL_TTL)
+
+    # Entries are keyed by attname so a schema change never shifts values between
+    # fields; fields missing from an older entry are deferred and loaded on access
+    present = [field for field in fields if field in values]
+    return User.from_db('default', present, [values[field] for field in present])
+
+
+def invalidate_cached_user(user_id):
+    """Drop a user's cached entry now and again once the surrounding transaction commits"""
+    key = _user_key(user_id)
+
+    def drop():
+        local_user_cache.delete(key)
+        cache.delete(key)
+
+    drop()
+    transaction.on_commit(drop)
+
+
+class VersionedRefreshToken(RefreshToken):
+    """Refresh token carrying the user's token_version (copied into its access tokens)"""
+
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        token[TOKEN_VERSION_CLAIM] = user.token_version
+        return token
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication that resolves the user through get_cached_user"""
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        user = get_cached_user(user_id)
+        if user is None:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+        if not api_settings.USER_AUTHENTICATION_RULE(user):
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        # Tokens issued before versioning have no claim and stay valid until they expire
+        version = validated_token.get(TOKEN_VERSION_CLAIM)
+        if version is not None and version != user.token_version:
+            raise AuthenticationFailed(_("Token has been revoked"), code="token_revoked")
+        return user
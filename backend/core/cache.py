@@ -0,0 +1,85 @@
+"""
+Per-user cache helpers for expensive aggregate endpoints
+
+Cached payloads are keyed by a per-user version counter. Mutations bump the
+counter instead of deleting keys, so stale entries simply stop being read and
+expire on their own. The counter doubles as an ETag for cheap revalidation.
+"""
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .metrics import record_cache
+
+
+def _version_key(scope, user_id):
+    return f"cache_version:{scope}:{user_id}"
+
+
+def get_cache_version(scope, user_id):
+    """Return the current cache version for a user's scope (e.g. 'scores')"""
+    key = _version_key(scope, user_id)
+    version = cache.get(key)
+    if version is None:
+        # Seed from the clock so an evicted counter never reuses an old version
+        cache.add(key, int(time.time() * 1000), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_cache_version(scope, user_id):
+    """Invalidate every cached payload in a user's scope"""
+    key = _version_key(scope, user_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, int(time.time() * 1000), timeout=None)
+
+
+def invalidate_user_cache(scope, user_id):
+    """
+    Bump the scope version now and again after the surrounding transaction commits,
+    so concurrent readers cannot re-cache pre-commit data under the new version.
+    """
+    bump_cache_version(scope, user_id)
+    transaction.on_commit(lambda: bump_cache_version(scope, user_id))
+
+
+def user_cache_key(scope, user_id, name, version=None):
+    """Build a versioned cache key for a user's payload"""
+    if version is None:
+        version = get_cache_version(scope, user_id)
+    return f"{name}:{user_id}:v{version}"
+
+
+def get_or_set_user_cache(scope, user_id, name, compute, version=None, timeout=None):
+    """Return a cached payload for the user, computing and storing it on a miss"""
+    key = user_cache_key(scope, user_id, name, version)
+    data = cache.get(key)
+    record_cache(name, 'miss' if data is None else 'hit')
+    if data is None:
+        data = compute()
+        if timeout is None:
+            timeout = settings.AGGREGATE_CACHE_TIMEOUT
+        cache.set(key, data, timeout=timeout)
+    return data
+
+
+def etag_for_version(scope, user_id, version):
+    """Build a strong ETag value from a scope version"""
+    return f'"{scope}-{user_id}-{version}"'
+
+
+def etag_matches(request, etag):
+    """Check the request's If-None-Match header against an ETag"""
+    header = request.META.get('HTTP_IF_NONE_MATCH', '')
+    if not header:
+        return False
+    candidates = [value.strip() for value in header.split(',')]
+    return '*' in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+def dashboard_cache_version(user_id):
+    """Combined version of every scope the dashboard overview is built from"""
+    return f"{get_cache_version('scores', user_id)}.{get_cache_version('setlists', user_id)}"
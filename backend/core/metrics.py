@@ -0,0 +1,145 @@
+"""
+Prometheus metrics for the API, S3 storage and the Celery pipeline
+
+With PROMETHEUS_MULTIPROC_DIR set, every process (gunicorn workers, uvicorn,
+prefork Celery children) writes its samples to its own mmap file in that
+directory, and metrics_view sums all of them. Web and worker containers share
+the directory, so files are named by host and pid rather than pid alone.
+Only counters and histograms are used: both aggregate across processes
+without any cleanup when a process exits.
+
+Files of exited processes stay until the directory is cleared (it is a tmpfs
+volume in docker-compose), so Celery pool children are named by their pool
+slot instead of their pid: a child recycled by --max-tasks-per-child reopens
+its predecessor's files and carries on from its counts, and the number of
+files stays bounded by the pool size.
+"""
+import os
+import socket
+import time
+from datetime import datetime
+
+from billiard.process import current_process
+from celery.signals import before_task_publish, task_postrun, task_prerun, worker_process_shutdown
+from prometheus_client import Counter, Histogram, multiprocess, values
+
+HOSTNAME = socket.gethostname()
+
+
+def process_identifier(pid=None):
+    """Name of this process's sample files: its Celery pool slot, or its pid"""
+    if pid is None:
+        index = getattr(current_process(), 'index', None)
+        if index is not None:
+            return f"{HOSTNAME}-celery{index}"
+        pid = os.getpid()
+    return f"{HOSTNAME}-{pid}"
+
+
+def mark_process_dead(pid=None):
+    """Drop the live-gauge files of an exited process (gunicorn child_exit, Celery shutdown)"""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        multiprocess.mark_process_dead(process_identifier(pid))
+
+
+if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+    values.ValueClass = values.MultiProcessValue(process_identifier)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+TASK_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+REQUEST_LATENCY = Histogram(
+    'scoremate_http_request_duration_seconds', 'API request latency',
+    ['method', 'route', 'status'], buckets=LATENCY_BUCKETS,
+)
+REQUEST_DB_QUERIES = Histogram(
+    'scoremate_http_request_db_queries', 'Database queries per API request',
+    ['route'], buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, 250),
+)
+REQUEST_DB_TIME = Histogram(
+    'scoremate_http_request_db_seconds', 'Database time per API request',
+    ['route'], buckets=LATENCY_BUCKETS,
+)
+S3_LATENCY = Histogram(
+    'scoremate_s3_request_duration_seconds', 'S3 API call latency',
+    ['operation', 'outcome'], buckets=LATENCY_BUCKETS,
+)
+TASK_DURATION = Histogram(
+    'scoremate_celery_task_duration_seconds', 'Celery task run time',
+    ['task', 'state'], buckets=TASK_BUCKETS,
+)
+TASK_QUEUE_WAIT = Histogram(
+    'scoremate_celery_task_queue_wait_seconds', 'Time from publish (or ETA) to start',
+    ['task'], buckets=TASK_BUCKETS,
+)
+QUOTA_RESERVATIONS = Counter(
+    'scoremate_quota_reservations_total', 'Upload quota reservations by outcome',
+    ['outcome'],  # reserved, rejected, confirmed, expired, cancelled
+)
+CACHE_REQUESTS = Counter(
+    'scoremate_cache_requests_total', 'Application cache lookups',
+    ['cache', 'result'],  # result: hit, local_hit, miss
+)
+AUDIT_EVENTS = Counter(
+    'scoremate_audit_events_total', 'Audit events through the in-process buffer',
+    ['outcome'],  # recorded, dropped, written, failed
+)
+
+
+def route_name(request):
+    """Low-cardinality route label: the URL name (e.g. 'score-detail'), not the path"""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return match.view_name or match.route or 'unnamed'
+
+
+def observe_request(request, status_code, duration, timings):
+    """Record one API request; `timings` is the access_log {name: (seconds, count)} dict"""
+    route = route_name(request)
+    REQUEST_LATENCY.labels(request.method, route, f"{status_code // 100}xx").observe(duration)
+    db_seconds, db_calls = timings.get('db', (0.0, 0))
+    REQUEST_DB_QUERIES.labels(route).observe(db_calls)
+    REQUEST_DB_TIME.labels(route).observe(db_seconds)
+
+
+def record_cache(cache_name, result):
+    CACHE_REQUESTS.labels(cache_name, result).inc()
+
+
+# Celery: queue wait is measured from a header stamped at publish time, so it
+# is only known for tasks published by an instrumented process
+_task_starts = {}
+
+
+@before_task_publish.connect
+def stamp_published_at(headers=None, **kwargs):
+    if headers is not None:
+        headers['published_at'] = time.time()
+
+
+@task_prerun.connect
+def start_task_timer(task_id=None, task=None, **kwargs):
+    now = time.time()
+    _task_starts[task_id] = time.perf_counter()
+
+    published_at = getattr(task.request, 'published_at', None)
+    if published_at is None:
+        return
+    eta = getattr(task.request, 'eta', None)
+    if eta:
+        # A countdown is scheduled delay, not queueing
+        published_at = max(published_at, datetime.fromisoformat(eta).timestamp())
+    TASK_QUEUE_WAIT.labels(task.name).observe(max(0.0, now - published_at))
+
+
+@task_postrun.connect
+def stop_task_timer(task_id=None, task=None, state=None, **kwargs):
+    start = _task_starts.pop(task_id, None)
+    if start is not None:
+        TASK_DURATION.labels(task.name, state or 'UNKNOWN').observe(time.perf_counter() - start)
+
+
+@worker_process_shutdown.connect
+def forget_pool_process(**kwargs):
+    mark_process_dead()
@@ -3,12 +3,15 @@ Custom middleware for ScoreMateServer
 """
 import json
 import time
+import random
 import logging
+from django.conf import settings
 from django.utils.deprecation import MiddlewareMixin
 from django.http import JsonResponse
 from rest_framework import status
 
 logger = logging.getLogger(__name__)
+access_logger = logging.getLogger('core.access')
 
 
 class CorsMiddleware(MiddlewareMixin):
@@ -21,7 +24,8 @@ class CorsMiddleware(MiddlewareMixin):
         # Allow requests from localhost:3000 (frontend)
         response['Access-Control-Allow-Origin'] = 'http://localhost:3000'
         response['Access-Control-Allow-Methods'] = 'GET, POST, PUT, PATCH, DELETE, OPTIONS'
-        response['Access-Control-Allow-Headers'] = 'Authorization, Content-Type, Accept'
+        response['Access-Control-Allow-Headers'] = 'Authorization, Content-Type, Accept, X-Profile'
+        response['Access-Control-Expose-Headers'] = 'X-Profile-Id'
         response['Access-Control-Allow-Credentials'] = 'true'
         response['Access-Control-Max-Age'] = '3600'
         
@@ -33,7 +37,7 @@ class CorsMiddleware(MiddlewareMixin):
             response = JsonResponse({'status': 'ok'})
             response['Access-Control-Allow-Origin'] = 'http://localhost:3000'
             response['Access-Control-Allow-Methods'] = 'GET, POST, PUT, PATCH, DELETE, OPTIONS'
-            response['Access-Control-Allow-Headers'] = 'Authorization, Content-Type, Accept'
+            response['Access-Control-Allow-Headers'] = 'Authorization, Content-Type, Accept, X-Profile'
             response['Access-Control-Allow-Credentials'] = 'true'
             response['Access-Control-Max-Age'] = '3600'
             return response
@@ -42,57 +46,72 @@ class CorsMiddleware(MiddlewareMixin):
 
 class APILoggingMiddleware(MiddlewareMixin):
     """
-    Middleware to log API requests and responses for monitoring and debugging
+    Emit one structured access log record per API request
+    
+    Records go to the 'core.access' logger, whose QueueAccessHandler formats
+    and writes them on a background thread. Successful GET/HEAD requests are
+    sampled at ACCESS_LOG_SAMPLE_RATE; everything else is always logged.
+    Latency and database timings of every request also go to core.metrics.
     """
     
+    skip_paths = ('/admin/', '/static/', '/media/', '/favicon.ico', '/metrics')
+    
     def process_request(self, request):
-        """Log incoming requests"""
-        request._start_time = time.time()
+        """Start timing the request"""
+        from django.db import connection
+        from .access_log import db_timing_wrapper, start_request_timings
         
-        # Skip logging for certain paths
-        skip_paths = ['/admin/', '/static/', '/media/', '/favicon.ico']
-        if any(request.path.startswith(path) for path in skip_paths):
+        request._access_log = not request.path.startswith(self.skip_paths)
+        if not request._access_log:
             return None
         
-        # Log request details
-        user_id = getattr(request.user, 'id', 'anonymous') if hasattr(request, 'user') else 'unknown'
-        logger.info(
-            f"API Request: {request.method} {request.path} "
-            f"[User: {user_id}, IP: {self.get_client_ip(request)}]"
-        )
-        
+        request._start_time = time.perf_counter()
+        start_request_timings()
+        connection.execute_wrappers.append(db_timing_wrapper)
         return None
     
     def process_response(self, request, response):
-        """Log outgoing responses"""
-        # Skip logging for certain paths
-        skip_paths = ['/admin/', '/static/', '/media/', '/favicon.ico']
-        if any(request.path.startswith(path) for path in skip_paths):
+        """Log the request with its status and timing breakdown"""
+        if not getattr(request, '_access_log', False):
             return response
         
-        # Calculate response time
-        response_time = 0
-        if hasattr(request, '_start_time'):
-            response_time = (time.time() - request._start_time) * 1000  # Convert to milliseconds
+        from django.db import connection
+        from .access_log import db_timing_wrapper, finish_request_timings
+        from .metrics import observe_request
         
-        # Log response details
-        user_id = getattr(request.user, 'id', 'anonymous') if hasattr(request, 'user') else 'unknown'
-        logger.info(
-            f"API Response: {request.method} {request.path} "
-            f"[Status: {response.status_code}, User: {user_id}, "
-            f"Time: {response_time:.2f}ms]"
-        )
+        if db_timing_wrapper in connection.execute_wrappers:
+            connection.execute_wrappers.remove(db_timing_wrapper)
+        timings = finish_request_timings()
+        duration = time.perf_counter() - request._start_time
+        observe_request(request, response.status_code, duration, timings)
         
+        if (request.method in ('GET', 'HEAD') and 200 <= response.status_code < 300
+                and random.random() >= settings.ACCESS_LOG_SAMPLE_RATE):
+            return response
+        
+        fields = {
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'user_id': getattr(getattr(request, 'user', None), 'id', None),
+            'ip': self.get_client_ip(request),
+            'duration_ms': round(duration * 1000, 2),
+        }
+        for name, (total, count) in timings.items():
+            fields[f'{name}_ms'] = round(total * 1000, 2)
+            fields[f'{name}_calls'] = count
+        
+        access_logger.info('request', extra={'fields': fields})
         return response
     
     def process_exception(self, request, exception):
         """Log unhandled exceptions"""
-        user_id = getattr(request.user, 'id', 'anonymous') if hasattr(request, 'user') else 'unknown'
-        logger.error(
-            f"Unhandled Exception: {request.method} {request.path} "
-            f"[User: {user_id}, Exception: {exception.__class__.__name__}: {str(exception)}]",
-            exc_info=True
-        )
+        access_logger.error('unhandled_exception', exc_info=True, extra={'fields': {
+            'method': request.method,
+            'path': request.path,
+            'user_id': getattr(getattr(request, 'user', None), 'id', None),
+            'exception': f"{exception.__class__.__name__}: {exception}",
+        }})
         return None
     
     def get_client_ip(self, request):
@@ -105,6 +124,82 @@ class APILoggingMiddleware(MiddlewareMixin):
         return ip
 
 
+class ProfilingMiddleware(MiddlewareMixin):
+    """
+    Profile one request for staff who ask for it (see core.profiling)
+    
+    Triggered by an `X-Profile: 1` header or `?_profile=1`. Staff are
+    recognised from the session or the bearer token; anyone else's request,
+    or one arriving while another is being profiled, runs normally and unprofiled.
+    """
+    
+    def process_request(self, request):
+        """Start cProfile and the SQL query log for a staff profiling request"""
+        if not settings.PROFILING_ENABLED:
+            return None
+        if request.META.get('HTTP_X_PROFILE') != '1' and request.GET.get('_profile') != '1':
+            return None
+        if not self.is_staff_request(request):
+            return None
+        
+        import cProfile
+        from django.db import connection
+        from .profiling import QueryLog, profiler_lock
+        
+        if not profiler_lock.acquire(blocking=False):
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiling tool (e.g. a debugger) is active in this process
+            profiler_lock.release()
+            return None
+        
+        request._query_log = QueryLog()
+        connection.execute_wrappers.append(request._query_log)
+        request._profile_start = time.perf_counter()
+        request._profiler = profiler
+        return None
+    
+    def process_response(self, request, response):
+        """Stop profiling, store the profile and return its id"""
+        profiler = getattr(request, '_profiler', None)
+        if profiler is None:
+            return response
+        from django.db import connection
+        from .profiling import profiler_lock, save_profile
+        
+        try:
+            profiler.disable()
+        finally:
+            profiler_lock.release()
+        duration = time.perf_counter() - request._profile_start
+        
+        if request._query_log in connection.execute_wrappers:
+            connection.execute_wrappers.remove(request._query_log)
+        request._profiler = None
+        response['X-Profile-Id'] = save_profile(request, response, profiler, request._query_log, duration)
+        return response
+    
+    def is_staff_request(self, request):
+        """Resolve staff status from the session user or the bearer token"""
+        from rest_framework.exceptions import AuthenticationFailed
+        from rest_framework_simplejwt.exceptions import InvalidToken
+        from .authentication import CachedJWTAuthentication
+        
+        if request.user.is_authenticated:
+            return request.user.is_staff
+        try:
+            result = CachedJWTAuthentication().authenticate(request)
+        except (InvalidToken, AuthenticationFailed):
+            return False
+        if result is None or not result[0].is_staff:
+            return False
+        request.user = result[0]
+        return True
+
+
 class SecurityHeadersMiddleware(MiddlewareMixin):
     """
     Middleware to add security headers to responses
@@ -167,57 +262,73 @@ class QuotaCheckMiddleware(MiddlewareMixin):
 
 class RateLimitingMiddleware(MiddlewareMixin):
     """
-    Basic rate limiting middleware (for demonstration)
-    In production, use Redis-based rate limiting
-    """
+    Shared per-endpoint rate limiting (see core.ratelimit)
     
-    def __init__(self, get_response):
-        super().__init__(get_response)
-        self.requests = {}  # Simple in-memory store (not suitable for production)
+    Requests are matched against the RATE_LIMITS path prefixes and counted per
+    user id (from the bearer token) or, for anonymous clients, per IP address.
+    """
     
     def process_request(self, request):
-        """Basic rate limiting check"""
-        # Skip for development or if user is staff
+        """Reject requests over their endpoint budget with 429 and Retry-After"""
+        from .ratelimit import client_ip, hit
+        
+        if not settings.RATE_LIMIT_ENABLED:
+            return None
+        # Skip for staff signed in to the Django admin
         if hasattr(request, 'user') and request.user.is_staff:
             return None
         
-        client_ip = self.get_client_ip(request)
-        current_time = int(time.time())
-        window_start = current_time - 60  # 1-minute window
+        budget = self.get_budget(request.path)
+        if budget is None:
+            return None
+        scope, rate = budget
         
-        # Clean old requests
-        if client_ip in self.requests:
-            self.requests[client_ip] = [
-                req_time for req_time in self.requests[client_ip] 
-                if req_time > window_start
-            ]
-        else:
-            self.requests[client_ip] = []
+        user_id = self.get_token_user_id(request)
+        client = f"user:{user_id}" if user_id else f"ip:{client_ip(request)}"
+        result = hit(f"{scope}:{client}", rate)
+        request.rate_limit = result
         
-        # Check rate limit (100 requests per minute)
-        if len(self.requests[client_ip]) >= 100:
-            return JsonResponse({
+        if not result.allowed:
+            response = JsonResponse({
                 'error': {
                     'type': 'RateLimitExceeded',
                     'code': 'rate_limit_exceeded',
                     'message': 'Too many requests. Please try again later.',
                     'details': {
-                        'limit': 100,
-                        'window': '1 minute',
-                        'retry_after': 60
+                        'scope': scope,
+                        'limit': rate,
+                        'retry_after': result.retry_after
                     }
                 }
             }, status=status.HTTP_429_TOO_MANY_REQUESTS)
-        
-        # Add current request
-        self.requests[client_ip].append(current_time)
+            response['Retry-After'] = str(result.retry_after)
+            return response
         return None
     
-    def get_client_ip(self, request):
-        """Get client IP address from request"""
-        x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-        if x_forwarded_for:
-            ip = x_forwarded_for.split(',')[0]
-        else:
-            ip = request.META.get('REMOTE_ADDR')
-        return ip
\ No newline at end of file
+    def process_response(self, request, response):
+        """Expose the remaining budget to clients"""
+        result = getattr(request, 'rate_limit', None)
+        if result is not None:
+            response['X-RateLimit-Limit'] = str(result.limit)
+            response['X-RateLimit-Remaining'] = str(result.remaining)
+        return response
+    
+    def get_budget(self, path):
+        """Return (scope, rate) of the first RATE_LIMITS entry matching the path"""
+        for scope, prefix, rate in settings.RATE_LIMITS:
+            if path.startswith(prefix):
+                return scope, rate
+        return None
+    
+    def get_token_user_id(self, request):
+        """Read the user id from a valid bearer token without a database query"""
+        from rest_framework_simplejwt.tokens import AccessToken
+        from rest_framework_simplejwt.exceptions import TokenError
+        
+        header = request.META.get('HTTP_AUTHORIZATION', '').split()
+        if len(header) != 2 or header[0] != 'Bearer':
+            return None
+        try:
+            return AccessToken(header[1]).get('user_id')
+        except TokenError:
+            return None
@@ -0,0 +1,109 @@
+"""
+Turn access_logs into a table range-partitioned by month on created_at
+
+Existing rows are copied into the new table; rows outside the monthly
+partitions created here land in access_logs_default. Later partitions are
+created by core.audit.ensure_partitions (run daily by Celery beat), which also
+moves rows out of access_logs_default into partitions of their own month.
+"""
+from datetime import date
+
+import django.utils.timezone
+from django.db import migrations, models
+
+COLUMNS = 'id, action, target_type, target_id, meta_json, ip_address, user_agent, created_at, user_id'
+
+PARTITION_SQL = [
+    "ALTER TABLE access_logs RENAME TO access_logs_old",
+    """
+    CREATE TABLE access_logs (
+        id bigserial NOT NULL,
+        action varchar(50) NOT NULL,
+        target_type varchar(50) NOT NULL,
+        target_id integer NULL,
+        meta_json jsonb NOT NULL,
+        ip_address inet NULL,
+        user_agent text NOT NULL,
+        created_at timestamp with time zone NOT NULL,
+        user_id bigint NOT NULL REFERENCES users (id) DEFERRABLE INITIALLY DEFERRED,
+        PRIMARY KEY (id, created_at)
+    ) PARTITION BY RANGE (created_at)
+    """,
+    "CREATE TABLE access_logs_default PARTITION OF access_logs DEFAULT",
+]
+
+COPY_SQL = [
+    f"INSERT INTO access_logs ({COLUMNS}) SELECT {COLUMNS} FROM access_logs_old",
+    "SELECT setval(pg_get_serial_sequence('access_logs', 'id'), COALESCE(MAX(id), 0) + 1, false) FROM access_logs",
+    "DROP TABLE access_logs_old",
+    'CREATE INDEX access_logs_user_id_2787bc_idx ON access_logs (user_id, created_at DESC)',
+    'CREATE INDEX access_logs_action_66c40c_idx ON access_logs (action, created_at DESC)',
+]
+
+UNPARTITION_SQL = [
+    "ALTER TABLE access_logs RENAME TO access_logs_partitioned",
+    """
+    CREATE TABLE access_logs (
+        id bigint GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        action varchar(50) NOT NULL,
+        target_type varchar(50) NOT NULL,
+        target_id integer NULL,
+        meta_json jsonb NOT NULL,
+        ip_address inet NULL,
+        user_agent text NOT NULL,
+        created_at timestamp with time zone NOT NULL,
+        user_id bigint NOT NULL REFERENCES users (id) DEFERRABLE INITIALLY DEFERRED
+    )
+    """,
+    f"INSERT INTO access_logs ({COLUMNS}) SELECT {COLUMNS} FROM access_logs_partitioned",
+    "SELECT setval(pg_get_serial_sequence('access_logs', 'id'), COALESCE(MAX(id), 0) + 1, false) FROM access_logs",
+    "DROP TABLE access_logs_partitioned CASCADE",
+    'CREATE INDEX access_logs_user_id_2787bc_idx ON access_logs (user_id, created_at DESC)',
+    'CREATE INDEX access_logs_action_66c40c_idx ON access_logs (action, created_at DESC)',
+]
+
+
+def _month_start(day, offset):
+    month = day.year * 12 + day.month - 1 + offset
+    return date(month // 12, month % 12 + 1, 1)
+
+
+def partition(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for sql in PARTITION_SQL:
+        schema_editor.execute(sql)
+    # This month and the next, before the copy so their rows don't land in the
+    # default partition; the maintenance task keeps creating them from here
+    today = date.today()
+    for offset in (0, 1):
+        start, end = _month_start(today, offset), _month_start(today, offset + 1)
+        schema_editor.execute(
+            f"CREATE TABLE access_logs_p{start:%Y%m} PARTITION OF access_logs "
+            f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+        )
+    for sql in COPY_SQL:
+        schema_editor.execute(sql)
+
+
+def unpartition(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for sql in UNPARTITION_SQL:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_user_token_version'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='accesslog',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(partition, unpartition),
+    ]
@@ -1,5 +1,7 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.db.models import F
+from django.db.models.functions import Greatest
 from django.utils import timezone
 import uuid
 
@@ -18,6 +20,7 @@ class User(AbstractUser):
     total_quota_mb = models.IntegerField(default=200)
     used_quota_mb = models.IntegerField(default=0)
     referral_code = models.CharField(max_length=20, unique=True, blank=True, null=True)
+    token_version = models.PositiveIntegerField(default=0, help_text="Bumped to revoke all issued JWTs")
     
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username']
@@ -27,6 +30,21 @@ class User(AbstractUser):
             self.referral_code = str(uuid.uuid4())[:8].upper()
         super().save(*args, **kwargs)
     
+    def revoke_tokens(self):
+        """Revoke every JWT issued to this user so far (password reset or change)"""
+        self.token_version = F('token_version') + 1
+        self.save(update_fields=['token_version'])
+        self.refresh_from_db(fields=['token_version'])
+    
+    def adjust_used_quota(self, delta_mb):
+        """
+        Add `delta_mb` (negative to release) to the used quota in one UPDATE, never
+        going below zero; the instance may be a stale cached copy of the user
+        """
+        self.used_quota_mb = Greatest(F('used_quota_mb') + delta_mb, 0)
+        self.save(update_fields=['used_quota_mb'])
+        self.refresh_from_db(fields=['used_quota_mb'])
+    
     @property
     def available_quota_mb(self):
         return max(0, self.total_quota_mb - self.used_quota_mb)
@@ -82,7 +100,12 @@ class BillingLog(models.Model):
 
 
 class AccessLog(models.Model):
-    """Track user access patterns for auditing"""
+    """
+    Track user access patterns for auditing
+    
+    Written in batches by core.audit; the table is partitioned by month on
+    created_at (migration 0003), so the primary key is (id, created_at).
+    """
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='access_logs')
     action = models.CharField(max_length=50)
     target_type = models.CharField(max_length=50)
@@ -90,7 +113,8 @@ class AccessLog(models.Model):
     meta_json = models.JSONField(default=dict, blank=True)
     ip_address = models.GenericIPAddressField(null=True, blank=True)
     user_agent = models.TextField(blank=True)
-    created_at = models.DateTimeField(auto_now_add=True)
+    # Set when the event is recorded, not when the batch writer flushes it
+    created_at = models.DateTimeField(default=timezone.now)
     
     class Meta:
         db_table = 'access_logs'
@@ -0,0 +1,138 @@
+"""
+On-demand profiles of single requests, for staff
+
+ProfilingMiddleware runs a request under cProfile with every SQL query timed
+when a staff user sends `X-Profile: 1` (or `?_profile=1`). The result is kept
+in the cache (Redis in production) for PROFILE_TTL seconds and its id is
+returned in the X-Profile-Id response header; the admin API lists profiles
+and serves the raw cProfile data as a .prof file (snakeviz, pstats).
+
+Only one request per process is profiled at a time (cProfile refuses a second
+active profiler); a concurrent profiling request is served unprofiled. Stored
+profiles are indexed by a shared sequence number, each in one of
+PROFILE_MAX_STORED slots, so concurrent saves never overwrite each other.
+"""
+import io
+import marshal
+import pstats
+import threading
+import time
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+SEQUENCE_KEY = 'profile:sequence'
+
+profiler_lock = threading.Lock()
+
+
+def _slot_key(sequence):
+    return f"profile:slot:{sequence % settings.PROFILE_MAX_STORED}"
+
+
+def _next_sequence():
+    try:
+        return cache.incr(SEQUENCE_KEY)
+    except ValueError:
+        # First profile; if another one races us to the add, increment theirs
+        if cache.add(SEQUENCE_KEY, 1, timeout=None):
+            return 1
+        return cache.incr(SEQUENCE_KEY)
+
+
+def _summary_key(profile_id):
+    return f"profile:{profile_id}"
+
+
+def _stats_key(profile_id):
+    return f"profile:{profile_id}:prof"
+
+
+class QueryLog:
+    """connection.execute_wrapper hook recording each query's SQL and duration"""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, time.perf_counter() - start))
+
+    def summary(self, limit=10):
+        """Count, total time, the most repeated statements and the slowest ones"""
+        counts = Counter(sql for sql, _ in self.queries)
+        slowest = sorted(self.queries, key=lambda query: query[1], reverse=True)[:limit]
+        return {
+            'count': len(self.queries),
+            'total_ms': round(sum(duration for _, duration in self.queries) * 1000, 2),
+            'duplicates': [
+                {'sql': sql, 'count': count}
+                for sql, count in counts.most_common(limit) if count > 1
+            ],
+            'slowest': [
+                {'sql': sql, 'duration_ms': round(duration * 1000, 2)}
+                for sql, duration in slowest
+            ],
+        }
+
+
+def save_profile(request, response, profiler, query_log, duration):
+    """Store a finished request profile and return its id"""
+    profile_id = uuid.uuid4().hex
+    profiler.create_stats()
+    # Same format as pstats.Stats.dump_stats, so the download opens in any .prof viewer.
+    # Taken first: pstats.Stats() below empties profiler.stats when loading it
+    raw_stats = marshal.dumps(profiler.stats)
+
+    stream = io.StringIO()
+    pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(settings.PROFILE_TOP_FUNCTIONS)
+
+    summary = {
+        'id': profile_id,
+        'created_at': timezone.now().isoformat(),
+        'user_id': request.user.id,
+        'method': request.method,
+        'path': request.get_full_path(),
+        'status': response.status_code,
+        'duration_ms': round(duration * 1000, 2),
+        'queries': query_log.summary(),
+        'functions': stream.getvalue(),
+    }
+    ttl = settings.PROFILE_TTL
+    cache.set_many({
+        _summary_key(profile_id): summary,
+        _stats_key(profile_id): raw_stats,
+    }, timeout=ttl)
+
+    cache.set(_slot_key(_next_sequence()), profile_id, timeout=ttl)
+    return profile_id
+
+
+def list_profiles():
+    """Summaries of the stored profiles, newest first, without the function listing"""
+    latest = cache.get(SEQUENCE_KEY) or 0
+    slot_keys = [_slot_key(sequence) for sequence in range(latest, max(latest - settings.PROFILE_MAX_STORED, 0), -1)]
+    slots = cache.get_many(slot_keys)
+    ids = [slots[key] for key in slot_keys if key in slots]
+    found = cache.get_many([_summary_key(profile_id) for profile_id in ids])
+    profiles = []
+    for profile_id in ids:
+        summary = found.get(_summary_key(profile_id))
+        if summary is not None:
+            profiles.append({key: value for key, value in summary.items() if key != 'functions'})
+    return profiles
+
+
+def get_profile(profile_id):
+    return cache.get(_summary_key(profile_id))
+
+
+def get_profile_stats(profile_id):
+    """The raw cProfile data (marshalled pstats) of a profile, or None"""
+    return cache.get(_stats_key(profile_id))
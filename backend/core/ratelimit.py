@@ -0,0 +1,107 @@
+"""
+Shared rate limiting with the generic cell rate algorithm (GCRA)
+
+Each key stores a single number, the "theoretical arrival time" (TAT) of the
+next request, so memory is O(1) per key no matter how busy it is. A limit of
+N requests per period P lets a client burst N requests, then one every P/N.
+With Redis configured the check-and-update is one atomic Lua script shared
+by every worker; otherwise the same algorithm runs on the Django cache.
+"""
+import logging
+import math
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+RateLimitResult = namedtuple('RateLimitResult', ['allowed', 'limit', 'remaining', 'retry_after'])
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+# KEYS[1] = TAT key; ARGV[1] = limit, ARGV[2] = period in ms
+# Returns {allowed, remaining, retry_after_ms}
+GCRA_SCRIPT = """
+local limit = tonumber(ARGV[1])
+local period = tonumber(ARGV[2])
+local emission = math.ceil(period / limit)
+local window = emission * limit
+local clock = redis.call('TIME')
+local now = clock[1] * 1000 + math.floor(clock[2] / 1000)
+local tat = tonumber(redis.call('GET', KEYS[1]) or now)
+if tat < now then
+    tat = now
+end
+local new_tat = tat + emission
+if new_tat - now > window then
+    return {0, 0, new_tat - now - window}
+end
+redis.call('SET', KEYS[1], new_tat, 'PX', new_tat - now)
+return {1, math.floor((window - (new_tat - now)) / emission), 0}
+"""
+
+_script = None
+
+
+def parse_rate(rate):
+    """Parse '100/m' (or '100/min', '5/s', '1000/h', '10000/d') into (count, seconds)"""
+    count, period = rate.split('/')
+    return int(count), PERIODS[period[0]]
+
+
+def _get_script():
+    """Register the Lua script once per process"""
+    global _script
+    if _script is None:
+        import redis
+        client = redis.Redis.from_url(settings.RATE_LIMIT_REDIS_URL)
+        _script = client.register_script(GCRA_SCRIPT)
+    return _script
+
+
+def _hit_cache(key, limit, period_ms):
+    """GCRA on the Django cache, for local runs without Redis"""
+    now = time.time() * 1000
+    emission = math.ceil(period_ms / limit)
+    window = emission * limit
+    tat = max(cache.get(key) or now, now)
+    new_tat = tat + emission
+    if new_tat - now > window:
+        return 0, 0, math.ceil(new_tat - now - window)
+    cache.set(key, new_tat, timeout=math.ceil((new_tat - now) / 1000))
+    return 1, math.floor((window - (new_tat - now)) / emission), 0
+
+
+def client_ip(request):
+    """
+    Address to count anonymous requests against: the X-Forwarded-For entry
+    added by the outermost of RATE_LIMIT_TRUSTED_PROXIES proxies, never one
+    the client could have sent itself
+    """
+    proxies = settings.RATE_LIMIT_TRUSTED_PROXIES
+    forwarded = [ip.strip() for ip in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if ip.strip()]
+    if proxies and len(forwarded) >= proxies:
+        return forwarded[-proxies]
+    return request.META.get('REMOTE_ADDR')
+
+
+def hit(key, rate):
+    """Count one request against `key` under a rate like '100/m'"""
+    limit, period = parse_rate(rate)
+    key = f"ratelimit:{key}"
+    period_ms = period * 1000
+
+    if settings.RATE_LIMIT_REDIS_URL:
+        from redis import RedisError
+        try:
+            allowed, remaining, retry_after_ms = _get_script()(keys=[key], args=[limit, period_ms])
+        except RedisError as exc:
+            # Fail open: an unavailable limiter must not take the API down with it
+            logger.warning(f"Rate limiter unavailable: {exc}")
+            return RateLimitResult(True, limit, limit, 0)
+    else:
+        allowed, remaining, retry_after_ms = _hit_cache(key, limit, period_ms)
+
+    return RateLimitResult(bool(allowed), limit, int(remaining), math.ceil(int(retry_after_ms) / 1000))
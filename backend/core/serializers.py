@@ -106,3 +106,10 @@ class UserProfileSerializer(serializers.ModelSerializer):
             'id', 'email', 'is_staff', 'total_quota_mb', 'used_quota_mb',
             'referral_code', 'date_joined', 'last_login'
         )
+    
+    def update(self, instance, validated_data):
+        """Save only the edited fields: the instance is the (possibly stale) cached user"""
+        for attr, value in validated_data.items():
+            setattr(instance, attr, value)
+        instance.save(update_fields=list(validated_data))
+        return instance
@@ -0,0 +1,14 @@
+"""
+Signal handlers for core app
+"""
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .authentication import invalidate_cached_user
+from .models import User
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_user_lookup(sender, instance, **kwargs):
+    """Drop the cached authentication entry on any profile, plan or quota change"""
+    invalidate_cached_user(instance.pk)
@@ -0,0 +1,83 @@
+"""
+DRF throttles with burst and sustained tiers per plan
+
+Each tier is a fixed-window counter in the shared cache: one atomic INCR per
+request (Redis INCR in production), instead of DRF's SimpleRateThrottle which
+reads, rewrites and stores the whole request history list on every call.
+Rates come from THROTTLE_PLAN_RATES[scope][plan] as (burst, sustained).
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.throttling import BaseThrottle
+
+from .ratelimit import client_ip, parse_rate
+
+
+class PlanRateThrottle(BaseThrottle):
+    """
+    Throttle every request by the caller's plan: per user when authenticated,
+    per IP address (with the 'anon' rates) otherwise
+    """
+    scope = 'user'
+    timer = time.time
+
+    def get_scope(self, view):
+        return self.scope
+
+    def get_rates(self, request, scope):
+        """Return the (burst, sustained) rates for the caller, or None if unthrottled"""
+        rates = settings.THROTTLE_PLAN_RATES.get(scope)
+        if not rates:
+            return None
+        user = request.user
+        if not (user and user.is_authenticated):
+            return rates.get('anon')
+        return rates.get(getattr(user, 'plan', None)) or rates.get('solo')
+
+    def get_ident(self, request):
+        user = request.user
+        if user and user.is_authenticated:
+            return f"user:{user.pk}"
+        # Not DRF's get_ident, which trusts the client-supplied start of X-Forwarded-For
+        return f"ip:{client_ip(request)}"
+
+    def allow_request(self, request, view):
+        scope = self.get_scope(view)
+        rates = self.get_rates(request, scope) if scope else None
+        if not rates:
+            return True
+
+        now = self.timer()
+        ident = self.get_ident(request)
+        self.wait_seconds = None
+        for tier, rate in zip(('burst', 'sustained'), rates):
+            limit, period = parse_rate(rate)
+            window = int(now // period)
+            key = f"throttle:{scope}:{tier}:{ident}:{window}"
+            try:
+                count = cache.incr(key)
+            except ValueError:
+                # First request of this window; a racing add just means one of us increments
+                if not cache.add(key, 1, timeout=period):
+                    count = cache.incr(key)
+                else:
+                    count = 1
+            if count > limit:
+                self.wait_seconds = (window + 1) * period - now
+                return False
+        return True
+
+    def wait(self):
+        return getattr(self, 'wait_seconds', None)
+
+
+class ScopedPlanThrottle(PlanRateThrottle):
+    """
+    Extra per-plan budget for heavy endpoints that set `throttle_scope`
+    (e.g. statistics, bulk thumbnail regeneration, direct download)
+    """
+
+    def get_scope(self, view):
+        return getattr(view, 'throttle_scope', None)
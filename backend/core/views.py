@@ -5,13 +5,20 @@ from rest_framework import status, generics, viewsets
 from rest_framework.decorators import api_view, permission_classes, action
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
-from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework_simplejwt.views import TokenObtainPairView
+from django.conf import settings
 from django.contrib.auth import authenticate
-from django.db.models import Count, Sum, Avg, Q
+from django.http import Http404, HttpResponse
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.http import require_GET
+from django.db.models import Count, Sum, Avg, Q, Case, When, Value, IntegerField
+from django.db.models.functions import TruncMonth
 from django.utils import timezone
 from datetime import timedelta
 
+from .audit import record_access
+from .authentication import VersionedRefreshToken
+from .cache import get_or_set_user_cache, dashboard_cache_version
 from .models import User
 from .serializers import (
     UserRegistrationSerializer, 
@@ -20,6 +27,29 @@ from .serializers import (
 )
 
 
+# Size histogram buckets for quota details: (label, min_bytes, max_bytes)
+QUOTA_SIZE_RANGES = [
+    ('0-1MB', 0, 1 * 1024 * 1024),
+    ('1-5MB', 1 * 1024 * 1024, 5 * 1024 * 1024),
+    ('5-20MB', 5 * 1024 * 1024, 20 * 1024 * 1024),
+    ('20MB+', 20 * 1024 * 1024, None),
+]
+LARGE_FILE_BYTES = 20 * 1024 * 1024
+QUOTA_TREND_WINDOWS = (6, 12, 24)
+
+
+def _month_starts(now, months):
+    """Return the first instant of each of the last `months` calendar months, oldest first"""
+    year, month = now.year, now.month
+    starts = []
+    for _ in range(months):
+        starts.append(now.replace(year=year, month=month, day=1, hour=0, minute=0, second=0, microsecond=0))
+        month -= 1
+        if month == 0:
+            year, month = year - 1, 12
+    return list(reversed(starts))
+
+
 class UserRegistrationView(generics.CreateAPIView):
     """User registration endpoint"""
     queryset = User.objects.all()
@@ -33,7 +63,7 @@ class UserRegistrationView(generics.CreateAPIView):
         user = serializer.save()
         
         # Generate JWT tokens for the new user
-        refresh = RefreshToken.for_user(user)
+        refresh = VersionedRefreshToken.for_user(user)
         
         return Response({
             'user': UserProfileSerializer(user).data,
@@ -56,7 +86,8 @@ class UserLoginView(generics.GenericAPIView):
         user = serializer.validated_data['user']
         
         # Generate JWT tokens
-        refresh = RefreshToken.for_user(user)
+        refresh = VersionedRefreshToken.for_user(user)
+        record_access(request, 'login', 'user', user.id, user=user)
         
         return Response({
             'user': UserProfileSerializer(user).data,
@@ -85,55 +116,20 @@ class DashboardViewSet(viewsets.ViewSet):
         """Get dashboard overview data"""
         user = request.user
         
-        # Get related data counts
-        from scores.models import Score
-        from setlists.models import Setlist
-        
-        scores_qs = Score.objects.filter(user=user)
-        setlists_qs = Setlist.objects.filter(user=user)
-        
-        # Basic counts
-        total_scores = scores_qs.count()
-        total_setlists = setlists_qs.count()
-        
-        # Score statistics
-        score_stats = scores_qs.aggregate(
-            total_size_bytes=Sum('size_bytes'),
-            total_pages=Sum('pages'),
-            scores_with_thumbnails=Count('id', filter=Q(thumbnail_key__isnull=False) & ~Q(thumbnail_key=''))
+        # Library aggregates are cached per user; quota comes from the already-loaded user
+        version = dashboard_cache_version(user.id)
+        content = get_or_set_user_cache(
+            'dashboard', user.id, 'dashboard_overview',
+            lambda: self._build_overview(user.id),
+            version=version
         )
         
-        # Convert bytes to MB
-        total_size_mb = (score_stats['total_size_bytes'] or 0) / (1024 * 1024)
-        
         # Quota information
         quota_used_mb = user.used_quota_mb
         quota_total_mb = user.total_quota_mb
         quota_percentage = (quota_used_mb / quota_total_mb * 100) if quota_total_mb > 0 else 0
         quota_available_mb = user.available_quota_mb
         
-        # Recent activity (last 7 days)
-        week_ago = timezone.now() - timedelta(days=7)
-        recent_scores = scores_qs.filter(created_at__gte=week_ago).count()
-        recent_setlists = setlists_qs.filter(created_at__gte=week_ago).count()
-        
-        # Get latest scores
-        latest_scores = scores_qs.order_by('-created_at')[:5].values(
-            'id', 'title', 'composer', 'created_at', 'pages', 'thumbnail_key'
-        )
-        
-        # Get latest setlists with item counts
-        latest_setlists = []
-        for setlist in setlists_qs.order_by('-created_at')[:5]:
-            latest_setlists.append({
-                'id': setlist.id,
-                'title': setlist.title,
-                'description': setlist.description,
-                'created_at': setlist.created_at,
-                'item_count': setlist.item_count,
-                'total_pages': setlist.total_pages
-            })
-        
         return Response({
             'user': {
                 'username': user.username,
@@ -141,102 +137,176 @@ class DashboardViewSet(viewsets.ViewSet):
                 'plan': user.plan,
                 'created_at': user.date_joined
             },
-            'counts': {
-                'total_scores': total_scores,
-                'total_setlists': total_setlists,
-                'scores_with_thumbnails': score_stats['scores_with_thumbnails'],
-            },
+            'counts': content['counts'],
             'quota': {
                 'used_mb': round(quota_used_mb, 2),
                 'total_mb': quota_total_mb,
                 'available_mb': round(quota_available_mb, 2),
                 'percentage_used': round(quota_percentage, 1),
             },
+            'statistics': content['statistics'],
+            'recent_activity': content['recent_activity'],
+            'latest_content': content['latest_content'],
+        })
+    
+    def _build_overview(self, user_id):
+        """Build the cacheable part of the dashboard in a fixed number of queries"""
+        from scores.models import Score
+        from setlists.models import Setlist
+        
+        scores_qs = Score.objects.filter(user_id=user_id)
+        setlists_qs = Setlist.objects.filter(user_id=user_id)
+        week_ago = timezone.now() - timedelta(days=7)
+        
+        # Score counts, sizes and recent activity in one aggregate
+        score_stats = scores_qs.aggregate(
+            total_scores=Count('id'),
+            total_size_bytes=Sum('size_bytes'),
+            total_pages=Sum('pages'),
+            scores_with_thumbnails=Count('id', filter=Q(thumbnail_key__isnull=False) & ~Q(thumbnail_key='')),
+            scores_this_week=Count('id', filter=Q(created_at__gte=week_ago)),
+        )
+        
+        setlist_stats = setlists_qs.aggregate(
+            total_setlists=Count('id'),
+            setlists_this_week=Count('id', filter=Q(created_at__gte=week_ago)),
+        )
+        
+        # Convert bytes to MB
+        total_size_mb = (score_stats['total_size_bytes'] or 0) / (1024 * 1024)
+        
+        # Get latest scores
+        latest_scores = scores_qs.order_by('-created_at')[:5].values(
+            'id', 'title', 'composer', 'created_at', 'pages', 'thumbnail_key'
+        )
+        
+        # Get latest setlists with their denormalized item counts and page totals
+        latest_setlists = setlists_qs.order_by('-created_at').values(
+            'id', 'title', 'description', 'created_at', 'item_count', 'total_pages'
+        )[:5]
+        
+        return {
+            'counts': {
+                'total_scores': score_stats['total_scores'],
+                'total_setlists': setlist_stats['total_setlists'],
+                'scores_with_thumbnails': score_stats['scores_with_thumbnails'],
+            },
             'statistics': {
                 'total_file_size_mb': round(total_size_mb, 2),
                 'total_pages': score_stats['total_pages'] or 0,
             },
             'recent_activity': {
-                'scores_this_week': recent_scores,
-                'setlists_this_week': recent_setlists,
+                'scores_this_week': score_stats['scores_this_week'],
+                'setlists_this_week': setlist_stats['setlists_this_week'],
             },
             'latest_content': {
                 'scores': list(latest_scores),
-                'setlists': latest_setlists,
+                'setlists': list(latest_setlists),
             }
-        })
+        }
     
     @action(detail=False, methods=['get'])
     def quota_details(self, request):
         """Get detailed quota information"""
         user = request.user
         
-        # Calculate quota breakdown by file sizes
+        try:
+            months = int(request.query_params.get('months', 6))
+        except (TypeError, ValueError):
+            months = None
+        if months not in QUOTA_TREND_WINDOWS:
+            return Response({
+                'error': f"months must be one of {', '.join(str(m) for m in QUOTA_TREND_WINDOWS)}"
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        details = get_or_set_user_cache(
+            'scores', user.id, f'quota_details:{months}',
+            lambda: self._build_quota_details(user.id, months)
+        )
+        
+        return Response({
+            'quota_summary': {
+                'used_mb': round(user.used_quota_mb, 2),
+                'total_mb': user.total_quota_mb,
+                'available_mb': round(user.available_quota_mb, 2),
+                'percentage_used': round((user.used_quota_mb / user.total_quota_mb * 100), 1) if user.total_quota_mb > 0 else 0,
+            },
+            'size_breakdown': details['size_breakdown'],
+            'monthly_usage': details['monthly_usage'],  # Oldest month first
+            'window_months': months,
+            'recommendations': self._get_quota_recommendations(
+                user, details['large_files'], details['missing_thumbnails']
+            )
+        })
+    
+    def _build_quota_details(self, user_id, months):
+        """Build size histogram and monthly trend with one grouped query each"""
         from scores.models import Score
-        scores_qs = Score.objects.filter(user=user)
+        scores_qs = Score.objects.filter(user_id=user_id)
         
-        # Size distribution
-        size_ranges = [
-            ('0-1MB', 0, 1 * 1024 * 1024),
-            ('1-5MB', 1 * 1024 * 1024, 5 * 1024 * 1024),
-            ('5-20MB', 5 * 1024 * 1024, 20 * 1024 * 1024),
-            ('20MB+', 20 * 1024 * 1024, float('inf')),
-        ]
+        # Size distribution: bucket each score with CASE and group by bucket
+        bucket = Case(
+            *[
+                When(size_bytes__lt=max_size, then=Value(index))
+                for index, (_, _, max_size) in enumerate(QUOTA_SIZE_RANGES[:-1])
+            ],
+            default=Value(len(QUOTA_SIZE_RANGES) - 1),
+            output_field=IntegerField()
+        )
+        bucket_rows = {
+            row['bucket']: row
+            for row in scores_qs.annotate(bucket=bucket).values('bucket').annotate(
+                count=Count('id'),
+                total_size=Sum('size_bytes'),
+                large_files=Count('id', filter=Q(size_bytes__gt=LARGE_FILE_BYTES)),
+                missing_thumbnails=Count('id', filter=Q(thumbnail_key__isnull=True) | Q(thumbnail_key='')),
+            ).order_by()
+        }
         
         size_breakdown = []
-        for range_name, min_size, max_size in size_ranges:
-            if max_size == float('inf'):
-                count = scores_qs.filter(size_bytes__gte=min_size).count()
-                total_size = scores_qs.filter(size_bytes__gte=min_size).aggregate(
-                    total=Sum('size_bytes'))['total'] or 0
-            else:
-                count = scores_qs.filter(size_bytes__gte=min_size, size_bytes__lt=max_size).count()
-                total_size = scores_qs.filter(size_bytes__gte=min_size, size_bytes__lt=max_size).aggregate(
-                    total=Sum('size_bytes'))['total'] or 0
-            
+        for index, (range_name, _, _) in enumerate(QUOTA_SIZE_RANGES):
+            row = bucket_rows.get(index, {})
+            total_size = row.get('total_size') or 0
             size_breakdown.append({
                 'range': range_name,
-                'count': count,
+                'count': row.get('count', 0),
                 'total_size_mb': round(total_size / (1024 * 1024), 2) if total_size else 0
             })
         
-        # Monthly usage trend (last 6 months)
+        # Monthly usage trend: calendar months in the current timezone
+        month_starts = _month_starts(timezone.localtime(), months)
+        monthly_rows = {
+            timezone.localtime(row['month']).strftime('%Y-%m'): row
+            for row in scores_qs.filter(created_at__gte=month_starts[0]).annotate(
+                month=TruncMonth('created_at')
+            ).values('month').annotate(
+                scores_added=Count('id'),
+                size_added=Sum('size_bytes'),
+            ).order_by()
+        }
+        
         monthly_usage = []
-        for i in range(6):
-            month_start = timezone.now().replace(day=1) - timedelta(days=30 * i)
-            month_end = month_start + timedelta(days=32)
-            month_end = month_end.replace(day=1) - timedelta(days=1)
-            
-            monthly_scores = scores_qs.filter(
-                created_at__gte=month_start,
-                created_at__lte=month_end
-            )
-            
+        for month_start in month_starts:
+            month = month_start.strftime('%Y-%m')
+            row = monthly_rows.get(month, {})
             monthly_usage.append({
-                'month': month_start.strftime('%Y-%m'),
-                'scores_added': monthly_scores.count(),
-                'size_added_mb': round((monthly_scores.aggregate(
-                    total=Sum('size_bytes'))['total'] or 0) / (1024 * 1024), 2)
+                'month': month,
+                'scores_added': row.get('scores_added', 0),
+                'size_added_mb': round((row.get('size_added') or 0) / (1024 * 1024), 2)
             })
         
-        return Response({
-            'quota_summary': {
-                'used_mb': round(user.used_quota_mb, 2),
-                'total_mb': user.total_quota_mb,
-                'available_mb': round(user.available_quota_mb, 2),
-                'percentage_used': round((user.used_quota_mb / user.total_quota_mb * 100), 1) if user.total_quota_mb > 0 else 0,
-            },
+        return {
             'size_breakdown': size_breakdown,
-            'monthly_usage': list(reversed(monthly_usage)),  # Most recent first
-            'recommendations': self._get_quota_recommendations(user, scores_qs)
-        })
+            'monthly_usage': monthly_usage,
+            'large_files': sum(row['large_files'] for row in bucket_rows.values()),
+            'missing_thumbnails': sum(row['missing_thumbnails'] for row in bucket_rows.values()),
+        }
     
-    def _get_quota_recommendations(self, user, scores_qs):
+    def _get_quota_recommendations(self, user, large_files, no_thumbnails):
         """Generate quota usage recommendations"""
         recommendations = []
         
         # Check for large files
-        large_files = scores_qs.filter(size_bytes__gt=20 * 1024 * 1024).count()
         if large_files > 0:
             recommendations.append({
                 'type': 'large_files',
@@ -245,7 +315,6 @@ class DashboardViewSet(viewsets.ViewSet):
             })
         
         # Check for files without thumbnails
-        no_thumbnails = scores_qs.filter(Q(thumbnail_key__isnull=True) | Q(thumbnail_key='')).count()
         if no_thumbnails > 0:
             recommendations.append({
                 'type': 'missing_thumbnails',
@@ -269,3 +338,28 @@ class DashboardViewSet(viewsets.ViewSet):
             })
         
         return recommendations
+
+
+@require_GET
+def metrics(request):
+    """
+    Prometheus scrape endpoint, aggregated across processes in multiprocess mode
+    
+    Requires `Authorization: Bearer <METRICS_TOKEN>`; disabled when no token is set.
+    """
+    import os
+    from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, generate_latest
+    from prometheus_client import multiprocess
+    
+    token = settings.METRICS_TOKEN
+    if not token:
+        raise Http404()
+    if not constant_time_compare(request.META.get('HTTP_AUTHORIZATION', ''), f"Bearer {token}"):
+        return HttpResponse(status=status.HTTP_401_UNAUTHORIZED)
+    
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
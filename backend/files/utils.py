@@ -8,6 +8,9 @@ from django.conf import settings
 from django.core.cache import cache
 import logging
 
+from core.access_log import instrument_boto3_client
+from core.metrics import QUOTA_RESERVATIONS
+
 logger = logging.getLogger(__name__)
 
 
@@ -15,13 +18,13 @@ class S3Handler:
     """Handle S3 operations for file upload/download"""
     
     def __init__(self):
-        self.s3_client = boto3.client(
+        self.s3_client = instrument_boto3_client(boto3.client(
             's3',
             endpoint_url=settings.STORAGE_ENDPOINT if hasattr(settings, 'STORAGE_ENDPOINT') else None,
             aws_access_key_id=settings.STORAGE_ACCESS_KEY,
             aws_secret_access_key=settings.STORAGE_SECRET_KEY,
             use_ssl=getattr(settings, 'STORAGE_USE_SSL', True)
-        )
+        ))
         self.bucket_name = settings.STORAGE_BUCKET
     
     def generate_presigned_upload_url(self, s3_key, content_type, expiry=None):
@@ -142,6 +145,7 @@ class QuotaManager:
         
         # Check if user can upload
         if not user.can_upload(size_bytes):
+            QUOTA_RESERVATIONS.labels('rejected').inc()
             raise ValueError(f"Upload size ({size_bytes / (1024*1024):.1f}MB) exceeds available quota")
         
         # Store reservation in cache (5 minutes TTL)
@@ -156,6 +160,7 @@ class QuotaManager:
         }
         
         cache.set(reservation_key, reservation_data, timeout=300)  # 5 minutes
+        QUOTA_RESERVATIONS.labels('reserved').inc()
         logger.info(f"Reserved quota for user {user.id}: {size_bytes / (1024*1024):.1f}MB (upload_id: {upload_id})")
         
         return upload_id
@@ -170,6 +175,7 @@ class QuotaManager:
         reservation_data = cache.get(reservation_key)
         
         if not reservation_data:
+            QUOTA_RESERVATIONS.labels('expired').inc()
             raise ValueError(f"Quota reservation not found or expired: {upload_id}")
         
         if reservation_data['user_id'] != user.id:
@@ -179,11 +185,11 @@ class QuotaManager:
         size_mb = size_bytes // (1024 * 1024)
         
         # Update user quota
-        user.used_quota_mb += size_mb
-        user.save(update_fields=['used_quota_mb'])
+        user.adjust_used_quota(size_mb)
         
         # Remove reservation
         cache.delete(reservation_key)
+        QUOTA_RESERVATIONS.labels('confirmed').inc()
         
         logger.info(f"Confirmed quota usage for user {user.id}: {size_mb}MB")
         return size_mb
@@ -193,6 +199,7 @@ class QuotaManager:
         """Cancel quota reservation"""
         reservation_key = f"quota_reservation:{upload_id}"
         cache.delete(reservation_key)
+        QUOTA_RESERVATIONS.labels('cancelled').inc()
         logger.info(f"Cancelled quota reservation: {upload_id}")
     
     @staticmethod
@@ -201,8 +208,7 @@ class QuotaManager:
         Release quota (step 3 - for file deletion)
         """
         size_mb = size_bytes // (1024 * 1024)
-        user.used_quota_mb = max(0, user.used_quota_mb - size_mb)
-        user.save(update_fields=['used_quota_mb'])
+        user.adjust_used_quota(-size_mb)
         
         logger.info(f"Released quota for user {user.id}: {size_mb}MB")
         return size_mb
@@ -12,6 +12,7 @@ import logging
 import requests
 from urllib.parse import quote
 
+from core.audit import record_access
 from scores.models import Score
 from .serializers import (
     FileUploadRequestSerializer,
@@ -168,6 +169,7 @@ class FileDownloadURLView(APIView):
             response_serializer = FileDownloadResponseSerializer(response_data)
             
             logger.info(f"Generated download URL for user {user.id}, score {score_id}, type {file_type}")
+            record_access(request, 'download_url', 'score', score.id, file_type=file_type)
             return Response(response_serializer.data, status=status.HTTP_200_OK)
             
         except Exception as e:
@@ -240,15 +242,17 @@ class UploadConfirmationView(APIView):
             
             # Queue background tasks for PDF processing (asynchronously)
             try:
+                from tasks.ledger import enqueue_once
                 from tasks.pdf_tasks import process_pdf_info, generate_thumbnail
-                process_pdf_info.delay(score.id)
-                generate_thumbnail.delay(score.id, page_number=1)
+                enqueue_once(process_pdf_info, 'pdf_info', score.id, coalesce=False)
+                enqueue_once(generate_thumbnail, 'thumbnail', score.id, coalesce=False, page_number=1)
             except Exception as e:
                 # Log but don't fail the upload
                 import logging
                 logger = logging.getLogger(__name__)
                 logger.warning(f"Failed to queue background tasks for score {score.id}: {e}")
             
+            record_access(request, 'upload', 'score', score.id, size_bytes=score.size_bytes)
             return Response({
                 'message': 'Upload confirmed and score created',
                 'upload_id': upload_id,
@@ -337,6 +341,7 @@ def get_thumbnail(request, thumbnail_key):
 class FileDirectDownloadView(APIView):
     """Direct download of files through Django proxy"""
     permission_classes = [IsAuthenticated]
+    throttle_scope = 'direct_download'
     
     def get(self, request, score_id):
         """Stream file directly through Django"""
@@ -401,6 +406,7 @@ class FileDirectDownloadView(APIView):
                 django_response['Content-Length'] = response.headers['content-length']
             
             logger.info(f"Direct download initiated for user {user.id}, score {score.id}, type {file_type}")
+            record_access(request, 'download', 'score', score.id, file_type=file_type)
             return django_response
             
         except requests.exceptions.RequestException as e:
@@ -0,0 +1,10 @@
+"""
+gunicorn settings for the production web container (read from the working
+directory, /app); the command line in Dockerfile.prod sets bind and workers
+"""
+
+
+def child_exit(server, worker):
+    # Prometheus multiprocess bookkeeping for the exited worker (core.metrics)
+    from core.metrics import mark_process_dead
+    mark_process_dead(worker.pid)
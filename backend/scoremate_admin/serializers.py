@@ -23,9 +23,13 @@ class AdminTaskSerializer(serializers.ModelSerializer):
         model = Task
         fields = (
             'id', 'user', 'user_email', 'score', 'score_title', 'kind', 'status',
-            'try_count', 'celery_task_id', 'error_message', 'created_at', 'updated_at'
+            'try_count', 'celery_task_id', 'error_message', 'progress_done', 'progress_total',
+            'started_at', 'completed_at', 'created_at', 'updated_at'
+        )
+        read_only_fields = (
+            'id', 'created_at', 'updated_at', 'celery_task_id', 'progress_done', 'progress_total',
+            'started_at', 'completed_at'
         )
-        read_only_fields = ('id', 'created_at', 'updated_at', 'celery_task_id')
 
 
 class AdminScoreSerializer(serializers.ModelSerializer):
@@ -2,11 +2,14 @@ from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAdminUser
 from rest_framework.response import Response
-from django.contrib.auth.hashers import make_password
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.filters import SearchFilter, OrderingFilter
+from django.http import Http404, HttpResponse
 
 from core.models import User
+from core.profiling import get_profile, get_profile_stats, list_profiles
+from tasks.jobs import start_failed_task_retry
+from tasks.ledger import RETRYABLE_KINDS, enqueue_once, task_for_kind
 from tasks.models import Task
 from .serializers import AdminUserSerializer, AdminTaskSerializer
 from .serializers import AdminScoreSerializer, AdminSetlistSerializer
@@ -31,8 +34,9 @@ class AdminUserViewSet(viewsets.ModelViewSet):
         new_password = request.data.get('new_password')
         if not new_password:
             return Response({'detail': 'new_password is required'}, status=status.HTTP_400_BAD_REQUEST)
-        user.password = make_password(new_password)
+        user.set_password(new_password)
         user.save(update_fields=['password'])
+        user.revoke_tokens()
         return Response({'detail': 'Password reset successfully'})
 
 
@@ -48,13 +52,42 @@ class AdminTaskViewSet(viewsets.ReadOnlyModelViewSet):
     @action(detail=True, methods=['post'], permission_classes=[IsAdminUser])
     def retry(self, request, pk=None):
         task = self.get_object()
-        # Policy: keep the same row; bump try_count, reset status to PENDING, clear error
-        task.try_count = (task.try_count or 0) + 1
-        task.status = 'PENDING'
-        task.error_message = ''
-        task.save(update_fields=['try_count', 'status', 'error_message', 'updated_at'])
-        # TODO: enqueue celery task based on kind (out of scope for this patch)
-        return Response({'detail': 'Task marked for retry', 'task_id': task.id})
+        entry = task_for_kind(task.kind)
+        if entry is None or task.score_id is None:
+            return Response({'detail': f'Tasks of kind {task.kind} cannot be retried'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        # Keep the same row; the run itself bumps try_count when it starts
+        if not task.is_running:
+            task.status = 'PENDING'
+            task.error_message = ''
+            task.save(update_fields=['status', 'error_message', 'updated_at'])
+        celery_task, kwargs = entry
+        celery_task_id, enqueued = enqueue_once(celery_task, task.kind, task.score_id, coalesce=False, **kwargs)
+        return Response({
+            'detail': 'Task queued for retry' if enqueued else 'Task is already queued or running',
+            'task_id': task.id,
+            'celery_task_id': celery_task_id,
+        })
+
+    @action(detail=False, methods=['post'], permission_classes=[IsAdminUser])
+    def retry_failed(self, request):
+        """Retry every failed task matching the list filters, in rate-limited chunks"""
+        task_ids = list(
+            self.filter_queryset(self.get_queryset())
+            .filter(status='FAILED', kind__in=RETRYABLE_KINDS, score__isnull=False)
+            .order_by('id')
+            .values_list('id', flat=True)
+        )
+        if not task_ids:
+            return Response({'detail': 'No failed tasks match', 'matched': 0, 'chunks': 0})
+
+        chunks = start_failed_task_retry(task_ids)
+        return Response({
+            'detail': f'Retrying {len(task_ids)} failed tasks',
+            'matched': len(task_ids),
+            'chunks': chunks,
+        }, status=status.HTTP_202_ACCEPTED)
 
 
 class AdminScoreViewSet(viewsets.ModelViewSet):
@@ -67,6 +100,12 @@ class AdminScoreViewSet(viewsets.ModelViewSet):
     ordering_fields = ['created_at', 'updated_at', 'pages', 'size_bytes']
     http_method_names = ['get', 'patch', 'delete', 'head', 'options']
 
+    def perform_update(self, serializer):
+        old_pages = serializer.instance.pages
+        score = serializer.save()
+        if score.pages != old_pages:
+            Setlist.objects.recalculate_for_score(score.id)
+
 
 class AdminSetlistViewSet(viewsets.ModelViewSet):
     queryset = Setlist.objects.select_related('user').all()
@@ -75,5 +114,30 @@ class AdminSetlistViewSet(viewsets.ModelViewSet):
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
     filterset_fields = ['user']
     search_fields = ['title', 'description', 'user__email']
-    ordering_fields = ['created_at', 'updated_at']
+    ordering_fields = ['created_at', 'updated_at', 'item_count']
     http_method_names = ['get', 'patch', 'delete', 'head', 'options']
+
+
+class AdminProfileViewSet(viewsets.ViewSet):
+    """Request profiles captured by ProfilingMiddleware"""
+    permission_classes = [IsAdminUser]
+    lookup_value_regex = '[0-9a-f]{32}'
+
+    def list(self, request):
+        return Response(list_profiles())
+
+    def retrieve(self, request, pk=None):
+        profile = get_profile(pk)
+        if profile is None:
+            raise Http404
+        return Response(profile)
+
+    @action(detail=True, methods=['get'], permission_classes=[IsAdminUser])
+    def download(self, request, pk=None):
+        """The raw cProfile data, loadable with pstats or snakeviz"""
+        stats = get_profile_stats(pk)
+        if stats is None:
+            raise Http404
+        response = HttpResponse(stats, content_type='application/octet-stream')
+        response['Content-Disposition'] = f'attachment; filename="profile-{pk}.prof"'
+        return response
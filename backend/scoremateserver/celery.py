@@ -3,6 +3,8 @@ Celery configuration for ScoreMateServer
 """
 import os
 from celery import Celery
+from celery.schedules import crontab
+from kombu import Queue
 from django.conf import settings
 
 # Set the default Django settings module for the 'celery' program.
@@ -31,11 +33,42 @@ def debug_task(self):
     print(f'Request: {self.request!r}')
 
 
-# Task routing disabled for now - all tasks go to default 'celery' queue
-# app.conf.task_routes = {
-#     'tasks.pdf_tasks.*': {'queue': 'pdf_processing'},
-#     'tasks.file_tasks.*': {'queue': 'file_operations'},
-# }
+# Named queues, each consumed by its own worker profile (see docker-compose):
+# - ingest-interactive: processing of fresh uploads, latency sensitive
+# - render-bulk: bulk and all-page rendering, throughput oriented
+# - storage-io: S3 deletes and other network-bound storage calls
+# - maintenance: periodic cleanup and anything not routed explicitly
+QUEUE_INGEST = 'ingest-interactive'
+QUEUE_RENDER_BULK = 'render-bulk'
+QUEUE_STORAGE = 'storage-io'
+QUEUE_MAINTENANCE = 'maintenance'
+
+app.conf.task_queues = [
+    Queue(QUEUE_INGEST),
+    Queue(QUEUE_RENDER_BULK),
+    Queue(QUEUE_STORAGE),
+    Queue(QUEUE_MAINTENANCE),
+]
+app.conf.task_default_queue = QUEUE_MAINTENANCE
+
+app.conf.task_routes = {
+    'tasks.pdf_tasks.process_pdf_info': {'queue': QUEUE_INGEST},
+    'tasks.pdf_tasks.generate_thumbnail': {'queue': QUEUE_INGEST},
+    'tasks.pdf_tasks.generate_all_page_thumbnails': {'queue': QUEUE_RENDER_BULK},
+    'tasks.pdf_tasks.regenerate_thumbnails_chunk': {'queue': QUEUE_RENDER_BULK},
+    'tasks.pdf_tasks.retry_tasks_chunk': {'queue': QUEUE_MAINTENANCE},
+    'tasks.file_tasks.delete_score_files': {'queue': QUEUE_STORAGE},
+    'tasks.file_tasks.delete_single_file': {'queue': QUEUE_STORAGE},
+    'tasks.file_tasks.cleanup_*': {'queue': QUEUE_MAINTENANCE},
+}
+
+# Periodic maintenance, run by the `beat` service
+app.conf.beat_schedule = {
+    'access-log-partitions': {
+        'task': 'tasks.file_tasks.cleanup_access_log_partitions',
+        'schedule': crontab(hour=3, minute=0),
+    },
+}
 
 # Task result expires after 1 hour
 app.conf.result_expires = 3600
@@ -72,6 +72,8 @@ MIDDLEWARE = [
     # Custom middleware
     'core.middleware.SecurityHeadersMiddleware',
     'core.middleware.APILoggingMiddleware',
+    'core.middleware.ProfilingMiddleware',
+    'core.middleware.RateLimitingMiddleware',
     'core.middleware.QuotaCheckMiddleware',
 ]
 
@@ -157,7 +159,7 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # REST Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'core.authentication.CachedJWTAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
@@ -170,13 +172,9 @@ REST_FRAMEWORK = {
         'rest_framework.filters.OrderingFilter',
     ],
     'DEFAULT_THROTTLE_CLASSES': [
-        'rest_framework.throttling.AnonRateThrottle',
-        'rest_framework.throttling.UserRateThrottle'
+        'core.throttling.PlanRateThrottle',
+        'core.throttling.ScopedPlanThrottle',
     ],
-    'DEFAULT_THROTTLE_RATES': {
-        'anon': '100/hour',
-        'user': '1000/hour'
-    },
     'DEFAULT_RENDERER_CLASSES': [
         'rest_framework.renderers.JSONRenderer',
     ],
@@ -188,6 +186,32 @@ REST_FRAMEWORK = {
     'EXCEPTION_HANDLER': 'core.exceptions.custom_exception_handler',
 }
 
+# Throttle budgets per scope and plan as (burst, sustained); see core.throttling.
+# 'user' applies to every request, the other scopes to views with that throttle_scope
+THROTTLE_PLAN_RATES = {
+    'user': {
+        'anon': ('30/min', '100/hour'),
+        'solo': ('120/min', '1000/hour'),
+        'pro': ('300/min', '5000/hour'),
+        'enterprise': ('600/min', '20000/hour'),
+    },
+    'statistics': {
+        'solo': ('10/min', '100/hour'),
+        'pro': ('30/min', '500/hour'),
+        'enterprise': ('60/min', '2000/hour'),
+    },
+    'bulk_thumbnails': {
+        'solo': ('5/min', '30/hour'),
+        'pro': ('10/min', '100/hour'),
+        'enterprise': ('20/min', '400/hour'),
+    },
+    'direct_download': {
+        'solo': ('10/min', '200/hour'),
+        'pro': ('30/min', '1000/hour'),
+        'enterprise': ('60/min', '5000/hour'),
+    },
+}
+
 # Simple JWT settings
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),
@@ -223,6 +247,12 @@ SIMPLE_JWT = {
 # Custom User Model
 AUTH_USER_MODEL = 'core.User'
 
+# Authenticated user lookups (core.authentication): shared cache entry lifetime,
+# plus a short-lived per-process LRU in front of it
+USER_CACHE_TIMEOUT = int(os.environ.get('USER_CACHE_TIMEOUT', 300))
+USER_CACHE_LOCAL_TTL = int(os.environ.get('USER_CACHE_LOCAL_TTL', 5))
+USER_CACHE_LOCAL_SIZE = int(os.environ.get('USER_CACHE_LOCAL_SIZE', 1024))
+
 # Storage settings (for S3/MinIO)
 STORAGE_ENDPOINT = os.environ.get('STORAGE_ENDPOINT')
 STORAGE_PUBLIC_ENDPOINT = os.environ.get('STORAGE_PUBLIC_ENDPOINT', STORAGE_ENDPOINT)
@@ -236,10 +266,33 @@ MAX_UPLOAD_SIZE = int(os.environ.get('MAX_UPLOAD_MB', 100)) * 1024 * 1024  # Con
 ALLOWED_MIME_TYPES = os.environ.get('ALLOWED_MIME', 'application/pdf').split(',')
 PRESIGNED_URL_EXPIRY = int(os.environ.get('PRESIGNED_URL_EXPIRY', 300))  # 5 minutes
 
+# Bulk operation settings
+BULK_METADATA_MAX_IDS = int(os.environ.get('BULK_METADATA_MAX_IDS', 5000))
+
 # Quota and Referral settings
 MAX_UPLOAD_MB = int(os.environ.get('MAX_UPLOAD_MB', 200))
 REFERRAL_BONUS_MB = int(os.environ.get('REFERRAL_BONUS_MB', 50))
 
+# Cache settings
+# Redis is shared by all web workers; fall back to local memory when REDIS_URL is not set (tests, local runs)
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ.get('REDIS_CACHE_URL', os.environ['REDIS_URL']),
+            'KEY_PREFIX': 'scoremate',
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Per-user aggregate caches (statistics, dashboard)
+AGGREGATE_CACHE_TIMEOUT = int(os.environ.get('AGGREGATE_CACHE_TIMEOUT', 600))  # 10 minutes
+
 # Celery settings (basic setup, more advanced config will be in tasks app)
 CELERY_BROKER_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
 CELERY_RESULT_BACKEND = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
@@ -248,6 +301,82 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'Asia/Seoul'
 
+# Worker tuning; each worker profile in docker-compose overrides these per queue
+CELERY_WORKER_PREFETCH_MULTIPLIER = int(os.environ.get('CELERY_WORKER_PREFETCH_MULTIPLIER', 1))
+CELERY_WORKER_MAX_TASKS_PER_CHILD = int(os.environ.get('CELERY_WORKER_MAX_TASKS_PER_CHILD', 1000))
+if os.environ.get('CELERY_WORKER_CONCURRENCY'):
+    CELERY_WORKER_CONCURRENCY = int(os.environ['CELERY_WORKER_CONCURRENCY'])
+
+# Pipeline enqueue deduplication: a (score, kind) run is queued at most once;
+# requests within the coalesce window share one delayed execution
+TASK_COALESCE_SECONDS = int(os.environ.get('TASK_COALESCE_SECONDS', 3))
+TASK_DEDUP_TIMEOUT = int(os.environ.get('TASK_DEDUP_TIMEOUT', 60 * 30))  # 30 minutes
+
+# Admin bulk retry: failed tasks re-enqueued per chunk, and seconds between chunks
+TASK_RETRY_CHUNK_SIZE = int(os.environ.get('TASK_RETRY_CHUNK_SIZE', 100))
+TASK_RETRY_CHUNK_INTERVAL = int(os.environ.get('TASK_RETRY_CHUNK_INTERVAL', 10))
+
+# Thumbnail rendering: page zoom before downscaling to 300x400, and JPEG quality
+THUMBNAIL_RENDER_ZOOM = float(os.environ.get('THUMBNAIL_RENDER_ZOOM', 2))
+THUMBNAIL_JPEG_QUALITY = int(os.environ.get('THUMBNAIL_JPEG_QUALITY', 85))
+
+# Bulk thumbnail regeneration: scores per chunk task, and the most chunks of
+# one user's job that may run at the same time
+BULK_THUMBNAIL_CHUNK_SIZE = int(os.environ.get('BULK_THUMBNAIL_CHUNK_SIZE', 50))
+BULK_THUMBNAIL_USER_CONCURRENCY = int(os.environ.get('BULK_THUMBNAIL_USER_CONCURRENCY', 2))
+# A bulk job without progress for this long is abandoned (a chunk died with
+# its worker) and no longer blocks a new job for the user
+BULK_JOB_STALL_TIMEOUT = int(os.environ.get('BULK_JOB_STALL_TIMEOUT', 60 * 60))
+
+# Shared rate limiting (core.ratelimit): first matching path prefix wins;
+# counted per user id for bearer tokens, per IP address otherwise
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'True').lower() == 'true'
+RATE_LIMIT_REDIS_URL = os.environ.get('REDIS_URL')
+# Reverse proxies in front of Django that append to X-Forwarded-For (nginx: 1).
+# The client address is the entry the outermost of them added; anything to
+# its left is client-supplied. 0 uses REMOTE_ADDR only.
+RATE_LIMIT_TRUSTED_PROXIES = int(os.environ.get('RATE_LIMIT_TRUSTED_PROXIES', 1))
+RATE_LIMITS = [
+    # (scope, path prefix, rate)
+    ('upload-url', '/api/v1/files/upload-url/', os.environ.get('RATE_LIMIT_UPLOAD_URL', '30/m')),
+    ('auth', '/api/v1/auth/', os.environ.get('RATE_LIMIT_AUTH', '20/m')),
+    ('api', '/api/', os.environ.get('RATE_LIMIT_API', '600/m')),
+]
+
+# Live events (SSE): pipeline tasks publish per-user events to Redis pub/sub;
+# publishing is disabled and the stream returns 503 when REDIS_URL is not set
+EVENTS_REDIS_URL = os.environ.get('REDIS_URL')
+EVENTS_KEEPALIVE_SECONDS = int(os.environ.get('EVENTS_KEEPALIVE_SECONDS', 15))
+EVENTS_RETRY_MS = int(os.environ.get('EVENTS_RETRY_MS', 5000))
+EVENTS_TICKET_TTL = int(os.environ.get('EVENTS_TICKET_TTL', 30))  # seconds to open the stream
+
+# Share of successful GET/HEAD requests written to the access log (1.0 = all);
+# other methods and non-2xx responses are always logged
+ACCESS_LOG_SAMPLE_RATE = float(os.environ.get('ACCESS_LOG_SAMPLE_RATE', 1.0))
+
+# Prometheus metrics (core.metrics) at /metrics, scraped with this bearer token;
+# the endpoint is disabled when unset. Set PROMETHEUS_MULTIPROC_DIR (an empty
+# directory shared by web and worker containers) to aggregate all processes
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+# Staff request profiling (core.profiling): profiles are kept in the cache for
+# PROFILE_TTL seconds, at most PROFILE_MAX_STORED of them listed in the admin API
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', 'True').lower() == 'true'
+PROFILE_TTL = int(os.environ.get('PROFILE_TTL', 60 * 60 * 24))
+PROFILE_MAX_STORED = int(os.environ.get('PROFILE_MAX_STORED', 100))
+PROFILE_TOP_FUNCTIONS = int(os.environ.get('PROFILE_TOP_FUNCTIONS', 60))
+
+# Audit trail (core.audit): events are buffered per process and written to
+# access_logs in batches; when the buffer is full new events are dropped.
+# Monthly partitions are created ahead and dropped after the retention period
+AUDIT_LOG_ENABLED = os.environ.get('AUDIT_LOG_ENABLED', 'True').lower() == 'true'
+AUDIT_BACKGROUND_FLUSH = os.environ.get('AUDIT_BACKGROUND_FLUSH', 'True').lower() == 'true'
+AUDIT_BUFFER_SIZE = int(os.environ.get('AUDIT_BUFFER_SIZE', 10000))
+AUDIT_BATCH_SIZE = int(os.environ.get('AUDIT_BATCH_SIZE', 500))
+AUDIT_FLUSH_INTERVAL = float(os.environ.get('AUDIT_FLUSH_INTERVAL', 2.0))
+AUDIT_PARTITIONS_AHEAD = int(os.environ.get('AUDIT_PARTITIONS_AHEAD', 2))
+AUDIT_RETENTION_MONTHS = int(os.environ.get('AUDIT_RETENTION_MONTHS', 6))
+
 # Logging configuration
 LOGGING = {
     'version': 1,
@@ -283,6 +412,12 @@ LOGGING = {
             'filename': BASE_DIR.parent / 'logs' / 'error.log',
             'formatter': 'verbose',
         },
+        # JSON access log, formatted and written by a background QueueListener
+        'access': {
+            'level': 'INFO',
+            'class': 'core.access_log.QueueAccessHandler',
+            'filename': BASE_DIR.parent / 'logs' / 'access.log',
+        },
     },
     'root': {
         'handlers': ['console', 'file'],
@@ -299,6 +434,11 @@ LOGGING = {
             'level': 'DEBUG' if DEBUG else 'INFO',
             'propagate': False,
         },
+        'core.access': {
+            'handlers': ['access'],
+            'level': 'INFO',
+            'propagate': False,
+        },
         'scores': {
             'handlers': ['console', 'file'],
             'level': 'DEBUG' if DEBUG else 'INFO',
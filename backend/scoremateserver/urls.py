@@ -5,6 +5,8 @@ from django.contrib import admin
 from django.urls import path, include
 from django.http import JsonResponse
 
+from core.views import metrics
+
 
 def api_root(request):
     """API root endpoint"""
@@ -17,6 +19,7 @@ def api_root(request):
             'files': '/api/v1/files/',
             'user': '/api/v1/user/',
             'dashboard': '/api/v1/dashboard/',
+            'events': '/api/v1/events/',
             'admin': '/admin/',
         }
     })
@@ -32,8 +35,12 @@ urlpatterns = [
     path('api/v1/', include('scores.urls')),
     path('api/v1/', include('setlists.urls')),
     path('api/v1/', include('files.urls')),
+    path('api/v1/', include('tasks.urls')),
     path('api/v1/admin/', include('scoremate_admin.urls')),
     
+    # Prometheus scrape endpoint (bearer METRICS_TOKEN)
+    path('metrics', metrics, name='metrics'),
+    
     # Default redirect to API
     path('', api_root, name='root'),
 ]
@@ -1,9 +1,41 @@
-from django.db import models
+from django.db import models, connection
 from django.conf import settings
 from django.contrib.postgres.fields import ArrayField
 import hashlib
 
 
+class ScoreQuerySet(models.QuerySet):
+    """QuerySet helpers for set-based score updates"""
+    
+    def _update_tags(self, assignment, params):
+        """
+        Run one UPDATE setting tags over this queryset and return the updated ids;
+        updated_at is bumped as a save() would, since auto_now doesn't apply to raw SQL
+        """
+        subquery, subquery_params = self.order_by().values('id').query.sql_with_params()
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {table} SET tags = {assignment}, updated_at = now() WHERE id IN ({subquery}) RETURNING id",
+                [*params, *subquery_params]
+            )
+            return [row[0] for row in cursor.fetchall()]
+    
+    def add_tags(self, tags):
+        """Append tags to every score missing any of them, keeping existing order"""
+        return self.exclude(tags__contains=tags)._update_tags(
+            "tags || ARRAY(SELECT tag FROM unnest(%s::varchar(50)[]) AS tag WHERE tag <> ALL(tags))",
+            [list(tags)]
+        )
+    
+    def remove_tags(self, tags):
+        """Remove tags from every score carrying any of them"""
+        assignment = 'tags'
+        for _ in tags:
+            assignment = f'array_remove({assignment}, %s::varchar(50))'
+        return self.filter(tags__overlap=tags)._update_tags(assignment, list(tags))
+
+
 class Score(models.Model):
     """Sheet music score metadata and storage information"""
     user = models.ForeignKey(
@@ -39,6 +71,8 @@ class Score(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = ScoreQuerySet.as_manager()
+    
     class Meta:
         db_table = 'scores'
         ordering = ['-created_at']
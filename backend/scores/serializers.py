@@ -1,6 +1,7 @@
 """
 Serializers for scores app
 """
+from django.conf import settings
 from rest_framework import serializers
 from .models import Score
 
@@ -154,22 +155,60 @@ class ScoreCreateSerializer(serializers.ModelSerializer):
         
         # Update user quota
         size_mb = size_bytes // (1024 * 1024)
-        user.used_quota_mb += size_mb
-        user.save(update_fields=['used_quota_mb'])
+        user.adjust_used_quota(size_mb)
         
         # Trigger background tasks for PDF processing (asynchronously)
         try:
+            from tasks.ledger import enqueue_once
             from tasks.pdf_tasks import process_pdf_info, generate_thumbnail
             
             # Start PDF info extraction asynchronously
-            process_pdf_info.delay(score.id)
+            enqueue_once(process_pdf_info, 'pdf_info', score.id, coalesce=False)
             
             # Generate cover thumbnail asynchronously  
-            generate_thumbnail.delay(score.id, page_number=1)
+            enqueue_once(generate_thumbnail, 'thumbnail', score.id, coalesce=False, page_number=1)
         except Exception as e:
             # Log the error but don't fail the score creation
             import logging
             logger = logging.getLogger(__name__)
             logger.warning(f"Failed to queue background tasks for score {score.id}: {e}")
         
-        return score
\ No newline at end of file
+        return score
+
+
+class ScoreMetadataSerializer(serializers.Serializer):
+    """Metadata fields that can be applied to many scores at once"""
+    composer = serializers.CharField(max_length=255, required=False, allow_blank=True)
+    instrumentation = serializers.CharField(max_length=255, required=False, allow_blank=True)
+    note = serializers.CharField(required=False, allow_blank=True)
+    tags = serializers.ListField(
+        child=serializers.CharField(max_length=50),
+        required=False
+    )
+    
+    def validate(self, data):
+        """Keep only non-empty fields; at least one is required"""
+        fields = {name: value for name, value in data.items() if value not in ('', [])}
+        if 'tags' in fields:
+            fields['tags'] = list(dict.fromkeys(fields['tags']))
+        if not fields:
+            raise serializers.ValidationError(
+                "Provide at least one of composer, instrumentation, note or tags"
+            )
+        return fields
+
+
+class ScoreBulkMetadataSerializer(serializers.Serializer):
+    """Serializer for bulk metadata update requests"""
+    score_ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False
+    )
+    metadata = ScoreMetadataSerializer()
+    
+    def validate_score_ids(self, value):
+        """Limit batch size and drop repeated ids"""
+        max_ids = settings.BULK_METADATA_MAX_IDS
+        if len(value) > max_ids:
+            raise serializers.ValidationError(f"At most {max_ids} scores can be updated at once")
+        return list(dict.fromkeys(value))
@@ -0,0 +1,14 @@
+"""
+Signal handlers for scores app
+"""
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from core.cache import invalidate_user_cache
+from .models import Score
+
+
+@receiver([post_save, post_delete], sender=Score)
+def invalidate_score_caches(sender, instance, **kwargs):
+    """Invalidate cached per-user score aggregates on any score mutation"""
+    invalidate_user_cache('scores', instance.user_id)
@@ -0,0 +1,85 @@
+"""
+Aggregate statistics for a user's score library
+"""
+from django.db import connection
+
+from .models import Score
+
+
+TOP_N = 10
+
+# One round trip: conditional aggregates with FILTER plus JSON sub-selects
+# for the top composers and tags over the same user-scoped CTE.
+STATISTICS_SQL = """
+WITH user_scores AS (
+    SELECT composer, pages, size_bytes, thumbnail_key, tags
+    FROM {table}
+    WHERE user_id = %(user_id)s
+)
+SELECT
+    COUNT(*) AS total_scores,
+    COUNT(*) FILTER (WHERE pages IS NOT NULL AND pages <> 0) AS scores_with_pages,
+    COUNT(*) FILTER (WHERE thumbnail_key IS NOT NULL AND thumbnail_key <> '') AS scores_with_thumbnails,
+    COALESCE(SUM(size_bytes), 0) AS total_size_bytes,
+    COALESCE(AVG(size_bytes), 0) AS avg_size_bytes,
+    COALESCE(SUM(pages) FILTER (WHERE pages <> 0), 0) AS total_pages,
+    COALESCE(AVG(pages) FILTER (WHERE pages <> 0), 0) AS avg_pages,
+    (
+        SELECT COALESCE(json_agg(c ORDER BY c.count DESC, c.composer), '[]'::json)
+        FROM (
+            SELECT composer, COUNT(*) AS count
+            FROM user_scores
+            WHERE composer IS NOT NULL AND composer <> ''
+            GROUP BY composer
+            ORDER BY count DESC, composer
+            LIMIT %(top_n)s
+        ) c
+    ) AS top_composers,
+    (
+        SELECT COALESCE(json_agg(t ORDER BY t.count DESC, t.tag), '[]'::json)
+        FROM (
+            SELECT tag, COUNT(*) AS count
+            FROM user_scores, unnest(tags) AS tag
+            GROUP BY tag
+            ORDER BY count DESC, tag
+            LIMIT %(top_n)s
+        ) t
+    ) AS top_tags
+FROM user_scores
+"""
+
+
+def compute_score_statistics(user_id):
+    """Compute the statistics payload for a user's scores in a single query"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            STATISTICS_SQL.format(table=connection.ops.quote_name(Score._meta.db_table)),
+            {'user_id': user_id, 'top_n': TOP_N}
+        )
+        (
+            total_scores, scores_with_pages, scores_with_thumbnails,
+            total_size_bytes, avg_size_bytes, total_pages, avg_pages,
+            top_composers, top_tags
+        ) = cursor.fetchone()
+
+    return {
+        'total_scores': total_scores,
+        'scores_with_pages': scores_with_pages,
+        'scores_with_thumbnails': scores_with_thumbnails,
+        'size_statistics': {
+            'total_size_mb': round(total_size_bytes / (1024 * 1024), 2),
+            'average_size_mb': round(float(avg_size_bytes) / (1024 * 1024), 2),
+        },
+        'page_statistics': {
+            'total_pages': total_pages,
+            'average_pages': round(float(avg_pages), 1),
+        },
+        'top_composers': [
+            {'composer': item['composer'], 'count': item['count']}
+            for item in top_composers
+        ],
+        'top_tags': [
+            {'tag': item['tag'], 'count': item['count']}
+            for item in top_tags
+        ]
+    }
@@ -6,17 +6,49 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from django_filters.rest_framework import DjangoFilterBackend
-from django.db.models import F, Count, Sum, Avg, Q
+from django.db.models import Q, Count
 from django.db import transaction
-from django.contrib.postgres.aggregates import ArrayAgg
+from django.utils import timezone
 
+from core.audit import record_access
+from core.cache import (
+    get_cache_version, get_or_set_user_cache, etag_for_version, etag_matches, invalidate_user_cache
+)
 from .models import Score
 from .serializers import (
     ScoreSerializer, 
     ScoreListSerializer, 
-    ScoreCreateSerializer
+    ScoreCreateSerializer,
+    ScoreBulkMetadataSerializer
 )
 from .filters import ScoreFilter, ScoreOrderingFilter
+from .statistics import compute_score_statistics
+
+
+TAG_MAX_LENGTH = 50
+
+
+def _list_param(data, key):
+    """Read a list from JSON or form-encoded request data"""
+    if hasattr(data, 'getlist'):
+        return data.getlist(key)
+    return data.get(key) or []
+
+
+def _clean_tags(tags):
+    """Strip, validate and de-duplicate a list of tags, keeping their order"""
+    if not isinstance(tags, list):
+        raise ValueError('Tags must be a list')
+    cleaned = []
+    for tag in tags:
+        if not isinstance(tag, str) or not tag.strip():
+            raise ValueError('Tags must be non-empty strings')
+        tag = tag.strip()
+        if len(tag) > TAG_MAX_LENGTH:
+            raise ValueError(f'Tags must be at most {TAG_MAX_LENGTH} characters')
+        if tag not in cleaned:
+            cleaned.append(tag)
+    return cleaned
 
 
 class ScoreViewSet(viewsets.ModelViewSet):
@@ -26,6 +58,7 @@ class ScoreViewSet(viewsets.ModelViewSet):
     filterset_class = ScoreFilter
     ordering_fields = ['created_at', 'updated_at', 'title', 'composer', 'size_mb', 'pages']
     ordering = ['-updated_at']
+    throttle_scope = None  # Set per action for heavy endpoints (see ScopedPlanThrottle)
     
     def get_queryset(self):
         """Return scores for the current user only"""
@@ -39,6 +72,15 @@ class ScoreViewSet(viewsets.ModelViewSet):
             return ScoreCreateSerializer
         return ScoreSerializer
     
+    def perform_update(self, serializer):
+        """Save score and propagate page count changes to setlist totals"""
+        old_pages = serializer.instance.pages
+        score = serializer.save()
+        
+        if score.pages != old_pages:
+            from setlists.models import Setlist
+            Setlist.objects.recalculate_for_score(score.id)
+    
     def destroy(self, request, *args, **kwargs):
         """Delete score and update user quota"""
         score = self.get_object()
@@ -50,8 +92,7 @@ class ScoreViewSet(viewsets.ModelViewSet):
         score_id = score.id
         
         # Update user quota before deleting
-        request.user.used_quota_mb = F('used_quota_mb') - size_mb
-        request.user.save(update_fields=['used_quota_mb'])
+        request.user.adjust_used_quota(-size_mb)
         
         # Delete the score record first
         response = super().destroy(request, *args, **kwargs)
@@ -60,6 +101,7 @@ class ScoreViewSet(viewsets.ModelViewSet):
         from tasks.file_tasks import delete_score_files
         delete_score_files.delay(s3_key, thumbnail_key, score_id)
         
+        record_access(request, 'delete', 'score', score_id, size_bytes=score.size_bytes)
         return response
     
     @action(detail=True, methods=['post'])
@@ -68,13 +110,15 @@ class ScoreViewSet(viewsets.ModelViewSet):
         score = self.get_object()
         
         # Trigger thumbnail regeneration task
+        from tasks.ledger import enqueue_once
         from tasks.pdf_tasks import generate_thumbnail
-        task = generate_thumbnail.delay(score.id, page_number=1)
+        task_id, enqueued = enqueue_once(generate_thumbnail, 'thumbnail', score.id, page_number=1)
         
         return Response({
-            'message': 'Thumbnail regeneration started',
+            'message': 'Thumbnail regeneration started' if enqueued else 'Thumbnail regeneration already queued',
             'score_id': score.id,
-            'task_id': task.id
+            'task_id': task_id,
+            'deduplicated': not enqueued
         }, status=status.HTTP_202_ACCEPTED)
     
     @action(detail=True, methods=['post'])
@@ -83,13 +127,15 @@ class ScoreViewSet(viewsets.ModelViewSet):
         score = self.get_object()
         
         # Trigger PDF info extraction task
+        from tasks.ledger import enqueue_once
         from tasks.pdf_tasks import process_pdf_info
-        task = process_pdf_info.delay(score.id)
+        task_id, enqueued = enqueue_once(process_pdf_info, 'pdf_info', score.id)
         
         return Response({
-            'message': 'PDF info refresh started',
+            'message': 'PDF info refresh started' if enqueued else 'PDF info refresh already queued',
             'score_id': score.id,
-            'task_id': task.id
+            'task_id': task_id,
+            'deduplicated': not enqueued
         }, status=status.HTTP_202_ACCEPTED)
     
     @action(detail=True, methods=['post'])
@@ -98,156 +144,170 @@ class ScoreViewSet(viewsets.ModelViewSet):
         score = self.get_object()
         
         # Trigger all page thumbnails generation
+        from tasks.ledger import enqueue_once
         from tasks.pdf_tasks import generate_all_page_thumbnails
-        task = generate_all_page_thumbnails.delay(score.id)
+        task_id, enqueued = enqueue_once(generate_all_page_thumbnails, 'page_thumbnails', score.id)
         
         return Response({
-            'message': 'All page thumbnails generation started',
+            'message': 'All page thumbnails generation started' if enqueued else 'All page thumbnails generation already queued',
             'score_id': score.id,
-            'task_id': task.id
+            'task_id': task_id,
+            'deduplicated': not enqueued
         }, status=status.HTTP_202_ACCEPTED)
     
-    @action(detail=False, methods=['get'])
-    def statistics(self, request):
-        """Get statistics about user's scores"""
-        queryset = self.get_queryset()
-        
-        # Basic counts
-        total_scores = queryset.count()
-        scores_with_pages = queryset.exclude(Q(pages__isnull=True) | Q(pages=0)).count()
-        scores_with_thumbnails = queryset.exclude(Q(thumbnail_key__isnull=True) | Q(thumbnail_key='')).count()
-        
-        # Size statistics
-        size_stats = queryset.aggregate(
-            total_size_bytes=Sum('size_bytes'),
-            avg_size_bytes=Avg('size_bytes'),
-            total_size_mb=Sum('size_bytes') / (1024 * 1024) if queryset.exists() else 0
-        )
+    @action(detail=True, methods=['get'])
+    def tasks(self, request, pk=None):
+        """Get the status of every pipeline task for a score"""
+        from tasks.models import Task
+        from tasks.serializers import TaskSerializer
         
-        # Page statistics
-        page_stats = queryset.exclude(Q(pages__isnull=True) | Q(pages=0)).aggregate(
-            total_pages=Sum('pages'),
-            avg_pages=Avg('pages')
-        )
-        
-        # Composer statistics (top 10)
-        composer_stats = queryset.exclude(Q(composer__isnull=True) | Q(composer='')).values('composer').annotate(
-            count=Count('composer')
-        ).order_by('-count')[:10]
-        
-        # Tag statistics (all unique tags)
-        all_tags = queryset.exclude(Q(tags__isnull=True) | Q(tags=[])).aggregate(
-            unique_tags=ArrayAgg('tags', distinct=True)
-        )
-        
-        # Flatten and count tags
-        tag_counts = {}
-        if all_tags['unique_tags']:
-            flat_tags = []
-            for tag_list in all_tags['unique_tags']:
-                if tag_list:
-                    flat_tags.extend(tag_list)
-            
-            for tag in flat_tags:
-                tag_counts[tag] = tag_counts.get(tag, 0) + 1
+        score = self.get_object()
+        tasks = Task.objects.filter(score=score).order_by('kind')
+        return Response(TaskSerializer(tasks, many=True).data)
+    
+    @action(detail=False, methods=['get'], throttle_scope='statistics')
+    def statistics(self, request):
+        """Get statistics about user's scores (cached per user, revalidated by ETag)"""
+        user_id = request.user.id
+        version = get_cache_version('scores', user_id)
+        etag = etag_for_version('scores', user_id, version)
         
-        # Sort tags by count
-        top_tags = sorted(tag_counts.items(), key=lambda x: x[1], reverse=True)[:10]
+        if etag_matches(request, etag):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            data = get_or_set_user_cache(
+                'scores', user_id, 'score_statistics',
+                lambda: compute_score_statistics(user_id),
+                version=version
+            )
+            response = Response(data)
         
-        return Response({
-            'total_scores': total_scores,
-            'scores_with_pages': scores_with_pages,
-            'scores_with_thumbnails': scores_with_thumbnails,
-            'size_statistics': {
-                'total_size_mb': round(size_stats['total_size_mb'] or 0, 2),
-                'average_size_mb': round((size_stats['avg_size_bytes'] or 0) / (1024 * 1024), 2),
-            },
-            'page_statistics': {
-                'total_pages': page_stats['total_pages'] or 0,
-                'average_pages': round(page_stats['avg_pages'] or 0, 1),
-            },
-            'top_composers': [
-                {'composer': item['composer'], 'count': item['count']} 
-                for item in composer_stats
-            ],
-            'top_tags': [
-                {'tag': tag, 'count': count} 
-                for tag, count in top_tags
-            ]
-        })
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
+        return response
     
     @action(detail=False, methods=['post'])
     def bulk_tag(self, request):
         """Add or remove tags from multiple scores"""
-        score_ids = request.data.get('score_ids', [])
-        tags_to_add = request.data.get('add_tags', [])
-        tags_to_remove = request.data.get('remove_tags', [])
+        score_ids = _list_param(request.data, 'score_ids')
+        tags_to_add = _list_param(request.data, 'add_tags')
+        tags_to_remove = _list_param(request.data, 'remove_tags')
         
-        if not score_ids:
+        if not score_ids or not isinstance(score_ids, list):
             return Response({'error': 'score_ids is required'}, status=status.HTTP_400_BAD_REQUEST)
         
+        try:
+            tags_to_add = _clean_tags(tags_to_add)
+            tags_to_remove = _clean_tags(tags_to_remove)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
         # Get user's scores only
         scores = self.get_queryset().filter(id__in=score_ids)
         
-        if not scores.exists():
+        # One UPDATE per operation, touching only rows whose tags actually change
+        added_ids, removed_ids = [], []
+        with transaction.atomic():
+            if tags_to_remove:
+                removed_ids = scores.remove_tags(tags_to_remove)
+            if tags_to_add:
+                added_ids = scores.add_tags(tags_to_add)
+        
+        updated_count = len(set(added_ids) | set(removed_ids))
+        if not updated_count and not scores.exists():
             return Response({'error': 'No valid scores found'}, status=status.HTTP_404_NOT_FOUND)
         
-        updated_count = 0
-        with transaction.atomic():
-            for score in scores:
-                current_tags = set(score.tags or [])
-                modified = False
-                
-                # Add tags
-                if tags_to_add:
-                    for tag in tags_to_add:
-                        if tag not in current_tags:
-                            current_tags.add(tag)
-                            modified = True
-                
-                # Remove tags
-                if tags_to_remove:
-                    for tag in tags_to_remove:
-                        if tag in current_tags:
-                            current_tags.discard(tag)
-                            modified = True
-                
-                if modified:
-                    score.tags = list(current_tags)
-                    score.save(update_fields=['tags'])
-                    updated_count += 1
+        if updated_count:
+            # Queryset updates bypass the post_save signal that keeps tag statistics fresh
+            invalidate_user_cache('scores', request.user.id)
         
         return Response({
             'message': f'Updated tags for {updated_count} scores',
             'updated_scores': updated_count,
+            'added_count': len(added_ids),
+            'removed_count': len(removed_ids),
             'total_scores': len(score_ids)
         })
     
     @action(detail=False, methods=['post'])
+    def bulk_metadata(self, request):
+        """Apply the same metadata to multiple scores with a single UPDATE"""
+        serializer = ScoreBulkMetadataSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        score_ids = serializer.validated_data['score_ids']
+        fields = serializer.validated_data['metadata']
+        scores = self.get_queryset().filter(id__in=score_ids)
+        
+        # One aggregate checks ownership and counts how many rows each field changes
+        counts = scores.aggregate(
+            owned=Count('id'),
+            **{
+                f'{name}_changed': Count('id', filter=~Q(**{name: value}))
+                for name, value in fields.items()
+            }
+        )
+        if counts['owned'] != len(score_ids):
+            missing_ids = sorted(set(score_ids) - set(scores.values_list('id', flat=True)))
+            return Response(
+                {'error': f'Scores not found: {missing_ids}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        updated_count = scores.update(**fields, updated_at=timezone.now())
+        # Queryset updates bypass the post_save signal that invalidates score caches
+        invalidate_user_cache('scores', request.user.id)
+        
+        return Response({
+            'success': True,
+            'updated_scores': updated_count,
+            'total_scores': len(score_ids),
+            'updated_fields': {name: counts[f'{name}_changed'] for name in fields},
+            'message': f'Successfully updated metadata for {updated_count} scores'
+        })
+    
+    @action(detail=False, methods=['post'], throttle_scope='bulk_thumbnails')
     def bulk_regenerate_thumbnails(self, request):
-        """Regenerate thumbnails for multiple scores"""
-        score_ids = request.data.get('score_ids', [])
+        """Regenerate thumbnails for multiple scores as one chunked background job"""
+        from tasks.jobs import start_thumbnail_regeneration, JobInProgress
         
-        if not score_ids:
-            # If no specific IDs, regenerate for all user's scores
-            scores = self.get_queryset()
-        else:
-            scores = self.get_queryset().filter(id__in=score_ids)
+        score_ids = _list_param(request.data, 'score_ids')
+        if not isinstance(score_ids, list):
+            return Response({'error': 'score_ids must be a list'}, status=status.HTTP_400_BAD_REQUEST)
         
-        if not scores.exists():
-            return Response({'error': 'No scores found'}, status=status.HTTP_404_NOT_FOUND)
+        # If no specific IDs, regenerate for all user's scores
+        scores = self.get_queryset()
+        if score_ids:
+            scores = scores.filter(id__in=score_ids)
         
-        # Trigger thumbnail regeneration for each score
-        task_ids = []
-        from tasks.pdf_tasks import generate_thumbnail
+        # Only process scores with S3 files
+        ids = list(scores.exclude(s3_key='').order_by('id').values_list('id', flat=True))
+        if not ids:
+            return Response({'error': 'No scores found'}, status=status.HTTP_404_NOT_FOUND)
         
-        for score in scores:
-            if score.s3_key:  # Only process scores with S3 files
-                task = generate_thumbnail.delay(score.id, page_number=1)
-                task_ids.append(task.id)
+        try:
+            job_id, created = start_thumbnail_regeneration(request.user.id, ids)
+        except JobInProgress as e:
+            return Response(
+                {'error': 'A thumbnail regeneration job is already running', 'job_id': e.job_id},
+                status=status.HTTP_409_CONFLICT
+            )
         
         return Response({
-            'message': f'Thumbnail regeneration started for {len(task_ids)} scores',
-            'task_ids': task_ids,
-            'total_scores': scores.count()
+            'message': (f'Thumbnail regeneration started for {len(ids)} scores' if created
+                        else 'Thumbnail regeneration for these scores is already running'),
+            'job_id': job_id,
+            'total_scores': len(ids),
+            'deduplicated': not created
         }, status=status.HTTP_202_ACCEPTED)
+    
+    @action(detail=False, methods=['get'], url_path=r'bulk_jobs/(?P<job_id>[0-9a-f]{32})')
+    def bulk_job(self, request, job_id=None):
+        """Get aggregate progress of a bulk job"""
+        from tasks.jobs import get_job
+        
+        job = get_job(job_id)
+        if job is None or job['user_id'] != request.user.id:
+            return Response({'error': 'Job not found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(job)
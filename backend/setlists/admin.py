@@ -6,9 +6,9 @@ class SetlistItemInline(admin.TabularInline):
     """Inline admin for SetlistItem"""
     model = SetlistItem
     extra = 1
-    fields = ['score', 'order_index', 'notes']
+    fields = ['score', 'sort_key', 'notes']
     raw_id_fields = ['score']
-    ordering = ['order_index']
+    ordering = ['sort_key', 'id']
 
 
 @admin.register(Setlist)
@@ -36,8 +36,8 @@ class SetlistAdmin(admin.ModelAdmin):
 @admin.register(SetlistItem)
 class SetlistItemAdmin(admin.ModelAdmin):
     """Admin for SetlistItem model"""
-    list_display = ['setlist', 'score', 'order_index', 'created_at']
+    list_display = ['setlist', 'score', 'sort_key', 'created_at']
     list_filter = ['created_at']
     search_fields = ['setlist__title', 'score__title']
     raw_id_fields = ['setlist', 'score']
-    ordering = ['setlist', 'order_index']
+    ordering = ['setlist', 'sort_key', 'id']
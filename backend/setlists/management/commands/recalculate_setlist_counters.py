@@ -0,0 +1,45 @@
+"""
+Recompute denormalized setlist counters (item_count, total_pages, total_size_bytes)
+"""
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Sum, F, Q
+from django.db.models.functions import Coalesce
+
+from setlists.models import Setlist
+
+
+class Command(BaseCommand):
+    help = 'Recompute denormalized setlist counters from setlist items in bulk'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user-id', type=int, help='Only repair setlists owned by this user')
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Report setlists whose counters have drifted without fixing them'
+        )
+
+    def handle(self, *args, **options):
+        setlists = Setlist.objects.all()
+        if options['user_id']:
+            setlists = setlists.filter(user_id=options['user_id'])
+
+        drifted = setlists.annotate(
+            actual_item_count=Count('items'),
+            actual_total_pages=Coalesce(Sum('items__score__pages'), 0),
+            actual_total_size_bytes=Coalesce(Sum('items__score__size_bytes'), 0),
+        ).filter(
+            ~Q(item_count=F('actual_item_count'))
+            | ~Q(total_pages=F('actual_total_pages'))
+            | ~Q(total_size_bytes=F('actual_total_size_bytes'))
+        ).values_list('id', flat=True)
+        drifted_ids = list(drifted)
+
+        if options['check']:
+            self.stdout.write(f'{len(drifted_ids)} setlist(s) with drifted counters')
+            for setlist_id in drifted_ids:
+                self.stdout.write(f'  setlist {setlist_id}')
+            return
+
+        updated = Setlist.objects.filter(id__in=drifted_ids).recalculate_counters()
+        self.stdout.write(self.style.SUCCESS(f'Recalculated counters for {updated} setlist(s)'))
@@ -0,0 +1,42 @@
+# Generated by Django 5.0.14 on 2026-10-18 23:50
+
+from django.db import migrations, models
+from django.db.models import Count, Sum, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def populate_counters(apps, schema_editor):
+    Setlist = apps.get_model('setlists', 'Setlist')
+    SetlistItem = apps.get_model('setlists', 'SetlistItem')
+    items = SetlistItem.objects.filter(setlist=OuterRef('pk')).order_by().values('setlist')
+    Setlist.objects.update(
+        item_count=Coalesce(Subquery(items.annotate(total=Count('id')).values('total')), 0),
+        total_pages=Coalesce(Subquery(items.annotate(total=Sum('score__pages')).values('total')), 0),
+        total_size_bytes=Coalesce(Subquery(items.annotate(total=Sum('score__size_bytes')).values('total')), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('setlists', '0002_alter_setlistitem_order_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='setlist',
+            name='item_count',
+            field=models.IntegerField(default=0, help_text='Number of scores in this setlist'),
+        ),
+        migrations.AddField(
+            model_name='setlist',
+            name='total_pages',
+            field=models.IntegerField(default=0, help_text='Total pages across all scores in setlist'),
+        ),
+        migrations.AddField(
+            model_name='setlist',
+            name='total_size_bytes',
+            field=models.BigIntegerField(default=0, help_text='Total file size across all scores in setlist'),
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
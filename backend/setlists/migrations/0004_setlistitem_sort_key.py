@@ -0,0 +1,51 @@
+# Generated by Django 5.0.14 on 2026-10-18 23:55
+
+from django.db import migrations, models
+
+
+# Spread existing items out on gapped keys in their current display order
+POPULATE_SORT_KEY = """
+UPDATE setlist_items AS item
+SET sort_key = ranked.position * 1024
+FROM (
+    SELECT id, ROW_NUMBER() OVER (
+        PARTITION BY setlist_id
+        ORDER BY order_index NULLS LAST, created_at, id
+    ) AS position
+    FROM setlist_items
+) AS ranked
+WHERE item.id = ranked.id
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('setlists', '0003_setlist_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='setlistitem',
+            name='sort_key',
+            field=models.BigIntegerField(default=0, help_text='Sparse ordering key; positions are derived from it on read'),
+            preserve_default=False,
+        ),
+        migrations.RunSQL(POPULATE_SORT_KEY, migrations.RunSQL.noop),
+        migrations.AlterModelOptions(
+            name='setlistitem',
+            options={'ordering': ['sort_key', 'id']},
+        ),
+        migrations.RemoveIndex(
+            model_name='setlistitem',
+            name='setlist_ite_setlist_eda258_idx',
+        ),
+        migrations.RemoveField(
+            model_name='setlistitem',
+            name='order_index',
+        ),
+        migrations.AddIndex(
+            model_name='setlistitem',
+            index=models.Index(fields=['setlist', 'sort_key'], name='setlist_ite_setlist_097d86_idx'),
+        ),
+    ]
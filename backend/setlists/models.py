@@ -1,8 +1,42 @@
-from django.db import models
+from django.db import models, connection
+from django.db.models import Count, Sum, Max, F, Q, OuterRef, Subquery, Window
+from django.db.models.functions import Coalesce, RowNumber
 from django.conf import settings
 from scores.models import Score
 
 
+class SetlistQuerySet(models.QuerySet):
+    """QuerySet helpers for setlists"""
+    
+    def adjust_counters(self, items=0, pages=0, size_bytes=0):
+        """Apply deltas to the denormalized counters with a single F() update"""
+        return self.update(
+            item_count=F('item_count') + items,
+            total_pages=F('total_pages') + pages,
+            total_size_bytes=F('total_size_bytes') + size_bytes,
+        )
+    
+    def recalculate_for_score(self, score_id):
+        """
+        Recompute the counters of every setlist containing a score after its page
+        count changed; unlike a delta from the old count this cannot race
+        """
+        return self.filter(items__score_id=score_id).recalculate_counters()
+    
+    def recalculate_counters(self):
+        """Recompute the denormalized counters from setlist items in one UPDATE"""
+        items = SetlistItem.objects.filter(setlist=OuterRef('pk')).order_by().values('setlist')
+        return self.update(
+            item_count=Coalesce(Subquery(items.annotate(total=Count('id')).values('total')), 0),
+            total_pages=Coalesce(Subquery(items.annotate(total=Sum('score__pages')).values('total')), 0),
+            total_size_bytes=Coalesce(Subquery(items.annotate(total=Sum('score__size_bytes')).values('total')), 0),
+        )
+
+
+# Maintained only through F() updates; never written back from a loaded instance
+COUNTER_FIELDS = ('item_count', 'total_pages', 'total_size_bytes')
+
+
 class Setlist(models.Model):
     """Collection of scores organized for performance"""
     user = models.ForeignKey(
@@ -12,9 +46,15 @@ class Setlist(models.Model):
     )
     title = models.CharField(max_length=255)
     description = models.TextField(blank=True)
+    # Denormalized counters, maintained on item add/remove and score page changes
+    item_count = models.IntegerField(default=0, help_text="Number of scores in this setlist")
+    total_pages = models.IntegerField(default=0, help_text="Total pages across all scores in setlist")
+    total_size_bytes = models.BigIntegerField(default=0, help_text="Total file size across all scores in setlist")
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = SetlistQuerySet.as_manager()
+    
     class Meta:
         db_table = 'setlists'
         ordering = ['-updated_at']
@@ -25,15 +65,121 @@ class Setlist(models.Model):
     def __str__(self):
         return self.title
     
-    @property
-    def item_count(self):
-        """Number of scores in this setlist"""
-        return self.items.count()
+    def save(self, *args, update_fields=None, **kwargs):
+        """Save an existing setlist without its counters unless update_fields names them"""
+        if update_fields is None and not self._state.adding and not kwargs.get('force_insert'):
+            deferred = self.get_deferred_fields()
+            update_fields = [
+                field.attname for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in COUNTER_FIELDS and field.attname not in deferred
+            ]
+        super().save(*args, update_fields=update_fields, **kwargs)
     
-    @property
-    def total_pages(self):
-        """Total pages across all scores in setlist"""
-        return sum(item.score.pages or 0 for item in self.items.all())
+    def adjust_counters(self, items=0, pages=0, size_bytes=0):
+        """Apply counter deltas in the database and reload them on this instance"""
+        Setlist.objects.filter(pk=self.pk).adjust_counters(items, pages, size_bytes)
+        self.refresh_from_db(fields=COUNTER_FIELDS)
+
+
+# Gap between consecutive sort keys; inserts and moves take the midpoint of
+# their neighbours so only the moved row is written until a gap runs out.
+ORDER_GAP = 1024
+
+
+class SetlistItemQuerySet(models.QuerySet):
+    """QuerySet helpers for sparse setlist item ordering"""
+    
+    def with_positions(self):
+        """Annotate each item with its dense 1-based position in its setlist"""
+        return self.annotate(
+            order_index=Window(
+                RowNumber(),
+                partition_by=[F('setlist_id')],
+                order_by=[F('sort_key').asc(), F('id').asc()],
+            )
+        )
+    
+    def placement(self, setlist_id, position=None, exclude_id=None):
+        """
+        Return (sort_key, position) for placing an item at a 1-based position,
+        or at the end when no position is given
+        """
+        items = self.filter(setlist_id=setlist_id)
+        if exclude_id is not None:
+            items = items.exclude(id=exclude_id)
+        
+        if position is not None:
+            position = max(int(position), 1)
+            keys = list(
+                items.order_by('sort_key', 'id').values_list('sort_key', flat=True)[max(position - 2, 0):position]
+            )
+            if position == 1:
+                if keys:
+                    return keys[0] - ORDER_GAP, 1
+            elif len(keys) == 1:
+                return keys[0] + ORDER_GAP, position
+            elif keys:
+                prev_key, next_key = keys
+                if next_key - prev_key > 1:
+                    return (prev_key + next_key) // 2, position
+                # No room between the neighbours: spread the setlist out again
+                SetlistItem.objects.rebalance(setlist_id)
+                return self.placement(setlist_id, position, exclude_id)
+        
+        totals = items.aggregate(max_key=Max('sort_key'), count=Count('id'))
+        return (totals['max_key'] or 0) + ORDER_GAP, totals['count'] + 1
+    
+    def bulk_add(self, setlist, items):
+        """
+        Insert unsaved items into one setlist with a single bulk_create,
+        appending any without a sort key and keeping counters and caches in step
+        """
+        from core.cache import invalidate_user_cache
+        
+        if not items:
+            return []
+        
+        if any(item.sort_key is None for item in items):
+            max_key = self.filter(setlist=setlist).aggregate(max_key=Max('sort_key'))['max_key'] or 0
+            for item in items:
+                if item.sort_key is None:
+                    max_key += ORDER_GAP
+                    item.sort_key = max_key
+        
+        for item in items:
+            item.setlist = setlist
+        # bulk_create skips post_save, so the signal handlers' work is done here
+        created = self.bulk_create(items)
+        
+        setlist.adjust_counters(
+            len(created),
+            sum(item.score.pages or 0 for item in created),
+            sum(item.score.size_bytes or 0 for item in created),
+        )
+        start = setlist.item_count - len(created)
+        for position, item in enumerate(sorted(created, key=lambda item: (item.sort_key, item.pk)), start + 1):
+            item.order_index = position
+        invalidate_user_cache('setlists', setlist.user_id)
+        return created
+    
+    def rebalance(self, setlist_id):
+        """Rewrite a setlist's sort keys as evenly spaced multiples of ORDER_GAP"""
+        table = connection.ops.quote_name(SetlistItem._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                UPDATE {table} AS item
+                SET sort_key = ranked.position * %s
+                FROM (
+                    SELECT id, ROW_NUMBER() OVER (ORDER BY sort_key, id) AS position
+                    FROM {table}
+                    WHERE setlist_id = %s
+                ) AS ranked
+                WHERE item.id = ranked.id
+                """,
+                [ORDER_GAP, setlist_id]
+            )
+            return cursor.rowcount
 
 
 class SetlistItem(models.Model):
@@ -48,27 +194,58 @@ class SetlistItem(models.Model):
         on_delete=models.CASCADE,
         related_name='setlist_items'
     )
-    order_index = models.IntegerField(null=True, blank=True)
+    sort_key = models.BigIntegerField(
+        help_text="Sparse ordering key; positions are derived from it on read"
+    )
     notes = models.TextField(blank=True, help_text="Performance notes for this item")
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = SetlistItemQuerySet.as_manager()
+    
     class Meta:
         db_table = 'setlist_items'
-        ordering = ['order_index', 'created_at']
+        ordering = ['sort_key', 'id']
         unique_together = ['setlist', 'score']
         indexes = [
-            models.Index(fields=['setlist', 'order_index']),
+            models.Index(fields=['setlist', 'sort_key']),
         ]
     
     def __str__(self):
         return f"{self.setlist.title} - {self.order_index}: {self.score.title}"
     
+    @property
+    def order_index(self):
+        """
+        Dense 1-based position of the item within its setlist, or None when it
+        was neither annotated by with_positions() nor set by load_position()
+        """
+        return getattr(self, '_order_index', None)
+    
+    def load_position(self):
+        """Compute the position of an item loaded without with_positions() (one COUNT)"""
+        self._order_index = SetlistItem.objects.filter(setlist_id=self.setlist_id).filter(
+            Q(sort_key__lt=self.sort_key) | Q(sort_key=self.sort_key, id__lt=self.pk)
+        ).count() + 1
+        return self._order_index
+    
+    @order_index.setter
+    def order_index(self, value):
+        # Before the first save this is the requested position; afterwards the
+        # position annotated by with_positions() or computed on save/move
+        self._order_index = value
+    
     def save(self, *args, **kwargs):
-        """Auto-assign order_index if not provided"""
-        if self.order_index is None:
-            max_index = SetlistItem.objects.filter(
-                setlist=self.setlist
-            ).aggregate(models.Max('order_index'))['order_index__max']
-            self.order_index = (max_index or 0) + 1
+        """Place new items at the requested position, or at the end"""
+        if self.sort_key is None:
+            self.sort_key, self._order_index = SetlistItem.objects.placement(
+                self.setlist_id, getattr(self, '_order_index', None)
+            )
         super().save(*args, **kwargs)
+    
+    def move_to(self, position):
+        """Move the item to a 1-based position by rewriting only its own sort key"""
+        self.sort_key, self._order_index = SetlistItem.objects.placement(
+            self.setlist_id, position, exclude_id=self.pk
+        )
+        self.save(update_fields=['sort_key', 'updated_at'])
@@ -10,6 +10,7 @@ class SetlistItemSerializer(serializers.ModelSerializer):
     """Serializer for SetlistItem model"""
     score = ScoreListSerializer(read_only=True)
     score_id = serializers.IntegerField(write_only=True)
+    order_index = serializers.IntegerField(read_only=True)
     
     class Meta:
         model = SetlistItem
@@ -51,34 +52,32 @@ class SetlistCreateUpdateSerializer(serializers.ModelSerializer):
 class SetlistSerializer(serializers.ModelSerializer):
     """Full serializer for Setlist model with statistics"""
     items = SetlistItemSerializer(many=True, read_only=True)
-    item_count = serializers.ReadOnlyField()
-    total_pages = serializers.ReadOnlyField()
     
     class Meta:
         model = Setlist
         fields = [
             'id', 'title', 'description', 'items', 'item_count', 'total_pages',
-            'created_at', 'updated_at'
+            'total_size_bytes', 'created_at', 'updated_at'
         ]
-        read_only_fields = ['id', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'item_count', 'total_pages', 'total_size_bytes', 'created_at', 'updated_at']
 
 
 class SetlistListSerializer(serializers.ModelSerializer):
     """Lightweight serializer for setlist lists"""
-    item_count = serializers.ReadOnlyField()
-    total_pages = serializers.ReadOnlyField()
     
     class Meta:
         model = Setlist
         fields = [
             'id', 'title', 'description', 'item_count', 'total_pages',
-            'created_at', 'updated_at'
+            'total_size_bytes', 'created_at', 'updated_at'
         ]
+        read_only_fields = fields
 
 
 class SetlistItemCreateSerializer(serializers.ModelSerializer):
     """Serializer for creating setlist items"""
     score_id = serializers.IntegerField()
+    order_index = serializers.IntegerField(required=False, allow_null=True, min_value=1)
     
     class Meta:
         model = SetlistItem
@@ -109,6 +108,7 @@ class SetlistItemCreateSerializer(serializers.ModelSerializer):
 
 class SetlistItemUpdateSerializer(serializers.ModelSerializer):
     """Serializer for updating setlist items"""
+    order_index = serializers.IntegerField(required=False, allow_null=True)
     
     class Meta:
         model = SetlistItem
@@ -118,4 +118,12 @@ class SetlistItemUpdateSerializer(serializers.ModelSerializer):
         """Validate order_index is positive"""
         if value is not None and value < 1:
             raise serializers.ValidationError("Order index must be positive")
-        return value
\ No newline at end of file
+        return value
+    
+    def update(self, instance, validated_data):
+        """Apply a position change as a single-row move"""
+        position = validated_data.pop('order_index', None)
+        instance = super().update(instance, validated_data)
+        if position is not None:
+            instance.move_to(position)
+        return instance
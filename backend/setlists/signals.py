@@ -0,0 +1,76 @@
+"""
+Signal handlers for setlists app
+"""
+from django.db.models import QuerySet
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from core.cache import invalidate_user_cache
+from scores.models import Score
+from .models import Setlist, SetlistItem
+
+
+@receiver([post_save, post_delete], sender=Setlist)
+def invalidate_setlist_caches(sender, instance, **kwargs):
+    """Invalidate cached per-user setlist aggregates on any setlist mutation"""
+    invalidate_user_cache('setlists', instance.user_id)
+
+
+@receiver([post_save, post_delete], sender=SetlistItem)
+def invalidate_setlist_item_caches(sender, instance, origin=None, **kwargs):
+    """Invalidate cached per-user setlist aggregates when items change"""
+    # Cascades from a setlist or score delete are covered by that object's own signal
+    if isinstance(origin, (Setlist, Score)):
+        return
+    
+    if SetlistItem.setlist.is_cached(instance):
+        user_id = instance.setlist.user_id
+    else:
+        user_id = Setlist.objects.filter(pk=instance.setlist_id).values_list('user_id', flat=True).first()
+    
+    if user_id is not None:
+        invalidate_user_cache('setlists', user_id)
+
+
+def _is_setlist_delete(origin):
+    """Whether a delete was started from a setlist (or a queryset of setlists)"""
+    if isinstance(origin, Setlist):
+        return True
+    return isinstance(origin, QuerySet) and origin.model is Setlist
+
+
+def _score_totals(instance, origin=None):
+    """Return (pages, size_bytes) of an item's score without refetching when possible"""
+    if SetlistItem.score.is_cached(instance):
+        score = instance.score
+    elif isinstance(origin, Score) and origin.pk == instance.score_id:
+        score = origin
+    else:
+        values = Score.objects.filter(pk=instance.score_id).values_list('pages', 'size_bytes').first()
+        return (values[0] or 0, values[1] or 0) if values else (0, 0)
+    return score.pages or 0, score.size_bytes or 0
+
+
+def _adjust_setlist_counters(instance, items, pages, size_bytes):
+    if SetlistItem.setlist.is_cached(instance):
+        instance.setlist.adjust_counters(items, pages, size_bytes)
+    else:
+        Setlist.objects.filter(pk=instance.setlist_id).adjust_counters(items, pages, size_bytes)
+
+
+@receiver(post_save, sender=SetlistItem)
+def count_added_setlist_item(sender, instance, created, raw=False, **kwargs):
+    """Add a new item's score to its setlist's denormalized counters"""
+    if not created or raw:
+        return
+    pages, size_bytes = _score_totals(instance)
+    _adjust_setlist_counters(instance, 1, pages, size_bytes)
+
+
+@receiver(post_delete, sender=SetlistItem)
+def count_removed_setlist_item(sender, instance, origin=None, **kwargs):
+    """Remove a deleted item's score from its setlist's denormalized counters"""
+    if _is_setlist_delete(origin):
+        return
+    pages, size_bytes = _score_totals(instance, origin)
+    _adjust_setlist_counters(instance, -1, -pages, -size_bytes)
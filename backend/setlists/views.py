@@ -5,11 +5,11 @@ from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
-from django.db import transaction, models
-from django.db.models import F
+from django.db import transaction, IntegrityError
+from django.db.models import Prefetch
 from django.shortcuts import get_object_or_404
 
-from .models import Setlist, SetlistItem
+from .models import Setlist, SetlistItem, ORDER_GAP
 from scores.models import Score
 from .serializers import (
     SetlistSerializer, 
@@ -25,9 +25,23 @@ class SetlistViewSet(viewsets.ModelViewSet):
     """ViewSet for managing setlists"""
     permission_classes = [IsAuthenticated]
     
+    # Actions that read the nested items of the requested setlist
+    item_prefetch_actions = ['retrieve', 'items', 'duplicate']
+    
     def get_queryset(self):
         """Return setlists for the current user only"""
-        return Setlist.objects.filter(user=self.request.user).prefetch_related('items__score')
+        queryset = Setlist.objects.filter(user=self.request.user)
+        if self.action in self.item_prefetch_actions:
+            queryset = self.prefetch_items(queryset)
+        return queryset
+    
+    @staticmethod
+    def prefetch_items(queryset):
+        """Prefetch items with their scores and dense positions"""
+        return queryset.prefetch_related(Prefetch(
+            'items',
+            queryset=SetlistItem.objects.select_related('score').with_positions()
+        ))
     
     def get_serializer_class(self):
         """Return appropriate serializer based on action"""
@@ -57,16 +71,7 @@ class SetlistViewSet(viewsets.ModelViewSet):
         
         if serializer.is_valid():
             with transaction.atomic():
-                # If order_index is provided, adjust other items
-                order_index = serializer.validated_data.get('order_index')
-                if order_index:
-                    # Shift existing items with same or higher order_index
-                    SetlistItem.objects.filter(
-                        setlist=setlist,
-                        order_index__gte=order_index
-                    ).update(order_index=F('order_index') + 1)
-                
-                # Create the new item
+                # The item takes a sort key between its neighbours, so no other rows move
                 item = serializer.save(
                     setlist=setlist,
                     score_id=serializer.validated_data['score_id']
@@ -90,49 +95,52 @@ class SetlistViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
+        skipped = []
+        requested_ids = {}  # Insertion-ordered set: O(1) duplicate checks, request order kept
+        for score_id in score_ids:
+            try:
+                score_id = int(score_id)
+            except (TypeError, ValueError):
+                skipped.append({'score_id': score_id, 'reason': 'invalid_id'})
+                continue
+            if score_id in requested_ids:
+                skipped.append({'score_id': score_id, 'reason': 'duplicate_in_request'})
+                continue
+            requested_ids[score_id] = None
+        
+        # One ownership query and one membership query for the whole batch
+        scores = Score.objects.filter(user=request.user, id__in=list(requested_ids)).in_bulk()
+        existing_ids = set(
+            SetlistItem.objects.filter(
+                setlist=setlist, score_id__in=list(scores)
+            ).values_list('score_id', flat=True)
+        )
+        
+        new_items = []
+        for score_id in requested_ids:
+            if score_id not in scores:
+                skipped.append({'score_id': score_id, 'reason': 'not_found'})
+            elif score_id in existing_ids:
+                skipped.append({'score_id': score_id, 'reason': 'already_in_setlist'})
+            else:
+                new_items.append(SetlistItem(score=scores[score_id]))
+        
         try:
             with transaction.atomic():
-                created_items = []
-                current_max_order = SetlistItem.objects.filter(
-                    setlist=setlist
-                ).aggregate(
-                    max_order=models.Max('order_index')
-                )['max_order'] or 0
-                
-                for i, score_id in enumerate(score_ids):
-                    # Validate score exists and belongs to user
-                    try:
-                        score = Score.objects.get(id=score_id, user=request.user)
-                    except Score.DoesNotExist:
-                        return Response(
-                            {'error': f'Score {score_id} not found'}, 
-                            status=status.HTTP_404_NOT_FOUND
-                        )
-                    
-                    # Check if score already in setlist
-                    if SetlistItem.objects.filter(setlist=setlist, score=score).exists():
-                        continue  # Skip duplicates
-                    
-                    # Create item
-                    item = SetlistItem.objects.create(
-                        setlist=setlist,
-                        score=score,
-                        order_index=current_max_order + i + 1
-                    )
-                    created_items.append(item)
-                
-                # Return created items
-                serializer = SetlistItemSerializer(created_items, many=True)
-                return Response({
-                    'created_count': len(created_items),
-                    'items': serializer.data
-                }, status=status.HTTP_201_CREATED)
-                
-        except Exception as e:
+                created_items = SetlistItem.objects.bulk_add(setlist, new_items)
+        except IntegrityError:
+            # A concurrent request added one of the scores first
             return Response(
-                {'error': f'Failed to add items: {str(e)}'}, 
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                {'error': 'Setlist changed while adding items, please retry'},
+                status=status.HTTP_409_CONFLICT
             )
+        
+        serializer = SetlistItemSerializer(created_items, many=True)
+        return Response({
+            'created_count': len(created_items),
+            'items': serializer.data,
+            'skipped': skipped
+        }, status=status.HTTP_201_CREATED if created_items else status.HTTP_200_OK)
     
     @action(detail=True, methods=['put', 'patch'], url_path='items/(?P<item_id>[^/.]+)')
     def update_item(self, request, pk=None, item_id=None):
@@ -148,27 +156,10 @@ class SetlistViewSet(viewsets.ModelViewSet):
         
         if serializer.is_valid():
             with transaction.atomic():
-                old_order = item.order_index
-                new_order = serializer.validated_data.get('order_index', old_order)
-                
-                # If order changed, reorder items
-                if old_order != new_order and new_order:
-                    if new_order > old_order:
-                        # Moving down: shift items between old and new position up
-                        SetlistItem.objects.filter(
-                            setlist=setlist,
-                            order_index__gt=old_order,
-                            order_index__lte=new_order
-                        ).update(order_index=F('order_index') - 1)
-                    else:
-                        # Moving up: shift items between new and old position down
-                        SetlistItem.objects.filter(
-                            setlist=setlist,
-                            order_index__gte=new_order,
-                            order_index__lt=old_order
-                        ).update(order_index=F('order_index') + 1)
-                
+                # A position change rewrites only this item's sort key
                 serializer.save()
+                if item.order_index is None:
+                    item.load_position()
                 return Response(SetlistItemSerializer(item).data)
         
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -179,19 +170,8 @@ class SetlistViewSet(viewsets.ModelViewSet):
         setlist = self.get_object()
         item = get_object_or_404(SetlistItem, id=item_id, setlist=setlist)
         
-        with transaction.atomic():
-            # Get the order index before deletion
-            order_index = item.order_index
-            
-            # Delete the item
-            item.delete()
-            
-            # Shift remaining items down
-            if order_index:
-                SetlistItem.objects.filter(
-                    setlist=setlist,
-                    order_index__gt=order_index
-                ).update(order_index=F('order_index') - 1)
+        # Positions are derived from sort keys on read, so nothing else needs shifting
+        item.delete()
         
         return Response(status=status.HTTP_204_NO_CONTENT)
     
@@ -207,28 +187,62 @@ class SetlistViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        with transaction.atomic():
-            for item_data in item_orders:
-                if 'id' not in item_data or 'order_index' not in item_data:
-                    return Response(
-                        {'error': 'Each item must have id and order_index'},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-                
-                try:
-                    item = SetlistItem.objects.get(
-                        id=item_data['id'], 
-                        setlist=setlist
-                    )
-                    item.order_index = item_data['order_index']
-                    item.save(update_fields=['order_index'])
-                except SetlistItem.DoesNotExist:
-                    return Response(
-                        {'error': f'Item {item_data["id"]} not found in setlist'},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
+        positions = {}
+        for item_data in item_orders:
+            if not isinstance(item_data, dict) or 'id' not in item_data or 'order_index' not in item_data:
+                return Response(
+                    {'error': 'Each item must have id and order_index'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            try:
+                item_id = int(item_data['id'])
+                order_index = int(item_data['order_index'])
+            except (TypeError, ValueError):
+                return Response(
+                    {'error': 'id and order_index must be integers'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            if item_id in positions:
+                return Response(
+                    {'error': f'Item {item_id} appears more than once'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            positions[item_id] = order_index
+        
+        # The payload must be a full permutation of the setlist's items
+        current_keys = dict(
+            SetlistItem.objects.filter(setlist=setlist).values_list('id', 'sort_key')
+        )
+        unknown_ids = sorted(set(positions) - set(current_keys))
+        if unknown_ids:
+            return Response(
+                {'error': f'Items not found in setlist: {unknown_ids}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        missing_ids = sorted(set(current_keys) - set(positions))
+        if missing_ids:
+            return Response(
+                {'error': f'Missing items from reorder: {missing_ids}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if sorted(positions.values()) != list(range(1, len(positions) + 1)):
+            return Response(
+                {'error': f'order_index values must be 1..{len(positions)} with no gaps or repeats'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        # Respace the keys in the new order and write only the rows that changed
+        changed = [
+            SetlistItem(id=item_id, sort_key=order_index * ORDER_GAP)
+            for item_id, order_index in positions.items()
+            if current_keys[item_id] != order_index * ORDER_GAP
+        ]
+        if changed:
+            with transaction.atomic():
+                SetlistItem.objects.bulk_update(changed, ['sort_key'])
         
         # Return updated setlist
+        setlist = self.prefetch_items(Setlist.objects.filter(pk=setlist.pk)).get()
         serializer = SetlistSerializer(setlist)
         return Response(serializer.data)
     
@@ -237,24 +251,19 @@ class SetlistViewSet(viewsets.ModelViewSet):
         """Create a copy of the setlist"""
         original_setlist = self.get_object()
         
-        # Create new setlist
-        new_title = f"{original_setlist.title} (Copy)"
-        new_setlist = Setlist.objects.create(
-            user=request.user,
-            title=new_title,
-            description=original_setlist.description
-        )
-        
-        # Copy all items
         with transaction.atomic():
-            original_items = original_setlist.items.all()
-            for item in original_items:
-                SetlistItem.objects.create(
-                    setlist=new_setlist,
-                    score=item.score,
-                    order_index=item.order_index,
-                    notes=item.notes
-                )
+            new_setlist = Setlist.objects.create(
+                user=request.user,
+                title=f"{original_setlist.title} (Copy)",
+                description=original_setlist.description
+            )
+            
+            # Copy all items in one insert, keeping their sort keys
+            SetlistItem.objects.bulk_add(new_setlist, [
+                SetlistItem(score=item.score, sort_key=item.sort_key, notes=item.notes)
+                for item in original_setlist.items.all()
+            ])
         
+        new_setlist = self.prefetch_items(Setlist.objects.filter(pk=new_setlist.pk)).get()
         serializer = SetlistSerializer(new_setlist)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
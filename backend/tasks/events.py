@@ -0,0 +1,124 @@
+"""
+Per-user live events over Redis pub/sub
+
+Pipeline tasks publish small JSON events (task started/progress/done, score
+metadata updated) to a per-user channel; the SSE endpoint subscribes to that
+channel and relays them to the browser, so clients don't need to poll /scores/.
+Publishing is best effort: it never fails the task that emits the event.
+
+EventSource cannot send an Authorization header, and a JWT in the URL would
+end up in proxy and server access logs, so browsers first POST for a stream
+ticket: a random, single-use id valid for EVENTS_TICKET_TTL seconds.
+"""
+import json
+import logging
+import secrets
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+_client = None
+
+
+def user_channel(user_id):
+    return f"events:user:{user_id}"
+
+
+def _ticket_key(ticket):
+    return f"events_ticket:{ticket}"
+
+
+def issue_stream_ticket(user_id):
+    """Return a new single-use ticket that opens the user's event stream"""
+    ticket = secrets.token_urlsafe(32)
+    cache.set(_ticket_key(ticket), user_id, timeout=settings.EVENTS_TICKET_TTL)
+    return ticket
+
+
+def redeem_stream_ticket(ticket):
+    """Return the ticket's user id and invalidate it, or None if unknown or used"""
+    key = _ticket_key(ticket)
+    user_id = cache.get(key)
+    # Only the caller whose delete removed the key may use it
+    if user_id is None or not cache.delete(key):
+        return None
+    return user_id
+
+
+def _get_client():
+    """Lazily create one Redis connection pool per process"""
+    global _client
+    if _client is None:
+        import redis
+        _client = redis.Redis.from_url(settings.EVENTS_REDIS_URL)
+    return _client
+
+
+def publish_user_event(user_id, event, data):
+    """Publish an event to everyone streaming the user's channel"""
+    if not settings.EVENTS_REDIS_URL or not user_id:
+        return
+    try:
+        from redis import RedisError
+        payload = json.dumps({'event': event, 'data': data}, default=str)
+        _get_client().publish(user_channel(user_id), payload)
+    except RedisError as exc:
+        logger.warning(f"Could not publish {event} event for user {user_id}: {exc}")
+
+
+def publish_task_event(task_row, event):
+    """Publish a task.* event describing a Task ledger row"""
+    publish_user_event(task_row.user_id, event, {
+        'task_id': task_row.id,
+        'score_id': task_row.score_id,
+        'kind': task_row.kind,
+        'status': task_row.status,
+        'try_count': task_row.try_count,
+        'progress_done': task_row.progress_done,
+        'progress_total': task_row.progress_total,
+        'progress': task_row.progress,
+        'error_message': task_row.error_message,
+    })
+
+
+def publish_score_updated(score, fields):
+    """Publish the new values of score fields a pipeline task has just saved"""
+    publish_user_event(score.user_id, 'score.updated', {
+        'score_id': score.id,
+        **{field: getattr(score, field) for field in fields},
+    })
+
+
+def format_sse(event, data):
+    """Encode one Server-Sent Events message"""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+async def stream_user_events(user_id):
+    """
+    Yield SSE messages for a user's channel until the client disconnects,
+    with a comment line every EVENTS_KEEPALIVE_SECONDS to keep proxies from
+    closing idle connections
+    """
+    import redis.asyncio as aioredis
+
+    client = aioredis.Redis.from_url(settings.EVENTS_REDIS_URL)
+    pubsub = client.pubsub(ignore_subscribe_messages=True)
+    try:
+        await pubsub.subscribe(user_channel(user_id))
+        yield f"retry: {settings.EVENTS_RETRY_MS}\n\n"
+        yield format_sse('ready', {'user_id': user_id})
+        while True:
+            message = await pubsub.get_message(timeout=settings.EVENTS_KEEPALIVE_SECONDS)
+            if message is None:
+                yield ": keepalive\n\n"
+                continue
+            try:
+                payload = json.loads(message['data'])
+            except (TypeError, ValueError):
+                continue
+            yield format_sse(payload.get('event', 'message'), payload.get('data', {}))
+    finally:
+        await pubsub.aclose()
+        await client.aclose()
@@ -192,4 +192,34 @@ def cleanup_expired_uploads(self):
         return {
             'success': False,
             'error': str(exc)
-        }
\ No newline at end of file
+        }
+
+
+@shared_task(bind=True, max_retries=2)
+def cleanup_access_log_partitions(self):
+    """
+    Create the upcoming monthly access_logs partitions and drop the ones past
+    AUDIT_RETENTION_MONTHS (run daily by Celery beat)
+    """
+    from core.audit import ensure_partitions, prune_partitions
+    
+    try:
+        created = ensure_partitions()
+        dropped = prune_partitions()
+        logger.info(f"Access log partitions: created {created}, dropped {dropped}")
+        return {
+            'success': True,
+            'created': created,
+            'dropped': dropped,
+        }
+    
+    except Exception as exc:
+        logger.error(f"Access log partition maintenance failed: {exc}")
+        
+        if self.request.retries < self.max_retries:
+            raise self.retry(exc=exc, countdown=300)
+        
+        return {
+            'success': False,
+            'error': str(exc)
+        }
@@ -0,0 +1,228 @@
+"""
+Bulk job tracking for fan-out Celery work
+
+A bulk job is split into chunks that run as a few parallel chains ("lanes").
+Progress lives in the shared cache as atomic counters that each chunk bumps
+once when it finishes, so a job of thousands of scores is one status read.
+
+A lane whose chunk raises is dropped by Celery, so the chains carry an errback
+that fails the job. A chunk lost with its worker (e.g. OOM-killed) fires no
+errback; a job with no progress for BULK_JOB_STALL_TIMEOUT seconds is then
+treated as abandoned and a new job may take over the user's slot.
+"""
+import hashlib
+import time
+import uuid
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+
+JOB_TIMEOUT = 60 * 60 * 24  # Keep job state for a day
+
+
+class JobInProgress(Exception):
+    """Raised when a user already has an unfinished job of the same kind"""
+
+    def __init__(self, job_id):
+        super().__init__(f"Job {job_id} is still running")
+        self.job_id = job_id
+
+
+def _job_key(job_id):
+    return f"bulk_job:{job_id}"
+
+
+def _counter_key(job_id, name):
+    return f"bulk_job:{job_id}:{name}"
+
+
+def _active_key(kind, user_id):
+    return f"bulk_job:active:{kind}:{user_id}"
+
+
+def _release_slot(job_id, job):
+    active_key = _active_key(job['kind'], job['user_id'])
+    if cache.get(active_key) == job_id:
+        cache.delete(active_key)
+
+
+def job_fingerprint(item_ids):
+    """Identify a job by the set of items it covers"""
+    return hashlib.sha1(','.join(map(str, sorted(item_ids))).encode()).hexdigest()
+
+
+def create_job(user_id, kind, total, fingerprint=''):
+    """
+    Register a new job for a user and return (job_id, created)
+
+    If a job of the same kind is unfinished, the same request (same fingerprint)
+    gets that job's id back with created=False; a different one is refused.
+    """
+    job_id = uuid.uuid4().hex
+    active_key = _active_key(kind, user_id)
+
+    if not cache.add(active_key, job_id, timeout=JOB_TIMEOUT):
+        active_job = get_job(cache.get(active_key))
+        if active_job and active_job['status'] in ('PENDING', 'RUNNING'):
+            if time.time() - active_job['touched_at'] > settings.BULK_JOB_STALL_TIMEOUT:
+                fail_job(active_job['job_id'], 'No progress; a chunk was lost')
+            elif fingerprint and active_job.get('fingerprint') == fingerprint:
+                return active_job['job_id'], False
+            else:
+                raise JobInProgress(active_job['job_id'])
+        cache.set(active_key, job_id, timeout=JOB_TIMEOUT)
+
+    cache.set_many({
+        _job_key(job_id): {
+            'job_id': job_id,
+            'user_id': user_id,
+            'kind': kind,
+            'total': total,
+            'fingerprint': fingerprint,
+            'created_at': timezone.now().isoformat(),
+        },
+        _counter_key(job_id, 'succeeded'): 0,
+        _counter_key(job_id, 'failed'): 0,
+        _counter_key(job_id, 'touched_at'): time.time(),
+    }, timeout=JOB_TIMEOUT)
+    return job_id, True
+
+
+def record_progress(job_id, succeeded=0, failed=0):
+    """Add finished items to a job's counters and release the user's slot when done"""
+    try:
+        done = cache.incr(_counter_key(job_id, 'succeeded'), succeeded)
+        done += cache.incr(_counter_key(job_id, 'failed'), failed)
+    except ValueError:
+        # Job state expired; nothing left to report progress against
+        return
+    cache.set(_counter_key(job_id, 'touched_at'), time.time(), timeout=JOB_TIMEOUT)
+
+    job = cache.get(_job_key(job_id))
+    if job and done >= job['total']:
+        _release_slot(job_id, job)
+
+
+def fail_job(job_id, error):
+    """End an unfinished job as FAILED (part of its work was lost) and free the user's slot"""
+    job = cache.get(_job_key(job_id))
+    if job is None:
+        return
+    job['error'] = error
+    cache.set(_job_key(job_id), job, timeout=JOB_TIMEOUT)
+    _release_slot(job_id, job)
+
+
+def job_failed(job_id):
+    """True once a job was failed, so its remaining chunks stop doing work"""
+    job = cache.get(_job_key(job_id))
+    return bool(job and job.get('error'))
+
+
+def discard_job(job_id):
+    """Forget a job that could not be submitted and free the user's slot"""
+    job = cache.get(_job_key(job_id))
+    if job:
+        _release_slot(job_id, job)
+    cache.delete_many([
+        _job_key(job_id),
+        _counter_key(job_id, 'succeeded'),
+        _counter_key(job_id, 'failed'),
+        _counter_key(job_id, 'touched_at'),
+    ])
+
+
+def get_job(job_id):
+    """Return a job's aggregate progress, or None if it is unknown or expired"""
+    if not job_id:
+        return None
+    values = cache.get_many([
+        _job_key(job_id),
+        _counter_key(job_id, 'succeeded'),
+        _counter_key(job_id, 'failed'),
+        _counter_key(job_id, 'touched_at'),
+    ])
+    job = values.get(_job_key(job_id))
+    if job is None:
+        return None
+
+    succeeded = values.get(_counter_key(job_id, 'succeeded'), 0)
+    failed = values.get(_counter_key(job_id, 'failed'), 0)
+    processed = succeeded + failed
+    if processed >= job['total']:
+        status = 'FAILED' if failed and not succeeded else 'SUCCEEDED'
+    elif job.get('error'):
+        status = 'FAILED'
+    elif processed:
+        status = 'RUNNING'
+    else:
+        status = 'PENDING'
+
+    return {
+        **job,
+        'status': status,
+        'succeeded': succeeded,
+        'failed': failed,
+        'touched_at': values.get(_counter_key(job_id, 'touched_at'), 0),
+        'progress': round(processed * 100 / job['total'], 1) if job['total'] else 100.0,
+    }
+
+
+def start_thumbnail_regeneration(user_id, score_ids):
+    """
+    Submit cover thumbnail regeneration for many scores as one job
+
+    Scores are grouped into chunks, and the chunks are spread over at most
+    BULK_THUMBNAIL_USER_CONCURRENCY chains, so one account never occupies
+    more bulk workers than that. Only the head of each chain is published now;
+    a chunk that raises fails the job through fail_thumbnail_job.
+    Returns (job_id, created); resubmitting the same scores while the job is
+    unfinished returns the existing job instead of queueing the work twice.
+    """
+    from celery import chain, group
+    from .pdf_tasks import fail_thumbnail_job, regenerate_thumbnails_chunk
+
+    job_id, created = create_job(user_id, 'thumbnail', len(score_ids), job_fingerprint(score_ids))
+    if not created:
+        return job_id, False
+
+    chunk_size = settings.BULK_THUMBNAIL_CHUNK_SIZE
+    chunks = [score_ids[i:i + chunk_size] for i in range(0, len(score_ids), chunk_size)]
+    lanes = [chunks[i::settings.BULK_THUMBNAIL_USER_CONCURRENCY]
+             for i in range(settings.BULK_THUMBNAIL_USER_CONCURRENCY)]
+
+    try:
+        group(
+            chain(regenerate_thumbnails_chunk.si(job_id, chunk) for chunk in lane).on_error(
+                fail_thumbnail_job.s(job_id)
+            )
+            for lane in lanes if lane
+        ).apply_async()
+    except Exception:
+        discard_job(job_id)
+        raise
+    return job_id, True
+
+
+def start_failed_task_retry(task_ids):
+    """
+    Mark failed ledger rows for retry and re-enqueue them in chunks
+
+    Chunks of TASK_RETRY_CHUNK_SIZE rows are dispatched on the maintenance queue
+    TASK_RETRY_CHUNK_INTERVAL seconds apart, so recovering from an outage that
+    failed thousands of tasks does not flood the render workers or storage at once.
+    Returns the number of chunks scheduled.
+    """
+    from .models import Task
+    from .pdf_tasks import retry_tasks_chunk
+
+    Task.objects.filter(id__in=task_ids).update(
+        status='PENDING', error_message='', updated_at=timezone.now()
+    )
+
+    chunk_size = settings.TASK_RETRY_CHUNK_SIZE
+    chunks = [task_ids[i:i + chunk_size] for i in range(0, len(task_ids), chunk_size)]
+    for index, chunk in enumerate(chunks):
+        retry_tasks_chunk.apply_async((chunk,), countdown=index * settings.TASK_RETRY_CHUNK_INTERVAL)
+    return len(chunks)
@@ -0,0 +1,145 @@
+"""
+Task ledger: keep a (score, kind) Task row in step with pipeline task runs,
+and make sure at most one run per (score, kind) is queued at a time
+"""
+import functools
+import json
+import logging
+import uuid
+
+from celery.exceptions import Retry
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError
+
+from .events import publish_task_event
+from .models import Task
+
+logger = logging.getLogger(__name__)
+
+
+def _json_safe(result):
+    """Round-trip a task result through JSON so PDF metadata values can be stored"""
+    return json.loads(json.dumps(result, default=str))
+
+
+def _record(task_row, method, *args):
+    """Apply a ledger update without letting ledger errors fail the task itself"""
+    try:
+        getattr(task_row, method)(*args)
+    except DatabaseError as exc:
+        # The score (and its task rows) may have been deleted mid-run
+        logger.warning(f"Could not update task ledger row {task_row.pk}: {exc}")
+        return
+    publish_task_event(task_row, 'task.retrying' if method == 'mark_retrying' else 'task.done')
+
+
+def _enqueue_key(kind, score_id):
+    return f"task_enqueue:{kind}:{score_id}"
+
+
+def enqueue_once(task, kind, score_id, coalesce=True, queue=None, **kwargs):
+    """
+    Enqueue a tracked task for a score unless a run of the same kind is already
+    pending or running, and return (celery_task_id, enqueued)
+
+    With `coalesce` the run is delayed by TASK_COALESCE_SECONDS, so a burst of
+    requests (repeated clicks) collapses into one execution. The claim is released
+    when the run finishes, or expires after TASK_DEDUP_TIMEOUT if a worker dies.
+    `queue` overrides the task's default route.
+    """
+    key = _enqueue_key(kind, score_id)
+    task_id = str(uuid.uuid4())
+    if not cache.add(key, task_id, timeout=settings.TASK_DEDUP_TIMEOUT):
+        existing = cache.get(key)
+        if existing:
+            return existing, False
+        cache.set(key, task_id, timeout=settings.TASK_DEDUP_TIMEOUT)
+    
+    options = {'queue': queue} if queue else {}
+    try:
+        task.apply_async(
+            args=(score_id,), kwargs=kwargs, task_id=task_id,
+            countdown=(settings.TASK_COALESCE_SECONDS if coalesce else 0) or None,
+            **options
+        )
+    except Exception:
+        cache.delete(key)
+        raise
+    return task_id, True
+
+
+# Ledger kinds that have a Celery task to re-run them
+RETRYABLE_KINDS = ('pdf_info', 'thumbnail', 'page_thumbnails')
+
+
+def task_for_kind(kind):
+    """Return the (Celery task, kwargs) that re-runs a ledger kind, or None if it has no task"""
+    from .pdf_tasks import process_pdf_info, generate_thumbnail, generate_all_page_thumbnails
+    return {
+        'pdf_info': (process_pdf_info, {}),
+        'thumbnail': (generate_thumbnail, {'page_number': 1}),
+        'page_thumbnails': (generate_all_page_thumbnails, {}),
+    }.get(kind)
+
+
+def pending_runs(kind, score_ids):
+    """Return the ids of scores that already have a run of this kind queued or running"""
+    keys = {_enqueue_key(kind, score_id): score_id for score_id in score_ids}
+    return {keys[key] for key in cache.get_many(list(keys))}
+
+
+def _release(kind, score_id, celery_task_id):
+    """Drop the enqueue claim if it belongs to this run"""
+    key = _enqueue_key(kind, score_id)
+    if celery_task_id and cache.get(key) == celery_task_id:
+        cache.delete(key)
+
+
+def tracked(kind, when=None):
+    """
+    Decorate a bound Celery task taking score_id first so each run upserts its
+    (score, kind) Task row: RUNNING on start, then SUCCEEDED/FAILED from the
+    returned {'success': ...} dict, or PENDING while a retry is scheduled.
+    `when` can restrict tracking to some calls, e.g. cover thumbnails only.
+    Each transition is also published as a task.* event for live clients.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, score_id, *args, **kwargs):
+            if when is not None and not when(*args, **kwargs):
+                return func(self, score_id, *args, **kwargs)
+
+            task_row = Task.objects.start(score_id, kind, celery_task_id=self.request.id or '')
+            self.request.ledger = task_row
+            if task_row is None:
+                _release(kind, score_id, self.request.id)
+                return func(self, score_id, *args, **kwargs)
+            publish_task_event(task_row, 'task.started')
+
+            try:
+                result = func(self, score_id, *args, **kwargs)
+            except Retry as exc:
+                # The retry keeps the same task id, so it keeps the enqueue claim
+                _record(task_row, 'mark_retrying', str(exc.exc or exc))
+                raise
+            except Exception as exc:
+                _release(kind, score_id, self.request.id)
+                _record(task_row, 'mark_failed', str(exc))
+                raise
+
+            _release(kind, score_id, self.request.id)
+
+            if isinstance(result, dict) and result.get('success'):
+                _record(task_row, 'mark_succeeded', _json_safe(result))
+            else:
+                error = result.get('error', '') if isinstance(result, dict) else ''
+                _record(task_row, 'mark_failed', error or 'Task reported failure')
+            return result
+        return wrapper
+    return decorator
+
+
+def current_ledger(task):
+    """Return the Task row of the running task invocation, if it is tracked"""
+    return getattr(task.request, 'ledger', None)
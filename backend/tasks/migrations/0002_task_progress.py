@@ -0,0 +1,28 @@
+# Generated by Django 5.0.14 on 2026-10-19 00:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='progress_done',
+            field=models.IntegerField(default=0, help_text='Units of work completed (e.g. pages)'),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='progress_total',
+            field=models.IntegerField(blank=True, help_text='Total units of work, if known', null=True),
+        ),
+        migrations.AlterField(
+            model_name='task',
+            name='kind',
+            field=models.CharField(choices=[('pdf_info', 'PDF Info Extraction'), ('thumbnail', 'Thumbnail Generation'), ('page_thumbnails', 'All Page Thumbnails'), ('layout_hook', 'Layout Analysis Hook')], max_length=20),
+        ),
+    ]
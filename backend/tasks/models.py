@@ -1,14 +1,71 @@
-from django.db import models
+import time
+from django.db import models, connection
 from django.conf import settings
+from django.utils import timezone
 from scores.models import Score
 
 
+# Progress is written at most this often, unless a step of PROGRESS_WRITE_FRACTION
+# of the total has been completed since the last write
+PROGRESS_WRITE_INTERVAL = 2.0  # seconds
+PROGRESS_WRITE_FRACTION = 0.05
+
+
+class TaskQuerySet(models.QuerySet):
+    """QuerySet helpers for the task ledger"""
+    
+    def start(self, score_id, kind, celery_task_id=''):
+        """
+        Upsert the (score, kind) row as RUNNING in one statement and return it,
+        or None when the score no longer exists
+        """
+        table = connection.ops.quote_name(Task._meta.db_table)
+        score_table = connection.ops.quote_name(Score._meta.db_table)
+        now = timezone.now()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO {table} (
+                    user_id, score_id, kind, status, try_count, celery_task_id, log,
+                    result_json, error_message, progress_done, progress_total,
+                    started_at, completed_at, created_at, updated_at
+                )
+                SELECT user_id, id, %(kind)s, 'RUNNING', 1, %(celery_task_id)s, '',
+                    '{{}}'::jsonb, '', 0, NULL, %(now)s, NULL, %(now)s, %(now)s
+                FROM {score_table}
+                WHERE id = %(score_id)s
+                ON CONFLICT (score_id, kind) DO UPDATE SET
+                    status = 'RUNNING',
+                    try_count = {table}.try_count + 1,
+                    celery_task_id = EXCLUDED.celery_task_id,
+                    error_message = '',
+                    progress_done = 0,
+                    progress_total = NULL,
+                    started_at = EXCLUDED.started_at,
+                    completed_at = NULL,
+                    updated_at = EXCLUDED.updated_at
+                RETURNING id, user_id, try_count
+                """,
+                {'score_id': score_id, 'kind': kind, 'celery_task_id': celery_task_id, 'now': now}
+            )
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        
+        task_id, user_id, try_count = row
+        return Task(
+            id=task_id, user_id=user_id, score_id=score_id, kind=kind, status='RUNNING',
+            try_count=try_count, celery_task_id=celery_task_id, started_at=now, progress_done=0
+        )
+
+
 class Task(models.Model):
     """Background task tracking for async operations"""
     
     KIND_CHOICES = [
         ('pdf_info', 'PDF Info Extraction'),
         ('thumbnail', 'Thumbnail Generation'),
+        ('page_thumbnails', 'All Page Thumbnails'),
         ('layout_hook', 'Layout Analysis Hook'),
     ]
     
@@ -38,11 +95,15 @@ class Task(models.Model):
     log = models.TextField(blank=True, help_text="Task execution log")
     result_json = models.JSONField(default=dict, blank=True, help_text="Task result data")
     error_message = models.TextField(blank=True)
+    progress_done = models.IntegerField(default=0, help_text="Units of work completed (e.g. pages)")
+    progress_total = models.IntegerField(null=True, blank=True, help_text="Total units of work, if known")
     started_at = models.DateTimeField(null=True, blank=True)
     completed_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = TaskQuerySet.as_manager()
+    
     class Meta:
         db_table = 'tasks'
         ordering = ['-created_at']
@@ -69,6 +130,15 @@ class Task(models.Model):
     def is_failed(self):
         return self.status == 'FAILED'
     
+    @property
+    def progress(self):
+        """Percentage of work completed, if the total is known"""
+        if self.is_completed and self.status == 'SUCCEEDED':
+            return 100.0
+        if self.progress_total:
+            return round(self.progress_done * 100 / self.progress_total, 1)
+        return None
+    
     @property
     def duration(self):
         """Calculate task duration if completed"""
@@ -103,3 +173,41 @@ class Task(models.Model):
         if log:
             self.log = log
         self.save(update_fields=['status', 'completed_at', 'error_message', 'log', 'updated_at'])
+    
+    def mark_retrying(self, error_message=""):
+        """Mark task as waiting for a Celery retry"""
+        self.status = 'PENDING'
+        self.error_message = error_message
+        self.save(update_fields=['status', 'error_message', 'updated_at'])
+    
+    def report_progress(self, done, total=None, force=False):
+        """
+        Record incremental progress, writing to the database (and publishing a
+        task.progress event) only every PROGRESS_WRITE_INTERVAL seconds or
+        PROGRESS_WRITE_FRACTION of the total
+        """
+        self.progress_done = done
+        if total is not None:
+            self.progress_total = total
+        
+        now = time.monotonic()
+        last_done, last_time = getattr(self, '_last_progress_write', (0, 0.0))
+        step = max(1, int((self.progress_total or 0) * PROGRESS_WRITE_FRACTION))
+        if not (
+            force
+            or done == self.progress_total
+            or done - last_done >= step
+            or now - last_time >= PROGRESS_WRITE_INTERVAL
+        ):
+            return False
+        
+        Task.objects.filter(pk=self.pk).update(
+            progress_done=self.progress_done,
+            progress_total=self.progress_total,
+            updated_at=timezone.now()
+        )
+        self._last_progress_write = (done, now)
+        
+        from .events import publish_task_event
+        publish_task_event(self, 'task.progress')
+        return True
@@ -11,12 +11,17 @@ from PIL import Image
 import fitz  # PyMuPDF for thumbnail generation
 
 from scores.models import Score
+from setlists.models import Setlist
+from core.access_log import timed
 from files.utils import S3Handler
+from .events import publish_score_updated
+from .ledger import tracked, current_ledger
 
 logger = logging.getLogger(__name__)
 
 
 @shared_task(bind=True, max_retries=3)
+@tracked('pdf_info')
 def process_pdf_info(self, score_id):
     """
     Extract PDF information (pages, metadata) from uploaded PDF
@@ -43,20 +48,26 @@ def process_pdf_info(self, score_id):
                 # For now, we'll simulate the process
                 
                 import requests
-                response = requests.get(download_data['url'], timeout=30)
-                response.raise_for_status()
-                
-                temp_file.write(response.content)
-                temp_file.flush()
+                with timed('download'):
+                    response = requests.get(download_data['url'], timeout=30)
+                    response.raise_for_status()
+                    
+                    temp_file.write(response.content)
+                    temp_file.flush()
                 
                 # Extract PDF information
-                with pdfplumber.open(temp_file.name) as pdf:
-                    page_count = len(pdf.pages)
+                with timed('open'):
+                    opened = pdfplumber.open(temp_file.name)
+                
+                with opened as pdf:
+                    with timed('parse'):
+                        page_count = len(pdf.pages)
                     
                     # Extract basic metadata
                     metadata = pdf.metadata or {}
                     
                     # Update score with extracted information
+                    old_pages = score.pages
                     score.pages = page_count
                     
                     # Update title if not already set and available in metadata
@@ -70,6 +81,11 @@ def process_pdf_info(self, score_id):
                     # Let users manually set composer information
                     
                     score.save(update_fields=['pages', 'title'])
+                    publish_score_updated(score, ['pages', 'title'])
+                    
+                    # Keep denormalized setlist page totals in sync
+                    if page_count != old_pages:
+                        Setlist.objects.recalculate_for_score(score.id)
                 
                 logger.info(f"Successfully extracted PDF info for score {score_id}: {page_count} pages")
                 
@@ -102,6 +118,7 @@ def process_pdf_info(self, score_id):
 
 
 @shared_task(bind=True, max_retries=3)
+@tracked('thumbnail', when=lambda page_number=1: page_number == 1)
 def generate_thumbnail(self, score_id, page_number=1):
     """
     Generate thumbnail for PDF (cover or specific page)
@@ -125,14 +142,16 @@ def generate_thumbnail(self, score_id, page_number=1):
                 )
                 
                 import requests
-                response = requests.get(download_data['url'], timeout=30)
-                response.raise_for_status()
-                
-                temp_pdf.write(response.content)
-                temp_pdf.flush()
+                with timed('download'):
+                    response = requests.get(download_data['url'], timeout=30)
+                    response.raise_for_status()
+                    
+                    temp_pdf.write(response.content)
+                    temp_pdf.flush()
                 
                 # Generate thumbnail using PyMuPDF
-                pdf_doc = fitz.open(temp_pdf.name)
+                with timed('open'):
+                    pdf_doc = fitz.open(temp_pdf.name)
                 
                 if page_number > len(pdf_doc):
                     logger.error(f"Page {page_number} not found in PDF with {len(pdf_doc)} pages")
@@ -141,10 +160,12 @@ def generate_thumbnail(self, score_id, page_number=1):
                 # Get page (0-indexed)
                 page = pdf_doc[page_number - 1]
                 
-                # Render page as image
-                mat = fitz.Matrix(2, 2)  # 2x zoom for better quality
-                pix = page.get_pixmap(matrix=mat)
-                img_data = pix.tobytes("png")
+                # Render page as image (zoomed for better quality)
+                with timed('rasterize'):
+                    zoom = settings.THUMBNAIL_RENDER_ZOOM
+                    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom))
+                with timed('encode'):
+                    img_data = pix.tobytes("png")
                 
                 # Convert to PIL Image for resizing
                 with tempfile.NamedTemporaryFile(suffix='.png') as temp_img:
@@ -153,11 +174,14 @@ def generate_thumbnail(self, score_id, page_number=1):
                     
                     with Image.open(temp_img.name) as img:
                         # Resize to thumbnail size (max 300x400, maintain aspect ratio)
-                        img.thumbnail((300, 400), Image.Resampling.LANCZOS)
+                        with timed('resize'):
+                            img.thumbnail((300, 400), Image.Resampling.LANCZOS)
                         
                         # Save as JPEG for smaller file size
                         with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as thumb_file:
-                            img.convert('RGB').save(thumb_file.name, 'JPEG', quality=85, optimize=True)
+                            with timed('encode'):
+                                img.convert('RGB').save(thumb_file.name, 'JPEG',
+                                                        quality=settings.THUMBNAIL_JPEG_QUALITY, optimize=True)
                             
                             # Upload thumbnail to S3
                             if page_number == 1:
@@ -168,7 +192,7 @@ def generate_thumbnail(self, score_id, page_number=1):
                                 thumb_s3_key = score.generate_page_thumbnail_s3_key(page_number)
                             
                             # Upload to S3
-                            with open(thumb_file.name, 'rb') as thumb_data:
+                            with open(thumb_file.name, 'rb') as thumb_data, timed('upload'):
                                 s3_handler.s3_client.put_object(
                                     Bucket=s3_handler.bucket_name,
                                     Key=thumb_s3_key,
@@ -181,6 +205,7 @@ def generate_thumbnail(self, score_id, page_number=1):
                             if page_number == 1:
                                 score.thumbnail_key = thumb_s3_key
                                 score.save(update_fields=['thumbnail_key'])
+                                publish_score_updated(score, ['thumbnail_key'])
                             
                             # Clean up temporary thumbnail file
                             try:
@@ -221,6 +246,7 @@ def generate_thumbnail(self, score_id, page_number=1):
 
 
 @shared_task(bind=True, max_retries=3)
+@tracked('page_thumbnails')
 def generate_all_page_thumbnails(self, score_id):
     """
     Generate thumbnails for all pages of a PDF
@@ -242,6 +268,7 @@ def generate_all_page_thumbnails(self, score_id):
         
         results = []
         failed_pages = []
+        ledger = current_ledger(self)
         
         # Generate thumbnail for each page
         for page_num in range(1, score.pages + 1):
@@ -255,6 +282,10 @@ def generate_all_page_thumbnails(self, score_id):
             except Exception as e:
                 logger.error(f"Failed to generate thumbnail for page {page_num}: {e}")
                 failed_pages.append(page_num)
+            
+            if ledger:
+                # Batched: only written every few seconds or every 5% of pages
+                ledger.report_progress(page_num, score.pages)
         
         success_count = len([r for r in results if r.get('success')])
         
@@ -279,4 +310,85 @@ def generate_all_page_thumbnails(self, score_id):
         if self.request.retries < self.max_retries:
             raise self.retry(exc=exc, countdown=60 * (2 ** self.request.retries))
         
-        return {'success': False, 'error': str(exc)}
\ No newline at end of file
+        return {'success': False, 'error': str(exc)}
+
+
+@shared_task(bind=True)
+def regenerate_thumbnails_chunk(self, job_id, score_ids):
+    """
+    Regenerate cover thumbnails for one chunk of a bulk job
+    """
+    from .jobs import job_failed, record_progress
+    from .ledger import pending_runs
+    
+    # Scores with a cover thumbnail run already queued or running get one anyway
+    queued = pending_runs('thumbnail', score_ids)
+    succeeded = len(queued)
+    failed = 0
+    for score_id in score_ids:
+        if score_id in queued:
+            continue
+        # A failed job (e.g. taken over after stalling) stops rendering at once
+        if job_failed(job_id):
+            logger.info(f"Bulk job {job_id} has failed; skipping the rest of its chunk")
+            return {'job_id': job_id, 'succeeded': succeeded, 'failed': failed, 'stopped': True}
+        try:
+            result = generate_thumbnail(score_id, page_number=1)
+        except Exception as exc:
+            logger.error(f"Bulk thumbnail regeneration failed for score {score_id}: {exc}")
+            result = None
+        
+        if result and result.get('success'):
+            succeeded += 1
+        else:
+            failed += 1
+    
+    # One progress update per chunk rather than per score
+    record_progress(job_id, succeeded=succeeded, failed=failed)
+    logger.info(f"Bulk job {job_id}: regenerated {succeeded}/{len(score_ids)} thumbnails in chunk")
+    
+    return {'job_id': job_id, 'succeeded': succeeded, 'failed': failed}
+
+
+@shared_task
+def fail_thumbnail_job(request, exc, traceback, job_id):
+    """
+    Errback of the bulk thumbnail chains: a chunk that raised dropped the rest
+    of its lane, so the job can never complete and is failed instead
+    """
+    from .jobs import fail_job
+    
+    logger.error(f"Bulk job {job_id}: chunk {request.id} failed: {exc}")
+    fail_job(job_id, f"{exc.__class__.__name__}: {exc}")
+
+
+@shared_task(bind=True)
+def retry_tasks_chunk(self, task_ids):
+    """
+    Re-enqueue one chunk of ledger rows an admin marked for retry
+    
+    The re-runs go to the bulk render queue so a mass retry never delays
+    processing of fresh uploads.
+    """
+    from scoremateserver.celery import QUEUE_RENDER_BULK
+    from .ledger import enqueue_once, task_for_kind
+    from .models import Task
+    
+    queued = 0
+    rows = Task.objects.filter(id__in=task_ids, status='PENDING', score__isnull=False).only('kind', 'score_id')
+    for task_row in rows:
+        entry = task_for_kind(task_row.kind)
+        if entry is None:
+            continue
+        task, kwargs = entry
+        try:
+            _, enqueued = enqueue_once(
+                task, task_row.kind, task_row.score_id, coalesce=False, queue=QUEUE_RENDER_BULK, **kwargs
+            )
+        except Exception as exc:
+            logger.error(f"Could not re-enqueue task {task_row.id}: {exc}")
+            continue
+        queued += enqueued
+    
+    logger.info(f"Retry chunk: re-enqueued {queued}/{len(task_ids)} tasks")
+    return {'queued': queued, 'total': len(task_ids)}
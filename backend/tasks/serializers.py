@@ -0,0 +1,20 @@
+"""
+Serializers for tasks app
+"""
+from rest_framework import serializers
+from .models import Task
+
+
+class TaskSerializer(serializers.ModelSerializer):
+    """Serializer for a score's pipeline task status"""
+    progress = serializers.FloatField(read_only=True)
+    duration = serializers.FloatField(read_only=True)
+    
+    class Meta:
+        model = Task
+        fields = [
+            'id', 'kind', 'status', 'try_count', 'progress_done', 'progress_total',
+            'progress', 'error_message', 'started_at', 'completed_at', 'duration',
+            'updated_at'
+        ]
+        read_only_fields = fields
@@ -0,0 +1,13 @@
+"""
+URL configuration for tasks app (live events)
+"""
+from django.urls import path
+
+from .views import event_stream, event_stream_ticket
+
+app_name = 'tasks'
+
+urlpatterns = [
+    path('events/', event_stream, name='event_stream'),
+    path('events/ticket/', event_stream_ticket, name='event_stream_ticket'),
+]
@@ -1,3 +1,86 @@
-from django.shortcuts import render
+"""
+Live task and ingestion events streamed over Server-Sent Events
+"""
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
+from rest_framework import status
+from rest_framework.decorators import api_view
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.response import Response
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.settings import api_settings
 
-# Create your views here.
+from core.authentication import CachedJWTAuthentication, get_cached_user
+
+from .events import issue_stream_ticket, redeem_stream_ticket, stream_user_events
+
+
+def _error(status_code, error_type, code, message):
+    return JsonResponse({
+        'error': {
+            'type': error_type,
+            'code': code,
+            'message': message,
+        }
+    }, status=status_code)
+
+
+def _authenticate(request):
+    """
+    Resolve the user from the Authorization header, or from a `ticket` query
+    parameter since browser EventSource cannot send custom headers
+    """
+    ticket = request.GET.get('ticket')
+    if ticket is None:
+        result = CachedJWTAuthentication().authenticate(request)
+        return result[0] if result else None
+
+    user_id = redeem_stream_ticket(ticket)
+    user = get_cached_user(user_id) if user_id is not None else None
+    if user is None or not api_settings.USER_AUTHENTICATION_RULE(user):
+        raise AuthenticationFailed('Stream ticket is invalid or has already been used.')
+    return user
+
+
+@api_view(['POST'])
+def event_stream_ticket(request):
+    """Issue a single-use ticket for opening the event stream with EventSource"""
+    return Response({
+        'ticket': issue_stream_ticket(request.user.id),
+        'expires_in': settings.EVENTS_TICKET_TTL,
+    }, status=status.HTTP_201_CREATED)
+
+
+@require_GET
+async def event_stream(request):
+    """
+    Stream the authenticated user's task and score events as text/event-stream
+
+    This is an async view: under ASGI an idle connection is a parked coroutine
+    waiting on Redis, not an occupied worker thread. Under WSGI Django would
+    consume the endless stream with async_to_sync and never flush it, so the
+    request is refused there instead.
+    """
+    try:
+        user = await sync_to_async(_authenticate)(request)
+    except (InvalidToken, TokenError, AuthenticationFailed) as exc:
+        return _error(status.HTTP_401_UNAUTHORIZED, 'AuthenticationFailed', 'token_not_valid', str(exc))
+    if user is None:
+        return _error(status.HTTP_401_UNAUTHORIZED, 'NotAuthenticated', 'not_authenticated',
+                      'Authentication credentials were not provided.')
+
+    if not settings.EVENTS_REDIS_URL:
+        return _error(status.HTTP_503_SERVICE_UNAVAILABLE, 'ServiceUnavailable', 'events_unavailable',
+                      'Live events are not configured on this server.')
+
+    if not isinstance(request, ASGIRequest):
+        return _error(status.HTTP_503_SERVICE_UNAVAILABLE, 'ServiceUnavailable', 'events_require_asgi',
+                      'Live events are served by the ASGI events service only.')
+
+    response = StreamingHttpResponse(stream_user_events(user.id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Stop nginx from buffering the stream
+    return response
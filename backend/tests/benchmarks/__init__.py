@@ -0,0 +1 @@
+# Timed benchmarks are skipped unless RUN_BENCHMARKS=1 (see test_api_benchmarks.py)
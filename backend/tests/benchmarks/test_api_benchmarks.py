@@ -0,0 +1,201 @@
+"""
+Query-count and latency benchmarks for the main API endpoints
+
+Every endpoint is requested with caches cleared, so each round measures the
+uncached path, and fails when it runs more queries than recorded in
+query_baseline.json. APIQueryCountTest checks those counts against a 10-score
+library in every test run. The timed benchmarks are skipped unless
+RUN_BENCHMARKS=1: each library size in BENCH_SIZES gets its own seeded user
+(scores built with ScoreFactory, one setlist of up to SETLIST_ITEMS items),
+and every endpoint is requested BENCH_ROUNDS times.
+
+    RUN_BENCHMARKS=1 BENCH_SIZES=10,1000,50000 pytest tests/benchmarks
+
+Query counts must hold at any library size. After an intended change, rewrite
+the baseline with BENCH_UPDATE_BASELINE=1. Query counts, wall-time
+percentiles and sizes are written as JSON to BENCH_OUTPUT for trend tracking.
+"""
+import json
+import os
+import statistics
+import time
+import unittest
+from pathlib import Path
+
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from core.authentication import local_user_cache
+from scores.models import Score
+from setlists.models import ORDER_GAP, Setlist, SetlistItem
+from ..factories import ScoreFactory, SetlistFactory, SetlistItemFactory, UserFactory
+
+RUN_BENCHMARKS = os.environ.get('RUN_BENCHMARKS') == '1'
+BENCH_SIZES = [int(size) for size in os.environ.get('BENCH_SIZES', '10,1000').split(',')]
+BENCH_ROUNDS = int(os.environ.get('BENCH_ROUNDS', 7))
+BENCH_OUTPUT = os.environ.get('BENCH_OUTPUT', 'benchmark-results.json')
+UPDATE_BASELINE = os.environ.get('BENCH_UPDATE_BASELINE') == '1'
+BASELINE_PATH = Path(__file__).with_name('query_baseline.json')
+SETLIST_ITEMS = 200
+BULK_IDS = 100
+
+results = []
+
+
+def seed_library(user, size):
+    """Create `size` scores for the user in batches"""
+    scores = ScoreFactory.build_batch(size, user=user)
+    return Score.objects.bulk_create(scores, batch_size=1000)
+
+
+def seed_setlist(user, scores):
+    """Create a setlist holding `scores` in order"""
+    setlist = SetlistFactory(user=user)
+    SetlistItem.objects.bulk_create([
+        SetlistItemFactory.build(setlist=setlist, score=score, sort_key=(position + 1) * ORDER_GAP)
+        for position, score in enumerate(scores)
+    ])
+    Setlist.objects.filter(pk=setlist.pk).recalculate_counters()
+    return setlist
+
+
+def load_baseline():
+    if BASELINE_PATH.exists():
+        return json.loads(BASELINE_PATH.read_text())
+    return {}
+
+
+def tearDownModule():
+    if not results:
+        return
+    Path(BENCH_OUTPUT).write_text(json.dumps({
+        'generated_at': timezone.now().isoformat(),
+        'commit': os.environ.get('BENCH_COMMIT', ''),
+        'rounds': BENCH_ROUNDS,
+        'results': results,
+    }, indent=2))
+
+    if UPDATE_BASELINE:
+        baseline = {}
+        for result in results:
+            baseline[result['endpoint']] = max(baseline.get(result['endpoint'], 0), result['queries'])
+        BASELINE_PATH.write_text(json.dumps(dict(sorted(baseline.items())), indent=2) + '\n')
+
+
+class APIBenchmarkMixin:
+    """Endpoint benchmarks against a library of `size` scores"""
+    size = None
+    rounds = BENCH_ROUNDS
+    record_results = True
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = UserFactory(total_quota_mb=10 ** 7)
+        cls.scores = seed_library(cls.user, cls.size)
+        cls.setlist = seed_setlist(cls.user, cls.scores[:SETLIST_ITEMS])
+        cls.item_ids = list(SetlistItem.objects.filter(setlist=cls.setlist).values_list('id', flat=True))
+        cls.bulk_ids = [score.id for score in cls.scores[:BULK_IDS]]
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def measure(self, endpoint, method, url, data=None, payload=None):
+        """
+        Time BENCH_ROUNDS requests after a warm-up; `payload(round)` may vary the
+        request body per round so writes actually change rows every time
+        """
+        request = getattr(self.client, method)
+        timings, queries = [], 0
+        for round_number in range(self.rounds + 1):
+            body = payload(round_number) if payload else data
+            cache.clear()
+            local_user_cache.clear()
+            with CaptureQueriesContext(connection) as captured:
+                start = time.perf_counter()
+                response = request(url, body, format='json') if body is not None else request(url)
+                elapsed = time.perf_counter() - start
+            self.assertEqual(response.status_code, status.HTTP_200_OK, f"{endpoint}: {response.content[:200]}")
+            if round_number:
+                timings.append(elapsed * 1000)
+                queries = max(queries, len(captured))
+
+        timings.sort()
+        if self.record_results or UPDATE_BASELINE:
+            results.append({
+                'endpoint': endpoint,
+                'library_size': self.size,
+                'queries': queries,
+                'p50_ms': round(statistics.median(timings), 2),
+                'p95_ms': round(timings[min(len(timings) - 1, round(0.95 * (len(timings) - 1)))], 2),
+                'max_ms': round(timings[-1], 2),
+            })
+
+        if not UPDATE_BASELINE:
+            allowed = load_baseline().get(endpoint)
+            self.assertIsNotNone(allowed, f"No query baseline for {endpoint}; run with BENCH_UPDATE_BASELINE=1")
+            self.assertLessEqual(
+                queries, allowed,
+                f"{endpoint} ran {queries} queries with {self.size} scores (baseline {allowed})"
+            )
+
+    def test_score_list(self):
+        self.measure('scores.list', 'get', '/api/v1/scores/')
+
+    def test_score_search(self):
+        term = self.scores[0].title.split()[0]
+        self.measure('scores.search', 'get', f'/api/v1/scores/?search={term}')
+
+    def test_score_filter(self):
+        self.measure('scores.filter', 'get',
+                     '/api/v1/scores/?instrumentation=piano&pages_min=10&ordering=-size_mb')
+
+    def test_score_tag_filter(self):
+        tag = self.scores[0].tags[0]
+        self.measure('scores.tag_filter', 'get', f'/api/v1/scores/?tags={tag}')
+
+    def test_score_statistics(self):
+        self.measure('scores.statistics', 'get', '/api/v1/scores/statistics/')
+
+    def test_dashboard(self):
+        self.measure('dashboard', 'get', '/api/v1/dashboard/')
+
+    def test_setlist_detail(self):
+        self.measure('setlists.detail', 'get', f'/api/v1/setlists/{self.setlist.id}/')
+
+    def test_setlist_reorder(self):
+        def payload(round_number):
+            # Alternate between reversed and original order so every round rewrites keys
+            ids = self.item_ids[::-1] if round_number % 2 == 0 else self.item_ids
+            return {'items': [{'id': item_id, 'order_index': index + 1} for index, item_id in enumerate(ids)]}
+        self.measure('setlists.reorder', 'post', f'/api/v1/setlists/{self.setlist.id}/reorder_items/',
+                     payload=payload)
+
+    def test_bulk_tag(self):
+        def payload(round_number):
+            key = 'add_tags' if round_number % 2 == 0 else 'remove_tags'
+            return {'score_ids': self.bulk_ids, key: ['benchmark']}
+        self.measure('scores.bulk_tag', 'post', '/api/v1/scores/bulk_tag/', payload=payload)
+
+    def test_bulk_metadata(self):
+        def payload(round_number):
+            return {'score_ids': self.bulk_ids, 'metadata': {'composer': f'Composer {round_number}'}}
+        self.measure('scores.bulk_metadata', 'post', '/api/v1/scores/bulk_metadata/', payload=payload)
+
+
+class APIQueryCountTest(APIBenchmarkMixin, APITestCase):
+    """Query counts against a small library in every test run; no timings recorded"""
+    size = 10
+    rounds = 1
+    record_results = False  # Still recorded under BENCH_UPDATE_BASELINE=1
+
+
+# One timed test class per library size
+for _size in BENCH_SIZES:
+    _name = f'APIBenchmark{_size}'
+    globals()[_name] = unittest.skipUnless(RUN_BENCHMARKS, 'set RUN_BENCHMARKS=1 to run benchmarks')(
+        type(_name, (APIBenchmarkMixin, APITestCase), {'size': _size})
+    )
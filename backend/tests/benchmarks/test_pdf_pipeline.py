@@ -0,0 +1,288 @@
+"""
+Benchmarks for the PDF pipeline (process_pdf_info and generate_thumbnail)
+
+Skipped unless RUN_BENCHMARKS=1. The corpus is tests/LaGazzaLadra.pdf plus
+synthetic scores drawn with reportlab for every combination of page count
+(BENCH_PDF_PAGES), page size (BENCH_PDF_PAGE_SIZES) and complexity
+(BENCH_PDF_COMPLEXITY: 'text' is staves and titles, 'vector' adds a dense
+layer of note heads, stems and slurs). Storage is a local directory standing
+in for S3, so 'download' and 'upload' measure the pipeline's own file
+handling rather than the network.
+
+    RUN_BENCHMARKS=1 BENCH_PDF_PAGES=1,50 BENCH_PDF_ZOOMS=1.5,2 pytest tests/benchmarks/test_pdf_pipeline.py
+
+Each case runs both tasks BENCH_PDF_ROUNDS times after a warm-up, per
+THUMBNAIL_RENDER_ZOOM in BENCH_PDF_ZOOMS, and records the median of every
+stage timed in the tasks (download, open, parse, rasterize, resize, encode,
+upload; 'encode' covers both the PNG handed to Pillow and the final JPEG) and
+the peak RSS of the run. A second benchmark renders the first page of
+each document to a bitmap with PyMuPDF and with pdfium to compare engines.
+Results are written as JSON to BENCH_PDF_OUTPUT.
+"""
+import json
+import os
+import random
+import resource
+import statistics
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+from urllib.parse import urlparse
+from urllib.request import url2pathname
+
+import fitz
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from reportlab.lib import pagesizes
+from reportlab.pdfgen import canvas
+
+from core.access_log import finish_request_timings, start_request_timings
+from tasks.pdf_tasks import generate_thumbnail, process_pdf_info
+from ..factories import ScoreFactory, UserFactory
+
+RUN_BENCHMARKS = os.environ.get('RUN_BENCHMARKS') == '1'
+BENCH_PDF_PAGES = [int(pages) for pages in os.environ.get('BENCH_PDF_PAGES', '1,10,50').split(',')]
+BENCH_PDF_PAGE_SIZES = os.environ.get('BENCH_PDF_PAGE_SIZES', 'A4,A3').split(',')
+BENCH_PDF_COMPLEXITY = os.environ.get('BENCH_PDF_COMPLEXITY', 'text,vector').split(',')
+BENCH_PDF_ZOOMS = [float(zoom) for zoom in os.environ.get('BENCH_PDF_ZOOMS', '2').split(',')]
+BENCH_PDF_ROUNDS = int(os.environ.get('BENCH_PDF_ROUNDS', 5))
+BENCH_PDF_OUTPUT = os.environ.get('BENCH_PDF_OUTPUT', 'benchmark-pdf-results.json')
+SAMPLE_PDF = Path(__file__).resolve().parent.parent / 'LaGazzaLadra.pdf'
+STAGES = ('download', 'open', 'parse', 'rasterize', 'resize', 'encode', 'upload')
+STAVES_PER_PAGE = 10
+NOTES_PER_STAFF = 400
+
+results = []
+engine_results = []
+
+
+def draw_score(path, pages, page_size, complexity):
+    """Write a synthetic score of `pages` pages to `path`"""
+    width, height = getattr(pagesizes, page_size)
+    rng = random.Random(pages)
+    pdf = canvas.Canvas(str(path), pagesize=(width, height))
+    pdf.setTitle(f"Synthetic {complexity} score ({pages} pages, {page_size})")
+    margin = 40
+    staff_gap = (height - 2 * margin) / STAVES_PER_PAGE
+    for page in range(pages):
+        pdf.setFont('Helvetica-Bold', 16)
+        pdf.drawCentredString(width / 2, height - margin / 2 - 8, f"Synthetic score, page {page + 1}")
+        for staff in range(STAVES_PER_PAGE):
+            top = height - margin - staff * staff_gap - 20
+            pdf.setFont('Helvetica', 8)
+            pdf.drawString(margin, top + 6, f"Bar {staff * 8 + 1}")
+            for line in range(5):
+                pdf.line(margin, top - line * 5, width - margin, top - line * 5)
+            if complexity != 'vector':
+                continue
+            for _ in range(NOTES_PER_STAFF):
+                x = rng.uniform(margin + 10, width - margin - 10)
+                y = top - rng.randint(-4, 12) * 2.5
+                pdf.ellipse(x - 3, y - 2, x + 3, y + 2, fill=1)
+                pdf.line(x + 3, y, x + 3, y + 15)
+            for _ in range(NOTES_PER_STAFF // 20):
+                x = rng.uniform(margin, width - margin - 60)
+                path_obj = pdf.beginPath()
+                path_obj.moveTo(x, top + 8)
+                path_obj.curveTo(x + 15, top + 18, x + 45, top + 18, x + 60, top + 8)
+                pdf.drawPath(path_obj)
+        pdf.showPage()
+    pdf.save()
+
+
+def build_corpus(directory):
+    """[(case name, path)] for the sample score and every synthetic combination"""
+    corpus = [('LaGazzaLadra', SAMPLE_PDF)]
+    for complexity in BENCH_PDF_COMPLEXITY:
+        for page_size in BENCH_PDF_PAGE_SIZES:
+            for pages in BENCH_PDF_PAGES:
+                name = f"{complexity}-{page_size}-{pages}p"
+                path = Path(directory) / f"{name}.pdf"
+                draw_score(path, pages, page_size, complexity)
+                corpus.append((name, path))
+    return corpus
+
+
+class LocalStorage:
+    """
+    Stand-in for files.utils.S3Handler that keeps objects in a directory;
+    it is its own s3_client, so put_object works as on the real client
+    """
+    bucket_name = 'benchmark'
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.s3_client = self
+
+    def path(self, key):
+        return self.root / key
+
+    def generate_presigned_download_url(self, s3_key, expiry=None, use_public_endpoint=True, filename=None):
+        return {'url': self.path(s3_key).as_uri(), 'expires_in': expiry}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        target = self.path(Key)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target.write_bytes(Body.read())
+        return {}
+
+
+class LocalResponse:
+    def __init__(self, content):
+        self.content = content
+
+    def raise_for_status(self):
+        pass
+
+
+def local_get(url, timeout=None):
+    return LocalResponse(Path(url2pathname(urlparse(url).path)).read_bytes())
+
+
+def reset_peak_rss():
+    """Restart peak RSS tracking for this process; False where the kernel doesn't allow it"""
+    try:
+        Path('/proc/self/clear_refs').write_text('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    """Peak RSS since the last reset (VmHWM), or since process start (ru_maxrss)"""
+    try:
+        for line in Path('/proc/self/status').read_text().splitlines():
+            if line.startswith('VmHWM:'):
+                return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def median_ms(samples):
+    return round(statistics.median(samples) * 1000, 2)
+
+
+def tearDownModule():
+    if not (results or engine_results):
+        return
+    Path(BENCH_PDF_OUTPUT).write_text(json.dumps({
+        'generated_at': timezone.now().isoformat(),
+        'commit': os.environ.get('BENCH_COMMIT', ''),
+        'rounds': BENCH_PDF_ROUNDS,
+        'pymupdf': fitz.VersionBind,
+        'results': results,
+        'engines': engine_results,
+    }, indent=2))
+
+
+@unittest.skipUnless(RUN_BENCHMARKS, 'set RUN_BENCHMARKS=1 to run benchmarks')
+class PDFPipelineBenchmark(TestCase):
+    """Per-stage timings and peak RSS of the PDF tasks across the corpus"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.workdir = tempfile.TemporaryDirectory()
+        cls.storage = LocalStorage(Path(cls.workdir.name) / 'bucket')
+        cls.corpus = build_corpus(cls.workdir.name)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.workdir.cleanup()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.user = UserFactory(total_quota_mb=10 ** 6)
+        patchers = [
+            patch('tasks.pdf_tasks.S3Handler', return_value=self.storage),
+            patch('requests.get', side_effect=local_get),
+            patch('tasks.pdf_tasks.publish_score_updated'),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def upload(self, name, path):
+        score = ScoreFactory(user=self.user, title='', pages=None, size_bytes=path.stat().st_size,
+                             s3_key=f"{self.user.id}/scores/{name}/original.pdf")
+        target = self.storage.path(score.s3_key)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target.write_bytes(path.read_bytes())
+        return score
+
+    def run_pipeline(self, score):
+        """Run both tasks once; returns ({stage: seconds}, wall seconds)"""
+        start_request_timings()
+        start = time.perf_counter()
+        try:
+            info = process_pdf_info(score.id)
+            thumbnail = generate_thumbnail(score.id)
+        finally:
+            timings = finish_request_timings()
+        elapsed = time.perf_counter() - start
+        self.assertTrue(info['success'], info)
+        self.assertTrue(thumbnail['success'], thumbnail)
+        return {name: seconds for name, (seconds, _) in timings.items() if name in STAGES}, elapsed
+
+    def test_pipeline(self):
+        for name, path in self.corpus:
+            score = self.upload(name, path)
+            for zoom in BENCH_PDF_ZOOMS:
+                with self.subTest(case=name, zoom=zoom), override_settings(THUMBNAIL_RENDER_ZOOM=zoom):
+                    self.run_pipeline(score)  # warm-up
+                    peak_reset = reset_peak_rss()
+                    stages, totals = {stage: [] for stage in STAGES}, []
+                    for _ in range(BENCH_PDF_ROUNDS):
+                        timings, elapsed = self.run_pipeline(score)
+                        totals.append(elapsed)
+                        for stage in STAGES:
+                            stages[stage].append(timings.get(stage, 0.0))
+
+                    score.refresh_from_db()
+                    results.append({
+                        'case': name,
+                        'pages': score.pages,
+                        'size_bytes': path.stat().st_size,
+                        'render_zoom': zoom,
+                        'stages_ms': {stage: median_ms(samples) for stage, samples in stages.items()},
+                        'total_ms': median_ms(totals),
+                        'peak_rss_mb': peak_rss_mb(),
+                        'peak_rss_scope': 'case' if peak_reset else 'process',
+                    })
+
+    def test_render_engines(self):
+        try:
+            import pypdfium2
+        except ImportError:
+            self.skipTest('pypdfium2 is not installed')
+
+        def render_pymupdf(path, zoom):
+            with fitz.open(path) as document:
+                document[0].get_pixmap(matrix=fitz.Matrix(zoom, zoom))
+
+        def render_pdfium(path, zoom):
+            document = pypdfium2.PdfDocument(str(path))
+            try:
+                document[0].render(scale=zoom)
+            finally:
+                document.close()
+
+        engines = {'pymupdf': render_pymupdf, 'pdfium': render_pdfium}
+        for name, path in self.corpus:
+            for zoom in BENCH_PDF_ZOOMS:
+                for engine, render in engines.items():
+                    render(path, zoom)  # warm-up
+                    samples = []
+                    for _ in range(BENCH_PDF_ROUNDS):
+                        start = time.perf_counter()
+                        render(path, zoom)
+                        samples.append(time.perf_counter() - start)
+                    engine_results.append({
+                        'case': name,
+                        'render_zoom': zoom,
+                        'engine': engine,
+                        'first_page_ms': median_ms(samples),
+                    })
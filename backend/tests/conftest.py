@@ -3,7 +3,6 @@ pytest configuration and fixtures for ScoreMateServer tests
 """
 import os
 import django
-from django.conf import settings
 
 # Ensure Django settings are configured
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'scoremateserver.settings')
@@ -15,4 +14,22 @@ import pytest
 @pytest.fixture
 def db_setup():
     """Setup test database - pytest-django handles the transaction"""
-    pass
\ No newline at end of file
+    pass
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    """Start every test with empty caches so rate limits and counters don't leak between tests"""
+    from django.core.cache import cache
+    from core.authentication import local_user_cache
+    cache.clear()
+    local_user_cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def audit_buffer(settings):
+    """Keep audit events in the buffer (no flusher thread) so tests flush explicitly"""
+    from core.audit import audit_buffer
+    settings.AUDIT_BACKGROUND_FLUSH = False
+    audit_buffer.clear()
+    yield audit_buffer
+    audit_buffer.clear()
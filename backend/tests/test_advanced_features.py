@@ -1,8 +1,13 @@
 """
 Tests for advanced features: Search, Filtering, Dashboard
 """
+import time
 from django.test import TestCase
 from django.db.models import Q
+from django.core.cache import cache
+from django.utils import timezone
+from datetime import timedelta
+from unittest.mock import patch
 from rest_framework.test import APITestCase, APIClient
 from rest_framework import status
 from rest_framework_simplejwt.tokens import RefreshToken
@@ -377,6 +382,67 @@ class ScoreStatisticsTest(APITestCase):
         self.assertEqual(tags['tag2'], 2)
         self.assertEqual(tags['tag3'], 1)
         self.assertEqual(tags['tag4'], 1)
+    
+    def test_statistics_single_query_and_cached(self):
+        """Statistics are computed in one query and served from cache afterwards"""
+        cache.clear()
+        
+        # 1 query for the JWT user lookup + 1 statistics query
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/v1/scores/statistics/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        
+        # Both the payload and the authenticated user now come from the cache
+        with self.assertNumQueries(0):
+            cached = self.client.get('/api/v1/scores/statistics/')
+        self.assertEqual(cached.data, response.data)
+    
+    def test_statistics_invalidated_on_score_change(self):
+        """Creating or deleting a score invalidates the cached statistics"""
+        response = self.client.get('/api/v1/scores/statistics/')
+        self.assertEqual(response.data['total_scores'], 3)
+        
+        Score.objects.create(
+            user=self.user,
+            title='Score 4',
+            composer='Composer B',
+            s3_key='score4.pdf',
+            size_bytes=1024 * 1024,
+            pages=1
+        )
+        response = self.client.get('/api/v1/scores/statistics/')
+        self.assertEqual(response.data['total_scores'], 4)
+        
+        self.scores[0].delete()
+        response = self.client.get('/api/v1/scores/statistics/')
+        self.assertEqual(response.data['total_scores'], 3)
+    
+    def test_statistics_etag_revalidation(self):
+        """Clients can revalidate statistics with If-None-Match"""
+        response = self.client.get('/api/v1/scores/statistics/')
+        etag = response['ETag']
+        self.assertTrue(etag)
+        
+        response = self.client.get('/api/v1/scores/statistics/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        
+        self.scores[1].tags = ['tag5']
+        self.scores[1].save()
+        response = self.client.get('/api/v1/scores/statistics/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+    
+    def test_statistics_empty_library(self):
+        """Statistics for a user without scores"""
+        Score.objects.filter(user=self.user).delete()
+        cache.clear()
+        
+        response = self.client.get('/api/v1/scores/statistics/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['total_scores'], 0)
+        self.assertEqual(response.data['size_statistics']['total_size_mb'], 0)
+        self.assertEqual(response.data['top_composers'], [])
+        self.assertEqual(response.data['top_tags'], [])
 
 
 class DashboardAPITest(APITestCase):
@@ -447,6 +513,45 @@ class DashboardAPITest(APITestCase):
         latest_setlists = data['latest_content']['setlists']
         self.assertEqual(len(latest_setlists), 1)
         self.assertEqual(latest_setlists[0]['item_count'], 3)
+        self.assertEqual(
+            latest_setlists[0]['total_pages'],
+            sum(score.pages for score in self.scores[:3])
+        )
+    
+    def test_dashboard_constant_queries(self):
+        """Dashboard query count does not grow with setlists and is cached afterwards"""
+        for i in range(4):
+            setlist = Setlist.objects.create(user=self.user, title=f'Extra Setlist {i}')
+            for score in self.scores:
+                SetlistItem.objects.create(setlist=setlist, score=score)
+        cache.clear()
+        
+        # 1 query for the JWT user lookup + 4 aggregate/listing queries
+        with self.assertNumQueries(5):
+            response = self.client.get('/api/v1/dashboard/')
+        self.assertEqual(len(response.data['latest_content']['setlists']), 5)
+        
+        # Both the payload and the authenticated user now come from the cache
+        with self.assertNumQueries(0):
+            cached = self.client.get('/api/v1/dashboard/')
+        self.assertEqual(cached.data['counts'], response.data['counts'])
+    
+    def test_dashboard_cache_invalidation(self):
+        """Score and setlist mutations invalidate the cached dashboard"""
+        response = self.client.get('/api/v1/dashboard/')
+        self.assertEqual(response.data['counts']['total_scores'], 5)
+        
+        ScoreFactory(user=self.user)
+        response = self.client.get('/api/v1/dashboard/')
+        self.assertEqual(response.data['counts']['total_scores'], 6)
+        
+        self.setlist.items.first().delete()
+        response = self.client.get('/api/v1/dashboard/')
+        self.assertEqual(response.data['latest_content']['setlists'][0]['item_count'], 2)
+        
+        self.setlist.delete()
+        response = self.client.get('/api/v1/dashboard/')
+        self.assertEqual(response.data['counts']['total_setlists'], 0)
     
     def test_quota_details(self):
         """Test detailed quota information"""
@@ -486,6 +591,46 @@ class DashboardAPITest(APITestCase):
         rec_types = [r['type'] for r in recommendations]
         # May include 'missing_thumbnails' if scores don't have thumbnails
     
+    def test_quota_details_grouped_queries(self):
+        """Size histogram and monthly trend use one grouped query each"""
+        cache.clear()
+        
+        # 1 query for the JWT user lookup + size histogram + monthly trend
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/v1/dashboard/quota_details/?months=12')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['window_months'], 12)
+        self.assertEqual(len(response.data['monthly_usage']), 12)
+        self.assertEqual(sum(r['count'] for r in response.data['size_breakdown']), 5)
+        
+        # Both the payload and the authenticated user now come from the cache
+        with self.assertNumQueries(0):
+            self.client.get('/api/v1/dashboard/quota_details/?months=12')
+    
+    def test_quota_details_calendar_months(self):
+        """Monthly trend buckets by calendar month, oldest first"""
+        now = timezone.localtime()
+        first_of_month = now.replace(day=1, hour=12, minute=0, second=0, microsecond=0)
+        last_month = (first_of_month - timedelta(days=1)).replace(day=15)
+        old_score = self.scores[0]
+        Score.objects.filter(id=old_score.id).update(created_at=last_month)
+        cache.clear()
+        
+        response = self.client.get('/api/v1/dashboard/quota_details/?months=24')
+        monthly_usage = response.data['monthly_usage']
+        self.assertEqual(len(monthly_usage), 24)
+        self.assertEqual(monthly_usage[-1]['month'], now.strftime('%Y-%m'))
+        self.assertEqual(monthly_usage[-2]['month'], last_month.strftime('%Y-%m'))
+        self.assertEqual(monthly_usage[-1]['scores_added'], 4)
+        self.assertEqual(monthly_usage[-2]['scores_added'], 1)
+        months = [entry['month'] for entry in monthly_usage]
+        self.assertEqual(months, sorted(set(months)))
+    
+    def test_quota_details_invalid_window(self):
+        """Only supported trend windows are accepted"""
+        response = self.client.get('/api/v1/dashboard/quota_details/?months=7')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
     def test_quota_recommendations(self):
         """Test quota recommendation logic"""
         # Create score without thumbnail
@@ -604,17 +749,210 @@ class BulkOperationsTest(APITestCase):
         for score in Score.objects.filter(id__in=score_ids):
             self.assertNotIn('old_tag', score.tags)
     
+    def test_bulk_tag_set_based_update(self):
+        """Adding and removing tags is one UPDATE per operation over changed rows"""
+        score_ids = [s.id for s in self.scores]
+        data = {
+            'score_ids': score_ids,
+            'add_tags': ['festival', 'festival', ' baroque '],
+            'remove_tags': ['old_tag']
+        }
+        
+        # JWT user lookup + savepoint + remove + add + release
+        with self.assertNumQueries(5):
+            response = self.client.post('/api/v1/scores/bulk_tag/', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['updated_scores'], 5)
+        self.assertEqual(response.data['removed_count'], 3)
+        self.assertEqual(response.data['added_count'], 5)
+        
+        for score in Score.objects.filter(id__in=score_ids):
+            self.assertEqual(score.tags, ['festival', 'baroque'])
+        
+        # Re-applying the same tags changes nothing
+        response = self.client.post('/api/v1/scores/bulk_tag/', data, format='json')
+        self.assertEqual(response.data['updated_scores'], 0)
+    
+    def test_bulk_tag_bumps_updated_at(self):
+        """Retagged scores get a new updated_at; untouched ones keep theirs"""
+        from datetime import datetime, timezone as dt_timezone
+        long_ago = datetime(2020, 1, 1, tzinfo=dt_timezone.utc)
+        Score.objects.filter(id__in=[s.id for s in self.scores]).update(updated_at=long_ago)
+        self.client.post('/api/v1/scores/bulk_tag/', {
+            'score_ids': [self.scores[0].id],
+            'add_tags': ['festival']
+        }, format='json')
+        
+        self.assertGreater(Score.objects.get(pk=self.scores[0].pk).updated_at, long_ago)
+        self.assertEqual(Score.objects.get(pk=self.scores[1].pk).updated_at, long_ago)
+    
+    def test_bulk_tag_refreshes_statistics(self):
+        """Tag statistics reflect a bulk retag"""
+        self.client.get('/api/v1/scores/statistics/')
+        self.client.post('/api/v1/scores/bulk_tag/', {
+            'score_ids': [s.id for s in self.scores],
+            'add_tags': ['festival']
+        }, format='json')
+        
+        response = self.client.get('/api/v1/scores/statistics/')
+        self.assertIn({'tag': 'festival', 'count': 5}, response.data['top_tags'])
+    
+    def test_bulk_tag_rejects_invalid_tags(self):
+        """Tags must be non-empty strings within the field length"""
+        for tags in [[''], ['x' * 51], [1]]:
+            response = self.client.post('/api/v1/scores/bulk_tag/', {
+                'score_ids': [self.scores[0].id],
+                'add_tags': tags
+            }, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_bulk_metadata_update(self):
+        """Metadata is applied in one UPDATE with per-field change counts"""
+        Score.objects.filter(pk=self.scores[0].pk).update(composer='Bach')
+        score_ids = [s.id for s in self.scores]
+        data = {
+            'score_ids': score_ids,
+            'metadata': {'composer': 'Bach', 'instrumentation': 'Organ', 'note': '', 'tags': ['a', 'a', 'b']}
+        }
+        
+        # JWT user lookup + ownership/change counts + update
+        with self.assertNumQueries(3):
+            response = self.client.post('/api/v1/scores/bulk_metadata/', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data['success'])
+        self.assertEqual(response.data['updated_scores'], 5)
+        self.assertEqual(response.data['updated_fields'], {'composer': 4, 'instrumentation': 5, 'tags': 5})
+        
+        for score in Score.objects.filter(id__in=score_ids):
+            self.assertEqual((score.composer, score.instrumentation, score.tags), ('Bach', 'Organ', ['a', 'b']))
+            self.assertEqual(score.note, '')
+    
+    def test_bulk_metadata_requires_owned_scores(self):
+        """Any foreign or unknown id rejects the whole update"""
+        other_score = ScoreFactory(user=UserFactory(), composer='Original')
+        response = self.client.post('/api/v1/scores/bulk_metadata/', {
+            'score_ids': [self.scores[0].id, other_score.id],
+            'metadata': {'composer': 'Hacked'}
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn(str(other_score.id), response.data['error'])
+        
+        other_score.refresh_from_db()
+        self.assertEqual(other_score.composer, 'Original')
+        self.assertFalse(Score.objects.filter(composer='Hacked').exists())
+    
+    def test_bulk_metadata_validation(self):
+        """Empty metadata and oversized batches are rejected"""
+        response = self.client.post('/api/v1/scores/bulk_metadata/', {
+            'score_ids': [self.scores[0].id],
+            'metadata': {'composer': ''}
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        
+        with self.settings(BULK_METADATA_MAX_IDS=2):
+            response = self.client.post('/api/v1/scores/bulk_metadata/', {
+                'score_ids': [s.id for s in self.scores],
+                'metadata': {'composer': 'Bach'}
+            }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('score_ids', response.data)
+    
     def test_bulk_thumbnail_regeneration(self):
         """Test bulk thumbnail regeneration"""
         score_ids = [s.id for s in self.scores[:3]]
         data = {'score_ids': score_ids}
         
-        response = self.client.post('/api/v1/scores/bulk_regenerate_thumbnails/', data)
+        with patch('celery.canvas.group.apply_async') as mock_apply:
+            response = self.client.post('/api/v1/scores/bulk_regenerate_thumbnails/', data)
         self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
         
-        # Should return task information
-        self.assertIn('task_ids', response.data)
-        self.assertEqual(len(response.data['task_ids']), 3)
+        # Should return a single job for all scores
+        self.assertIn('job_id', response.data)
+        self.assertEqual(response.data['total_scores'], 3)
+        mock_apply.assert_called_once()
+    
+    @patch('tasks.pdf_tasks.generate_thumbnail')
+    def test_bulk_thumbnail_job_progress(self, mock_generate):
+        """Chunks report aggregate progress under one job id"""
+        from scoremateserver.celery import app
+        
+        mock_generate.side_effect = lambda score_id, page_number=1: {'success': score_id != self.scores[0].id}
+        
+        app.conf.task_always_eager = True
+        try:
+            with self.settings(BULK_THUMBNAIL_CHUNK_SIZE=2, BULK_THUMBNAIL_USER_CONCURRENCY=2):
+                response = self.client.post('/api/v1/scores/bulk_regenerate_thumbnails/', {}, format='json')
+        finally:
+            app.conf.task_always_eager = False
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(mock_generate.call_count, 5)
+        
+        response = self.client.get(f"/api/v1/scores/bulk_jobs/{response.data['job_id']}/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['status'], 'SUCCEEDED')
+        self.assertEqual((response.data['succeeded'], response.data['failed']), (4, 1))
+        self.assertEqual(response.data['progress'], 100.0)
+        
+        # Other users cannot read the job
+        self.client.force_authenticate(UserFactory())
+        response = self.client.get(f"/api/v1/scores/bulk_jobs/{response.data['job_id']}/")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+    
+    def test_bulk_thumbnail_failed_chunk_fails_job(self):
+        """A chunk that raises fails the job and frees the slot instead of leaving it RUNNING"""
+        from unittest.mock import MagicMock
+        from tasks.pdf_tasks import fail_thumbnail_job
+        
+        with patch('celery.canvas.group.apply_async', autospec=True) as mock_apply:
+            response = self.client.post('/api/v1/scores/bulk_regenerate_thumbnails/', {}, format='json')
+        job_id = response.data['job_id']
+        lanes = mock_apply.call_args[0][0].tasks
+        for lane in lanes:
+            self.assertEqual([errback['task'] for errback in lane.options['link_error']],
+                             ['tasks.pdf_tasks.fail_thumbnail_job'])
+        
+        fail_thumbnail_job(MagicMock(id='chunk-task'), RuntimeError('cache unavailable'), None, job_id)
+        job = self.client.get(f"/api/v1/scores/bulk_jobs/{job_id}/").data
+        self.assertEqual(job['status'], 'FAILED')
+        self.assertIn('cache unavailable', job['error'])
+        
+        with patch('celery.canvas.group.apply_async'):
+            response = self.client.post('/api/v1/scores/bulk_regenerate_thumbnails/', {
+                'score_ids': [self.scores[0].id]
+            }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+    
+    def test_bulk_thumbnail_stalled_job_is_taken_over(self):
+        """A job whose chunks died with their worker stops blocking the user after a while"""
+        with patch('celery.canvas.group.apply_async'):
+            first = self.client.post('/api/v1/scores/bulk_regenerate_thumbnails/', {}, format='json')
+            cache.set(f"bulk_job:{first.data['job_id']}:touched_at", time.time() - 7200)
+            with self.settings(BULK_JOB_STALL_TIMEOUT=3600):
+                other = self.client.post('/api/v1/scores/bulk_regenerate_thumbnails/', {
+                    'score_ids': [self.scores[0].id]
+                }, format='json')
+        self.assertEqual(other.status_code, status.HTTP_202_ACCEPTED)
+        self.assertNotEqual(other.data['job_id'], first.data['job_id'])
+        
+        job = self.client.get(f"/api/v1/scores/bulk_jobs/{first.data['job_id']}/").data
+        self.assertEqual(job['status'], 'FAILED')
+    
+    def test_bulk_thumbnail_one_job_per_user(self):
+        """Repeating a job returns it; a different job is refused while the first is unfinished"""
+        with patch('celery.canvas.group.apply_async') as mock_apply:
+            first = self.client.post('/api/v1/scores/bulk_regenerate_thumbnails/', {}, format='json')
+            repeat = self.client.post('/api/v1/scores/bulk_regenerate_thumbnails/', {}, format='json')
+            other = self.client.post('/api/v1/scores/bulk_regenerate_thumbnails/', {
+                'score_ids': [self.scores[0].id]
+            }, format='json')
+        self.assertEqual(first.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(repeat.status_code, status.HTTP_202_ACCEPTED)
+        self.assertTrue(repeat.data['deduplicated'])
+        self.assertEqual(repeat.data['job_id'], first.data['job_id'])
+        mock_apply.assert_called_once()
+        
+        self.assertEqual(other.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(other.data['job_id'], first.data['job_id'])
     
     def test_bulk_operations_user_isolation(self):
         """Test that bulk operations respect user isolation"""
@@ -6,6 +6,7 @@ from rest_framework.test import APIClient
 from rest_framework import status
 from django.test import TestCase
 from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
 
 from .factories import UserFactory
 
@@ -146,4 +147,110 @@ class AuthAPITest(TestCase):
         profile_response = self.client.get(self.profile_url)
         
         self.assertEqual(profile_response.status_code, status.HTTP_200_OK)
-        self.assertEqual(profile_response.data['id'], user.id)
\ No newline at end of file
+        self.assertEqual(profile_response.data['id'], user.id)
+
+class CachedAuthenticationTest(TestCase):
+    """Test JWT authentication with cached user lookups"""
+    
+    def setUp(self):
+        from core.authentication import VersionedRefreshToken
+        self.user = UserFactory(plan='solo')
+        self.client = APIClient()
+        token = VersionedRefreshToken.for_user(self.user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+    
+    def user_queries(self, queries):
+        return [q for q in queries if 'FROM "users"' in q['sql']]
+    
+    def test_user_lookup_is_cached(self):
+        """Only the first request loads the user row"""
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        
+        with CaptureQueriesContext(connection) as first:
+            self.client.get('/api/v1/scores/')
+        with CaptureQueriesContext(connection) as second:
+            response = self.client.get('/api/v1/scores/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(self.user_queries(first.captured_queries)), 1)
+        self.assertEqual(self.user_queries(second.captured_queries), [])
+    
+    def test_profile_changes_invalidate_cache(self):
+        """Plan and quota changes are visible on the next request"""
+        self.client.get('/api/v1/user/profile/')
+        self.user.plan = 'pro'
+        self.user.used_quota_mb = 42
+        self.user.save(update_fields=['plan', 'used_quota_mb'])
+        
+        response = self.client.get('/api/v1/user/profile/')
+        self.assertEqual(response.data['used_quota_mb'], 42)
+    
+    def test_password_change_revokes_tokens(self):
+        """Bumping the token version rejects tokens issued before"""
+        self.assertEqual(self.client.get('/api/v1/scores/').status_code, status.HTTP_200_OK)
+        self.user.set_password('a-new-password-123')
+        self.user.save(update_fields=['password'])
+        self.user.revoke_tokens()
+        
+        response = self.client.get('/api/v1/scores/')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+    
+    def test_password_hash_upgrade_keeps_tokens(self):
+        """check_password re-hashing an outdated password does not revoke tokens"""
+        from core.authentication import VersionedRefreshToken
+        User.objects.filter(pk=self.user.pk).update(password=make_password('testpass123', hasher='pbkdf2_sha1'))
+        user = User.objects.get(pk=self.user.pk)
+        self.assertTrue(user.check_password('testpass123'))
+        self.assertTrue(User.objects.get(pk=user.pk).password.startswith('pbkdf2_sha256$'))
+        self.assertEqual(User.objects.get(pk=user.pk).token_version, user.token_version)
+        
+        token = VersionedRefreshToken.for_user(user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(self.client.get('/api/v1/scores/').status_code, status.HTTP_200_OK)
+    
+    def test_quota_updates_apply_to_stale_cached_user(self):
+        """Quota changes made through a stale copy of the user are not lost"""
+        from core.authentication import get_cached_user
+        stale = get_cached_user(self.user.pk)
+        User.objects.filter(pk=self.user.pk).update(used_quota_mb=10)
+        stale.adjust_used_quota(5)
+        self.assertEqual(User.objects.get(pk=self.user.pk).used_quota_mb, 15)
+        stale.adjust_used_quota(-50)
+        self.assertEqual(User.objects.get(pk=self.user.pk).used_quota_mb, 0)
+    
+    def test_profile_update_keeps_token_version(self):
+        """A profile PATCH served from a stale cached user does not undo a revocation"""
+        from django.db.models import F
+        self.client.get('/api/v1/user/profile/')
+        # Revoked by another process: this process's cached copy is now stale
+        User.objects.filter(pk=self.user.pk).update(token_version=F('token_version') + 1)
+        
+        response = self.client.patch('/api/v1/user/profile/', {'username': 'clara'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(User.objects.get(pk=self.user.pk).token_version, self.user.token_version + 1)
+    
+    def test_profile_update_keeps_password(self):
+        """Saving the cached user never overwrites fields left out of the cache"""
+        old_hash = User.objects.get(pk=self.user.pk).password
+        response = self.client.patch('/api/v1/user/profile/', {'username': 'clara'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        
+        user = User.objects.get(pk=self.user.pk)
+        self.assertEqual(user.username, 'clara')
+        self.assertEqual(user.password, old_hash)
+    
+    def test_cache_entry_from_older_schema(self):
+        """Entries written before a field was added or removed still load correctly"""
+        from django.core.cache import cache
+        from core.authentication import _user_key, get_cached_user, local_user_cache
+        values = User.objects.filter(pk=self.user.pk).values('id', 'email', 'plan', 'token_version').first()
+        values['removed_field'] = 'ignored'
+        local_user_cache.delete(_user_key(self.user.pk))
+        cache.set(_user_key(self.user.pk), values)
+        
+        user = get_cached_user(self.user.pk)
+        self.assertEqual(user.plan, 'solo')
+        self.assertEqual(user.email, self.user.email)
+        # Fields the entry doesn't have are loaded from the database on access
+        self.assertEqual(user.used_quota_mb, self.user.used_quota_mb)
+        self.assertEqual(user.username, self.user.username)
@@ -2,9 +2,11 @@
 Tests for Celery tasks
 """
 import pytest
-from unittest.mock import patch, MagicMock, mock_open
+from unittest.mock import patch, ANY, AsyncMock, MagicMock, mock_open
 from django.test import TestCase
 from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
 from .factories import UserFactory, ScoreFactory
 from tasks.pdf_tasks import process_pdf_info, generate_thumbnail
@@ -63,6 +65,30 @@ class CeleryTaskTest(TestCase):
         self.score.refresh_from_db()
         self.assertEqual(self.score.pages, 5)
     
+    @patch('requests.get')
+    @patch('pdfplumber.open')
+    @patch('tasks.pdf_tasks.S3Handler.generate_presigned_download_url')
+    def test_process_pdf_info_updates_setlist_pages(self, mock_s3_url, mock_pdf, mock_requests):
+        """Test that extracted page counts propagate to setlist totals"""
+        from setlists.models import Setlist, SetlistItem
+        setlist = Setlist.objects.create(user=self.user, title="Concert")
+        SetlistItem.objects.create(setlist=setlist, score=self.score)
+        
+        mock_s3_url.return_value = {'url': 'https://example.com/download/test.pdf'}
+        mock_response = MagicMock()
+        mock_response.content = b'fake pdf content'
+        mock_requests.return_value = mock_response
+        mock_pdf_doc = MagicMock()
+        mock_pdf_doc.pages = [MagicMock() for _ in range(7)]
+        mock_pdf_doc.metadata = {}
+        mock_pdf.return_value.__enter__.return_value = mock_pdf_doc
+        
+        result = process_pdf_info(self.score.id)
+        self.assertTrue(result['success'])
+        
+        setlist.refresh_from_db()
+        self.assertEqual(setlist.total_pages, 7)
+    
     @patch('requests.get')
     @patch('tasks.pdf_tasks.S3Handler.generate_presigned_download_url')  
     def test_process_pdf_info_download_failure(self, mock_s3_url, mock_requests):
@@ -212,8 +238,12 @@ class CeleryTaskTest(TestCase):
             score = serializer.save()
             
             # Verify tasks were called
-            mock_info.delay.assert_called_once_with(score.id)
-            mock_thumbnail.delay.assert_called_once_with(score.id, page_number=1)
+            mock_info.apply_async.assert_called_once_with(
+                args=(score.id,), kwargs={}, task_id=ANY, countdown=None
+            )
+            mock_thumbnail.apply_async.assert_called_once_with(
+                args=(score.id,), kwargs={'page_number': 1}, task_id=ANY, countdown=None
+            )
         else:
             self.fail(f"Serializer validation failed: {serializer.errors}")
     
@@ -252,4 +282,390 @@ class CeleryTaskTest(TestCase):
         # 2. Task retries with exponential backoff
         # 3. Task eventually succeeds or fails permanently
         
-        pass  # Placeholder for retry testing
\ No newline at end of file
+        pass  # Placeholder for retry testing
+
+@pytest.mark.django_db
+class TaskLedgerTest(TestCase):
+    """Test that pipeline tasks keep their (score, kind) Task rows up to date"""
+    
+    def setUp(self):
+        self.user = UserFactory()
+        self.score = ScoreFactory(user=self.user, pages=None)
+    
+    def mock_pdf(self, mock_s3_url, mock_pdf, mock_requests, pages=3):
+        mock_s3_url.return_value = {'url': 'https://example.com/download/test.pdf'}
+        mock_requests.return_value = MagicMock(content=b'fake pdf content')
+        mock_pdf_doc = MagicMock()
+        mock_pdf_doc.pages = [MagicMock() for _ in range(pages)]
+        mock_pdf_doc.metadata = {}
+        mock_pdf.return_value.__enter__.return_value = mock_pdf_doc
+    
+    @patch('requests.get')
+    @patch('pdfplumber.open')
+    @patch('tasks.pdf_tasks.S3Handler.generate_presigned_download_url')
+    def test_runs_upsert_one_row_per_kind(self, mock_s3_url, mock_pdf, mock_requests):
+        """Each run updates the same row and counts tries"""
+        from tasks.models import Task
+        self.mock_pdf(mock_s3_url, mock_pdf, mock_requests)
+        
+        process_pdf_info(self.score.id)
+        process_pdf_info(self.score.id)
+        
+        task = Task.objects.get(score=self.score, kind='pdf_info')
+        self.assertEqual(task.user, self.user)
+        self.assertEqual(task.status, 'SUCCEEDED')
+        self.assertEqual(task.try_count, 2)
+        self.assertEqual(task.result_json['pages'], 3)
+        self.assertIsNotNone(task.duration)
+    
+    @patch('tasks.pdf_tasks.S3Handler')
+    def test_failure_is_recorded(self, mock_s3_handler):
+        """A task that gives up records FAILED with its error"""
+        from tasks.models import Task
+        mock_s3_handler.return_value.generate_presigned_download_url.side_effect = Exception('S3 down')
+        
+        with patch.object(process_pdf_info, 'max_retries', 0):
+            result = process_pdf_info(self.score.id)
+        self.assertFalse(result['success'])
+        
+        task = Task.objects.get(score=self.score, kind='pdf_info')
+        self.assertEqual(task.status, 'FAILED')
+        self.assertEqual(task.error_message, 'S3 down')
+    
+    def test_progress_writes_are_batched(self):
+        """Reporting every page of a 500-page render writes only a few times"""
+        from tasks.models import Task
+        task = Task.objects.start(self.score.id, 'page_thumbnails')
+        
+        with CaptureQueriesContext(connection) as queries:
+            for page in range(1, 501):
+                task.report_progress(page, 500)
+        self.assertLessEqual(len(queries), 21)
+        
+        task.refresh_from_db()
+        self.assertEqual((task.progress_done, task.progress_total, task.progress), (500, 500, 100.0))
+    
+    def test_score_tasks_endpoint(self):
+        """Clients read every task of a score in one request"""
+        from rest_framework.test import APIClient
+        from tasks.models import Task
+        Task.objects.start(self.score.id, 'pdf_info').mark_succeeded({'pages': 3})
+        Task.objects.start(self.score.id, 'thumbnail')
+        
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get(f'/api/v1/scores/{self.score.id}/tasks/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(t['kind'], t['status']) for t in response.data],
+            [('pdf_info', 'SUCCEEDED'), ('thumbnail', 'RUNNING')]
+        )
+        
+        client.force_authenticate(UserFactory())
+        response = client.get(f'/api/v1/scores/{self.score.id}/tasks/')
+        self.assertEqual(response.status_code, 404)
+        response = client.get('/api/v1/scores/not-a-number/tasks/')
+        self.assertEqual(response.status_code, 404)
+
+
+class EnqueueDedupTest(TestCase):
+    """Test that a (score, kind) run is queued at most once at a time"""
+    
+    def setUp(self):
+        cache.clear()
+        self.user = UserFactory()
+        self.score = ScoreFactory(user=self.user)
+    
+    @patch('tasks.pdf_tasks.generate_thumbnail.apply_async')
+    def test_repeated_requests_share_one_run(self, mock_apply):
+        """Repeated clicks return the queued run's id instead of queueing again"""
+        from rest_framework.test import APIClient
+        client = APIClient()
+        client.force_authenticate(self.user)
+        url = f'/api/v1/scores/{self.score.id}/regenerate_thumbnail/'
+        
+        with self.settings(TASK_COALESCE_SECONDS=5):
+            responses = [client.post(url) for _ in range(3)]
+        
+        mock_apply.assert_called_once_with(
+            args=(self.score.id,), kwargs={'page_number': 1},
+            task_id=responses[0].data['task_id'], countdown=5
+        )
+        self.assertEqual({r.data['task_id'] for r in responses}, {responses[0].data['task_id']})
+        self.assertEqual([r.data['deduplicated'] for r in responses], [False, True, True])
+    
+    @patch('tasks.pdf_tasks.S3Handler')
+    def test_claim_released_when_run_finishes(self, mock_s3_handler):
+        """Once the queued run has finished, the next request queues a new one"""
+        from scoremateserver.celery import app
+        from tasks.ledger import enqueue_once, pending_runs
+        mock_s3_handler.return_value.generate_presigned_download_url.side_effect = Exception('S3 down')
+        
+        app.conf.task_always_eager = True
+        try:
+            with patch.object(process_pdf_info, 'max_retries', 0):
+                first_id, first_enqueued = enqueue_once(process_pdf_info, 'pdf_info', self.score.id)
+                self.assertEqual(pending_runs('pdf_info', [self.score.id]), set())
+                second_id, second_enqueued = enqueue_once(process_pdf_info, 'pdf_info', self.score.id)
+        finally:
+            app.conf.task_always_eager = False
+        
+        self.assertTrue(first_enqueued and second_enqueued)
+        self.assertNotEqual(first_id, second_id)
+    
+    @patch('tasks.pdf_tasks.generate_thumbnail')
+    def test_bulk_chunk_skips_queued_scores(self, mock_generate):
+        """A bulk chunk does not render covers that already have a run queued"""
+        from tasks.jobs import create_job
+        from tasks.ledger import _enqueue_key
+        from tasks.pdf_tasks import regenerate_thumbnails_chunk
+        other = ScoreFactory(user=self.user)
+        mock_generate.return_value = {'success': True}
+        cache.set(_enqueue_key('thumbnail', self.score.id), 'queued-task-id')
+        
+        job_id, _ = create_job(self.user.id, 'thumbnail', 2)
+        result = regenerate_thumbnails_chunk(job_id, [self.score.id, other.id])
+        
+        mock_generate.assert_called_once_with(other.id, page_number=1)
+        self.assertEqual(result['succeeded'], 2)
+    
+    @patch('tasks.pdf_tasks.generate_thumbnail')
+    def test_bulk_chunk_of_failed_job_stops(self, mock_generate):
+        """Chunks of a job failed by a stall takeover do no more rendering"""
+        from tasks.jobs import create_job, fail_job, get_job
+        from tasks.pdf_tasks import regenerate_thumbnails_chunk
+        other = ScoreFactory(user=self.user)
+        mock_generate.return_value = {'success': True}
+        
+        job_id, _ = create_job(self.user.id, 'thumbnail', 2)
+        fail_job(job_id, 'No progress; a chunk was lost')
+        result = regenerate_thumbnails_chunk(job_id, [self.score.id, other.id])
+        
+        mock_generate.assert_not_called()
+        self.assertTrue(result['stopped'])
+        self.assertEqual(get_job(job_id)['succeeded'], 0)
+
+
+class AdminTaskRetryTest(TestCase):
+    """Test that admin retries re-enqueue failed pipeline work"""
+    
+    def setUp(self):
+        from rest_framework.test import APIClient
+        from tasks.models import Task
+        cache.clear()
+        self.user = UserFactory()
+        self.scores = [ScoreFactory(user=self.user) for _ in range(5)]
+        self.failed = []
+        for score in self.scores:
+            row = Task.objects.start(score.id, 'thumbnail')
+            row.mark_failed('MinIO unavailable')
+            self.failed.append(row)
+        self.client = APIClient()
+        self.client.force_authenticate(UserFactory(is_staff=True))
+    
+    @patch('tasks.pdf_tasks.generate_thumbnail.apply_async')
+    def test_retry_enqueues_by_kind(self, mock_apply):
+        """Retrying a failed row queues the task for its kind and resets the row"""
+        row = self.failed[0]
+        response = self.client.post(f'/api/v1/admin/tasks/{row.id}/retry/')
+        self.assertEqual(response.status_code, 200)
+        mock_apply.assert_called_once_with(
+            args=(row.score_id,), kwargs={'page_number': 1},
+            task_id=response.data['celery_task_id'], countdown=None
+        )
+        row.refresh_from_db()
+        self.assertEqual((row.status, row.error_message), ('PENDING', ''))
+    
+    def test_retry_unsupported_kind(self):
+        """Kinds without a task to run cannot be retried"""
+        from tasks.models import Task
+        row = Task.objects.start(self.scores[0].id, 'layout_hook')
+        row.mark_failed('boom')
+        response = self.client.post(f'/api/v1/admin/tasks/{row.id}/retry/')
+        self.assertEqual(response.status_code, 400)
+    
+    @patch('tasks.pdf_tasks.generate_thumbnail.apply_async')
+    @patch('tasks.pdf_tasks.retry_tasks_chunk.apply_async')
+    def test_retry_failed_in_chunks(self, mock_chunk, mock_thumbnail):
+        """One action retries every matching failure in staggered chunks"""
+        from tasks.models import Task
+        from tasks.pdf_tasks import retry_tasks_chunk
+        
+        with self.settings(TASK_RETRY_CHUNK_SIZE=2, TASK_RETRY_CHUNK_INTERVAL=10):
+            response = self.client.post('/api/v1/admin/tasks/retry_failed/?kind=thumbnail')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual((response.data['matched'], response.data['chunks']), (5, 3))
+        self.assertEqual([c.kwargs['countdown'] for c in mock_chunk.call_args_list], [0, 10, 20])
+        self.assertFalse(Task.objects.filter(status='FAILED').exists())
+        
+        # Matched rows are no longer FAILED, so repeating the action queues nothing
+        response = self.client.post('/api/v1/admin/tasks/retry_failed/?kind=thumbnail')
+        self.assertEqual(response.data['matched'], 0)
+        
+        for call in mock_chunk.call_args_list:
+            retry_tasks_chunk(*call.args[0])
+        self.assertEqual(mock_thumbnail.call_count, 5)
+        self.assertEqual({c.kwargs['queue'] for c in mock_thumbnail.call_args_list}, {'render-bulk'})
+    
+    def test_retry_requires_staff(self):
+        """Regular users cannot retry tasks"""
+        self.client.force_authenticate(self.user)
+        response = self.client.post('/api/v1/admin/tasks/retry_failed/')
+        self.assertEqual(response.status_code, 403)
+
+
+class LiveEventsTest(TestCase):
+    """Test that pipeline tasks publish per-user events and the SSE stream relays them"""
+    
+    def setUp(self):
+        self.user = UserFactory()
+        self.score = ScoreFactory(user=self.user, pages=None)
+    
+    @patch('requests.get')
+    @patch('pdfplumber.open')
+    @patch('tasks.pdf_tasks.S3Handler.generate_presigned_download_url')
+    @patch('tasks.events._get_client')
+    def test_pipeline_publishes_user_events(self, mock_client, mock_s3_url, mock_pdf, mock_requests):
+        """A PDF info run publishes started, score.updated and done to the owner's channel"""
+        import json
+        from django.test import override_settings
+        TaskLedgerTest.mock_pdf(self, mock_s3_url, mock_pdf, mock_requests)
+        
+        with override_settings(EVENTS_REDIS_URL='redis://localhost:6379/0'):
+            process_pdf_info(self.score.id)
+        
+        calls = mock_client.return_value.publish.call_args_list
+        self.assertEqual({c.args[0] for c in calls}, {f'events:user:{self.user.id}'})
+        messages = [json.loads(c.args[1]) for c in calls]
+        self.assertEqual([m['event'] for m in messages], ['task.started', 'score.updated', 'task.done'])
+        self.assertEqual(messages[1]['data']['pages'], 3)
+        self.assertEqual(messages[2]['data']['status'], 'SUCCEEDED')
+    
+    @patch('tasks.events._get_client')
+    def test_nothing_published_without_redis(self, mock_client):
+        """Publishing is a no-op when live events are not configured"""
+        from django.test import override_settings
+        from tasks.events import publish_user_event
+        with override_settings(EVENTS_REDIS_URL=None):
+            publish_user_event(self.user.id, 'task.started', {})
+        mock_client.assert_not_called()
+    
+    def stream_ticket(self):
+        from rest_framework.test import APIClient
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        response = client.post('/api/v1/events/ticket/')
+        self.assertEqual(response.status_code, 201)
+        return response.json()['ticket']
+    
+    def test_stream_requires_authentication(self):
+        """The stream rejects anonymous clients and accepts a stream ticket"""
+        from django.test import override_settings
+        from rest_framework_simplejwt.tokens import AccessToken
+        response = self.client.get('/api/v1/events/')
+        self.assertEqual(response.status_code, 401)
+        response = self.client.get('/api/v1/events/', {'ticket': 'not-a-ticket'})
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json()['error']['code'], 'token_not_valid')
+        self.assertEqual(self.client.post('/api/v1/events/ticket/').status_code, 401)
+        
+        with override_settings(EVENTS_REDIS_URL=None):
+            response = self.client.get('/api/v1/events/', {'ticket': self.stream_ticket()})
+            self.assertEqual(response.status_code, 503)
+            response = self.client.get('/api/v1/events/', HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+            self.assertEqual(response.status_code, 503)
+    
+    def test_stream_ticket_is_single_use(self):
+        """A ticket opens one stream; access tokens are not accepted in the URL"""
+        from django.test import override_settings
+        from rest_framework_simplejwt.tokens import AccessToken
+        ticket = self.stream_ticket()
+        with override_settings(EVENTS_REDIS_URL=None):
+            self.assertEqual(self.client.get('/api/v1/events/', {'ticket': ticket}).status_code, 503)
+            self.assertEqual(self.client.get('/api/v1/events/', {'ticket': ticket}).status_code, 401)
+            response = self.client.get('/api/v1/events/', {'token': str(AccessToken.for_user(self.user))})
+            self.assertEqual(response.status_code, 401)
+    
+    def test_stream_ticket_rejects_inactive_user(self):
+        """A ticket issued before the user was deactivated no longer opens the stream"""
+        from django.test import override_settings
+        ticket = self.stream_ticket()
+        self.user.is_active = False
+        self.user.save()
+        with override_settings(EVENTS_REDIS_URL=None):
+            self.assertEqual(self.client.get('/api/v1/events/', {'ticket': ticket}).status_code, 401)
+    
+    def test_stream_requires_asgi(self):
+        """Under WSGI the stream is refused rather than holding a worker forever"""
+        import asyncio
+        from django.test import AsyncClient, override_settings
+        
+        async def empty_stream(user_id):
+            yield ': keepalive\n\n'
+        
+        with override_settings(EVENTS_REDIS_URL='redis://localhost:6379/0'), \
+                patch('tasks.views.stream_user_events', side_effect=empty_stream):
+            response = self.client.get('/api/v1/events/', {'ticket': self.stream_ticket()})
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response.json()['error']['code'], 'events_require_asgi')
+            
+            response = asyncio.run(AsyncClient().get('/api/v1/events/', {'ticket': self.stream_ticket()}))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], 'text/event-stream')
+    
+    def test_stream_relays_channel_messages(self):
+        """Published messages are encoded as SSE events, with keepalives while idle"""
+        import asyncio
+        import json
+        from django.test import override_settings
+        from tasks.events import stream_user_events
+        
+        pubsub = MagicMock()
+        pubsub.subscribe = AsyncMock()
+        pubsub.aclose = AsyncMock()
+        pubsub.get_message = AsyncMock(side_effect=[
+            {'data': json.dumps({'event': 'task.progress', 'data': {'progress': 50.0}})},
+            None,
+        ])
+        client = MagicMock(pubsub=MagicMock(return_value=pubsub), aclose=AsyncMock())
+        
+        async def read(count):
+            stream = stream_user_events(self.user.id)
+            try:
+                return [await stream.__anext__() for _ in range(count)]
+            finally:
+                await stream.aclose()
+        
+        with override_settings(EVENTS_REDIS_URL='redis://localhost:6379/0'), \
+                patch('redis.asyncio.Redis.from_url', return_value=client):
+            chunks = asyncio.run(read(4))
+        
+        pubsub.subscribe.assert_awaited_once_with(f'events:user:{self.user.id}')
+        self.assertTrue(chunks[0].startswith('retry:'))
+        self.assertTrue(chunks[1].startswith('event: ready\n'))
+        self.assertEqual(chunks[2], 'event: task.progress\ndata: {"progress": 50.0}\n\n')
+        self.assertEqual(chunks[3], ': keepalive\n\n')
+        pubsub.aclose.assert_awaited_once()
+
+
+class CeleryRoutingTest(TestCase):
+    """Test that tasks are routed to their dedicated queues"""
+    
+    def route(self, task_name):
+        from scoremateserver.celery import app
+        return app.amqp.router.route({}, task_name)['queue'].name
+    
+    def test_interactive_and_bulk_work_use_separate_queues(self):
+        """Upload processing never shares a queue with bulk rendering"""
+        self.assertEqual(self.route('tasks.pdf_tasks.process_pdf_info'), 'ingest-interactive')
+        self.assertEqual(self.route('tasks.pdf_tasks.generate_thumbnail'), 'ingest-interactive')
+        self.assertEqual(self.route('tasks.pdf_tasks.generate_all_page_thumbnails'), 'render-bulk')
+        self.assertEqual(self.route('tasks.pdf_tasks.regenerate_thumbnails_chunk'), 'render-bulk')
+    
+    def test_storage_and_maintenance_queues(self):
+        """File deletion and cleanup have their own queues; unrouted tasks default to maintenance"""
+        self.assertEqual(self.route('tasks.file_tasks.delete_score_files'), 'storage-io')
+        self.assertEqual(self.route('tasks.file_tasks.delete_single_file'), 'storage-io')
+        self.assertEqual(self.route('tasks.file_tasks.cleanup_orphaned_files'), 'maintenance')
+        self.assertEqual(self.route('tasks.file_tasks.cleanup_expired_uploads'), 'maintenance')
+        self.assertEqual(self.route('scoremateserver.celery.debug_task'), 'maintenance')
@@ -2,8 +2,11 @@
 Tests for core models - User quota system
 """
 import pytest
+from datetime import date, datetime, timedelta
 from django.test import TestCase
-from django.db import IntegrityError
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+from core.audit import AuditBuffer, audit_buffer, ensure_partitions, prune_partitions
 from core.models import User, ReferralLog, BillingLog, AccessLog
 from .factories import UserFactory, ReferralLogFactory
 
@@ -180,4 +183,124 @@ class TestReferralLogModel(TestCase):
                 user=self.referrer,
                 referred_user=self.referred,
                 bonus_mb=50
-            )
\ No newline at end of file
+            )
+
+
+@pytest.mark.django_db
+class TestAccessLogAudit(TestCase):
+    """Test the batched audit writer and access_logs partition maintenance"""
+    
+    def setUp(self):
+        self.user = UserFactory(email="audit@test.com", username="audit")
+    
+    def make_event(self, **overrides):
+        event = {
+            'user_id': self.user.id,
+            'action': 'download',
+            'target_type': 'score',
+            'target_id': 1,
+            'meta_json': {},
+            'ip_address': '127.0.0.1',
+            'user_agent': '',
+            'created_at': timezone.now() - timedelta(minutes=5),
+        }
+        event.update(overrides)
+        return event
+    
+    def test_flush_writes_batches_with_event_time(self):
+        """Buffered events are written in batches and keep the time they were recorded"""
+        buffer = AuditBuffer(maxsize=100, batch_size=2, interval=60)
+        events = [self.make_event(target_id=i) for i in range(5)]
+        for event in events:
+            self.assertTrue(buffer.put(event))
+        
+        with self.assertNumQueries(3):
+            self.assertEqual(buffer.flush(), 5)
+        
+        logs = AccessLog.objects.filter(user=self.user).order_by('target_id')
+        self.assertEqual([log.target_id for log in logs], list(range(5)))
+        self.assertEqual(logs[0].created_at, events[0]['created_at'])
+        self.assertEqual(buffer.stats(), {'recorded': 5, 'dropped': 0, 'written': 5, 'failed': 0, 'pending': 0})
+    
+    def test_full_buffer_drops_and_counts(self):
+        """Events beyond the buffer size are dropped instead of blocking, exported and logged"""
+        from prometheus_client import REGISTRY
+        
+        def exported_drops():
+            return REGISTRY.get_sample_value('scoremate_audit_events_total', {'outcome': 'dropped'}) or 0
+        
+        before = exported_drops()
+        buffer = AuditBuffer(maxsize=2, batch_size=10, interval=60)
+        with self.assertLogs('core.audit', level='WARNING') as logs:
+            results = [buffer.put(self.make_event()) for _ in range(5)]
+        
+        self.assertEqual(results, [True, True, False, False, False])
+        self.assertEqual(buffer.stats()['dropped'], 3)
+        self.assertEqual(buffer.stats()['pending'], 2)
+        self.assertEqual(exported_drops() - before, 3)
+        # Drops in quick succession are reported once
+        self.assertEqual(len(logs.records), 1)
+    
+    def test_failed_batch_is_counted(self):
+        """A batch the database rejects is dropped and counted, not retried forever"""
+        buffer = AuditBuffer(maxsize=10, batch_size=10, interval=60)
+        buffer.put(self.make_event(action='x' * 100))
+        
+        with transaction.atomic():
+            self.assertEqual(buffer.flush(), 0)
+        self.assertEqual(buffer.stats()['failed'], 1)
+        self.assertEqual(buffer.stats()['pending'], 0)
+    
+    def test_login_records_event(self):
+        """Logging in queues an audit event without writing it on the request"""
+        self.client.post('/api/v1/auth/login/', {'email': 'audit@test.com', 'password': 'testpass123'})
+        self.assertFalse(AccessLog.objects.exists())
+        
+        audit_buffer.flush()
+        log = AccessLog.objects.get(user=self.user)
+        self.assertEqual(log.action, 'login')
+        self.assertEqual(log.target_id, self.user.id)
+    
+    def test_event_records_trusted_client_address(self):
+        """The recorded address is the one the trusted proxy saw, not a client-supplied one"""
+        with self.settings(RATE_LIMIT_TRUSTED_PROXIES=1):
+            self.client.post('/api/v1/auth/login/', {'email': 'audit@test.com', 'password': 'testpass123'},
+                             HTTP_X_FORWARDED_FOR='10.0.0.99, 203.0.113.7')
+        
+        audit_buffer.flush()
+        self.assertEqual(AccessLog.objects.get(user=self.user).ip_address, '203.0.113.7')
+    
+    def test_partition_maintenance(self):
+        """Upcoming partitions are created and partitions past retention dropped"""
+        self.assertEqual(ensure_partitions(months_ahead=0, today=date(2020, 1, 15)), ['access_logs_p202001'])
+        self.assertEqual(ensure_partitions(months_ahead=0, today=date(2020, 1, 15)), [])
+        
+        AccessLog.objects.create(user=self.user, action='login', target_type='user',
+                                 created_at=timezone.make_aware(datetime(2020, 1, 20)))
+        created = ensure_partitions(months_ahead=2)
+        with connection.cursor() as cursor:
+            # Run the deferred FK check now; Postgres won't drop a table with pending trigger events
+            cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        
+        self.assertEqual(prune_partitions(retention_months=6), ['access_logs_p202001'])
+        self.assertFalse(AccessLog.objects.filter(created_at__year=2020).exists())
+        self.assertEqual(prune_partitions(retention_months=6), [])
+        self.assertEqual(len(created), 1)  # This month and next exist from the migration
+    
+    def test_rows_in_default_partition_get_their_own_partition(self):
+        """A month missed by maintenance moves out of the default partition and then expires"""
+        AccessLog.objects.create(user=self.user, action='login', target_type='user',
+                                 created_at=timezone.make_aware(datetime(2019, 5, 10)))
+        with connection.cursor() as cursor:
+            cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+            cursor.execute('SELECT count(*) FROM access_logs_default')
+            self.assertEqual(cursor.fetchone()[0], 1)
+            
+            self.assertEqual(ensure_partitions(months_ahead=0, today=date(2019, 5, 15)), ['access_logs_p201905'])
+            cursor.execute('SELECT count(*) FROM access_logs_default')
+            self.assertEqual(cursor.fetchone()[0], 0)
+            cursor.execute('SELECT count(*) FROM access_logs_p201905')
+            self.assertEqual(cursor.fetchone()[0], 1)
+        
+        self.assertIn('access_logs_p201905', prune_partitions(retention_months=6))
+        self.assertFalse(AccessLog.objects.filter(created_at__year=2019).exists())
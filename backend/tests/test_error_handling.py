@@ -9,6 +9,7 @@ from rest_framework_simplejwt.tokens import RefreshToken
 from unittest.mock import patch
 
 from core.models import User
+from core.throttling import PlanRateThrottle
 from core.exceptions import (
     ScoreMateError, ValidationError, QuotaExceededError,
     FileProcessingError, S3Error, TaskError,
@@ -369,6 +370,317 @@ class MiddlewareTest(APITestCase):
         
         quota_data = response.data['quota_summary']
         self.assertEqual(quota_data['percentage_used'], 95.0)
+    
+    def test_structured_access_log(self):
+        """Each API request emits one access record with its timing breakdown"""
+        self.client.force_authenticate(self.user)
+        with self.assertLogs('core.access', level='INFO') as logs:
+            self.client.get('/api/v1/scores/')
+        
+        self.assertEqual(len(logs.records), 1)
+        fields = logs.records[0].fields
+        self.assertEqual((fields['method'], fields['path'], fields['status']), ('GET', '/api/v1/scores/', 200))
+        self.assertEqual(fields['user_id'], self.user.id)
+        self.assertGreater(fields['db_calls'], 0)
+        self.assertGreaterEqual(fields['duration_ms'], fields['db_ms'])
+    
+    def test_access_log_sampling(self):
+        """Successful GETs are sampled; writes and errors are always logged"""
+        self.client.force_authenticate(self.user)
+        with self.settings(ACCESS_LOG_SAMPLE_RATE=0.0), self.assertLogs('core.access', level='INFO') as logs:
+            self.client.get('/api/v1/scores/')
+            self.client.get('/api/v1/scores/999999/')
+            self.client.post('/api/v1/scores/', {})
+        self.assertEqual([r.fields['status'] for r in logs.records], [404, 400])
+    
+    def test_json_formatter(self):
+        """Records are rendered as one JSON object per line"""
+        import json
+        import logging
+        from core.access_log import JSONFormatter
+        record = logging.LogRecord('core.access', logging.INFO, __file__, 1, 'request', None, None)
+        record.fields = {'status': 200, 'duration_ms': 1.5}
+        entry = json.loads(JSONFormatter().format(record))
+        self.assertEqual((entry['message'], entry['status'], entry['duration_ms']), ('request', 200, 1.5))
+    
+    def test_rate_limit_per_endpoint_budget(self):
+        """Requests over an endpoint budget get 429 with Retry-After; other endpoints are unaffected"""
+        refresh = RefreshToken.for_user(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {refresh.access_token}')
+        budgets = [('upload-url', '/api/v1/files/upload-url/', '2/m'), ('api', '/api/', '100/m')]
+        
+        with self.settings(RATE_LIMITS=budgets):
+            responses = [self.client.post('/api/v1/files/upload-url/', {}) for _ in range(3)]
+            other = self.client.get('/api/v1/scores/')
+        
+        self.assertNotEqual(responses[1].status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(responses[1]['X-RateLimit-Remaining'], '0')
+        self.assertEqual(responses[2].status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(responses[2].json()['error']['code'], 'rate_limit_exceeded')
+        self.assertTrue(1 <= int(responses[2]['Retry-After']) <= 30)
+        self.assertEqual(other.status_code, status.HTTP_200_OK)
+    
+    def test_rate_limit_keyed_by_user(self):
+        """Each user has their own budget, even from the same IP address"""
+        budgets = [('api', '/api/', '1/m')]
+        other_user = UserFactory()
+        
+        with self.settings(RATE_LIMITS=budgets):
+            for user in (self.user, other_user):
+                token = RefreshToken.for_user(user).access_token
+                self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+                self.assertEqual(self.client.get('/api/v1/scores/').status_code, status.HTTP_200_OK)
+            self.assertEqual(self.client.get('/api/v1/scores/').status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+    
+    def test_rate_limit_ignores_client_supplied_forwarded_for(self):
+        """Anonymous clients are counted by the address the proxy appended, not a spoofable one"""
+        budgets = [('auth', '/api/v1/auth/', '2/m')]
+        
+        def login(forwarded_for):
+            return self.client.post('/api/v1/auth/login/', {'email': 'x@example.com', 'password': 'x'},
+                                    HTTP_X_FORWARDED_FOR=forwarded_for).status_code
+        
+        with self.settings(RATE_LIMITS=budgets, RATE_LIMIT_TRUSTED_PROXIES=1):
+            codes = [login(f'10.0.0.{i}, 203.0.113.7') for i in range(3)]
+            other_client = login('203.0.113.8')
+        self.assertEqual(codes[2], status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertNotEqual(other_client, status.HTTP_429_TOO_MANY_REQUESTS)
+        
+        with self.settings(RATE_LIMITS=budgets, RATE_LIMIT_TRUSTED_PROXIES=0):
+            # Without a trusted proxy the header is ignored entirely
+            codes = [login(f'198.51.100.{i}') for i in range(3)]
+        self.assertEqual(codes[2], status.HTTP_429_TOO_MANY_REQUESTS)
+
+
+class PlanThrottleTest(APITestCase):
+    """Test plan-tiered throttling on the shared cache"""
+    
+    RATES = {
+        'user': {'anon': ('2/min', '100/hour'), 'solo': ('100/min', '1000/hour')},
+        'statistics': {'solo': ('2/min', '3/hour'), 'pro': ('4/min', '100/hour')},
+    }
+    
+    def setUp(self):
+        self.client = APIClient()
+    
+    def get_statistics(self, user, times):
+        self.client.force_authenticate(user)
+        with self.settings(THROTTLE_PLAN_RATES=self.RATES):
+            return [self.client.get('/api/v1/scores/statistics/').status_code for _ in range(times)]
+    
+    def test_scope_burst_tier_by_plan(self):
+        """Heavy endpoints get their own budget, larger on higher plans"""
+        self.assertEqual(self.get_statistics(UserFactory(plan='solo'), 3), [200, 200, 429])
+        self.assertEqual(self.get_statistics(UserFactory(plan='pro'), 5), [200] * 4 + [429])
+    
+    def test_sustained_tier_and_retry_after(self):
+        """The sustained tier applies once the burst tier has room, with a Retry-After header"""
+        user = UserFactory(plan='solo')
+        hour_start = 3600 * 500000
+        with patch.object(PlanRateThrottle, 'timer', return_value=hour_start):
+            self.assertEqual(self.get_statistics(user, 2), [200, 200])
+        with patch.object(PlanRateThrottle, 'timer', return_value=hour_start + 60):
+            statuses = self.get_statistics(user, 1)
+            self.client.force_authenticate(user)
+            with self.settings(THROTTLE_PLAN_RATES=self.RATES):
+                response = self.client.get('/api/v1/scores/statistics/')
+        self.assertEqual(statuses, [200])
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(int(response['Retry-After']), 3540)
+        
+        # Other endpoints only count against the general budget
+        with self.settings(THROTTLE_PLAN_RATES=self.RATES):
+            self.assertEqual(self.client.get('/api/v1/scores/').status_code, status.HTTP_200_OK)
+    
+    def test_anonymous_throttled_by_ip(self):
+        """Anonymous requests use the anon rates"""
+        with self.settings(THROTTLE_PLAN_RATES=self.RATES):
+            statuses = [self.client.post('/api/v1/auth/login/', {}).status_code for _ in range(3)]
+        self.assertNotEqual(statuses[1], status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(statuses[2], status.HTTP_429_TOO_MANY_REQUESTS)
+    
+    def test_anonymous_ident_ignores_spoofed_forwarded_for(self):
+        """Rotating a client-supplied X-Forwarded-For entry does not reset the anon budget"""
+        with self.settings(THROTTLE_PLAN_RATES=self.RATES, RATE_LIMIT_TRUSTED_PROXIES=1):
+            statuses = [
+                self.client.post('/api/v1/auth/login/', {},
+                                 HTTP_X_FORWARDED_FOR=f'198.51.100.{attempt}, 203.0.113.7').status_code
+                for attempt in range(3)
+            ]
+        self.assertEqual(statuses[2], status.HTTP_429_TOO_MANY_REQUESTS)
+
+
+class ProfilingMiddlewareTest(APITestCase):
+    """Test staff request profiling and the admin profile API"""
+    
+    def setUp(self):
+        self.staff = UserFactory(is_staff=True)
+        self.user = UserFactory()
+    
+    def authenticate(self, user):
+        refresh = RefreshToken.for_user(user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {refresh.access_token}')
+    
+    def test_staff_request_is_profiled(self):
+        """A staff request with X-Profile gets a stored profile with its SQL log"""
+        import marshal
+        self.authenticate(self.staff)
+        response = self.client.get('/api/v1/scores/', HTTP_X_PROFILE='1')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        profile_id = response['X-Profile-Id']
+        
+        profile = self.client.get(f'/api/v1/admin/profiles/{profile_id}/').data
+        self.assertEqual((profile['method'], profile['path'], profile['status']), ('GET', '/api/v1/scores/', 200))
+        self.assertGreater(profile['queries']['count'], 0)
+        self.assertIn('cumulative', profile['functions'])
+        
+        listed = self.client.get('/api/v1/admin/profiles/').data
+        self.assertEqual([entry['id'] for entry in listed], [profile_id])
+        self.assertNotIn('functions', listed[0])
+        
+        download = self.client.get(f'/api/v1/admin/profiles/{profile_id}/download/')
+        self.assertEqual(download['Content-Type'], 'application/octet-stream')
+        self.assertTrue(marshal.loads(download.content))
+    
+    def test_query_param_trigger(self):
+        """?_profile=1 works like the header, for links opened in a browser"""
+        self.authenticate(self.staff)
+        response = self.client.get('/api/v1/scores/?_profile=1')
+        self.assertIn('X-Profile-Id', response)
+    
+    def test_non_staff_is_not_profiled(self):
+        """Other users' requests run normally and cannot read profiles"""
+        self.authenticate(self.user)
+        response = self.client.get('/api/v1/scores/', HTTP_X_PROFILE='1')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertEqual(self.client.get('/api/v1/admin/profiles/').status_code, status.HTTP_403_FORBIDDEN)
+    
+    def test_concurrent_request_is_not_profiled(self):
+        """A request arriving while another is profiled is served normally"""
+        from core.profiling import profiler_lock
+        self.authenticate(self.staff)
+        with profiler_lock:
+            response = self.client.get('/api/v1/scores/', HTTP_X_PROFILE='1')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('X-Profile-Id', response)
+        
+        response = self.client.get('/api/v1/scores/', HTTP_X_PROFILE='1')
+        self.assertIn('X-Profile-Id', response)
+    
+    def test_profile_index_keeps_newest(self):
+        """Every saved profile is listed, newest first, up to PROFILE_MAX_STORED"""
+        self.authenticate(self.staff)
+        with self.settings(PROFILE_MAX_STORED=3):
+            ids = [self.client.get('/api/v1/scores/', HTTP_X_PROFILE='1')['X-Profile-Id'] for _ in range(4)]
+            listed = self.client.get('/api/v1/admin/profiles/').data
+        self.assertEqual([entry['id'] for entry in listed], ids[:0:-1])
+    
+    def test_query_log_summary(self):
+        """Repeated statements are reported as duplicates, slowest first otherwise"""
+        from core.profiling import QueryLog
+        log = QueryLog()
+        log.queries = [('SELECT 1', 0.001), ('SELECT 2', 0.005), ('SELECT 1', 0.002)]
+        summary = log.summary()
+        self.assertEqual(summary['count'], 3)
+        self.assertEqual(summary['duplicates'], [{'sql': 'SELECT 1', 'count': 2}])
+        self.assertEqual(summary['slowest'][0], {'sql': 'SELECT 2', 'duration_ms': 5.0})
+
+
+class MetricsTest(APITestCase):
+    """Test Prometheus metrics collection and the scrape endpoint"""
+    
+    def setUp(self):
+        self.user = UserFactory()
+    
+    def sample(self, name, **labels):
+        from prometheus_client import REGISTRY
+        return REGISTRY.get_sample_value(name, labels) or 0
+    
+    def test_request_latency_and_db_per_route(self):
+        """Every API request is observed under its URL name, with its query count"""
+        self.client.force_authenticate(self.user)
+        before = self.sample('scoremate_http_request_db_queries_count', route='scores:score-list')
+        
+        response = self.client.get('/api/v1/scores/')
+        
+        self.assertEqual(response.wsgi_request.resolver_match.view_name, 'scores:score-list')
+        self.assertEqual(self.sample('scoremate_http_request_db_queries_count', route='scores:score-list'), before + 1)
+        self.assertGreater(self.sample('scoremate_http_request_duration_seconds_count',
+                                       method='GET', route='scores:score-list', status='2xx'), 0)
+    
+    def test_celery_pool_children_reuse_sample_files(self):
+        """A recycled pool child takes over its slot's files; other processes use their pid"""
+        import os
+        from unittest.mock import MagicMock
+        from core.metrics import HOSTNAME, process_identifier
+        
+        self.assertEqual(process_identifier(), f"{HOSTNAME}-{os.getpid()}")
+        with patch('core.metrics.current_process', return_value=MagicMock(index=1)):
+            self.assertEqual(process_identifier(), f"{HOSTNAME}-celery1")
+        self.assertEqual(process_identifier(1234), f"{HOSTNAME}-1234")
+    
+    def test_metrics_endpoint_requires_token(self):
+        """/metrics is off without METRICS_TOKEN and needs the bearer token when on"""
+        self.assertEqual(self.client.get('/metrics').status_code, status.HTTP_404_NOT_FOUND)
+        with self.settings(METRICS_TOKEN='scrape-secret'):
+            self.assertEqual(self.client.get('/metrics').status_code, status.HTTP_401_UNAUTHORIZED)
+            response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape-secret')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn(b'scoremate_http_request_duration_seconds', response.content)
+    
+    def test_celery_task_duration_and_queue_wait(self):
+        """Task run time is observed per task; queue wait from the publish header"""
+        import time
+        from types import SimpleNamespace
+        from core.metrics import start_task_timer, stop_task_timer
+        
+        task = SimpleNamespace(name='tasks.example', request=SimpleNamespace(published_at=time.time() - 5, eta=None))
+        start_task_timer(task_id='t1', task=task)
+        stop_task_timer(task_id='t1', task=task, state='SUCCESS')
+        
+        self.assertEqual(self.sample('scoremate_celery_task_duration_seconds_count',
+                                     task='tasks.example', state='SUCCESS'), 1)
+        self.assertGreaterEqual(self.sample('scoremate_celery_task_queue_wait_seconds_sum',
+                                            task='tasks.example'), 5)
+    
+    def test_cache_and_quota_counters(self):
+        """Aggregate cache lookups count hits and misses; reservations count by outcome"""
+        from core.cache import get_or_set_user_cache
+        from files.utils import QuotaManager
+        
+        misses = self.sample('scoremate_cache_requests_total', cache='metrics_test', result='miss')
+        hits = self.sample('scoremate_cache_requests_total', cache='metrics_test', result='hit')
+        for _ in range(2):
+            get_or_set_user_cache('scores', self.user.id, 'metrics_test', lambda: {'n': 1})
+        self.assertEqual(self.sample('scoremate_cache_requests_total', cache='metrics_test', result='miss'), misses + 1)
+        self.assertEqual(self.sample('scoremate_cache_requests_total', cache='metrics_test', result='hit'), hits + 1)
+        
+        reserved = self.sample('scoremate_quota_reservations_total', outcome='reserved')
+        expired = self.sample('scoremate_quota_reservations_total', outcome='expired')
+        QuotaManager.reserve_quota(self.user, 1024)
+        with self.assertRaises(ValueError):
+            QuotaManager.confirm_quota(self.user, 'missing-upload')
+        self.assertEqual(self.sample('scoremate_quota_reservations_total', outcome='reserved'), reserved + 1)
+        self.assertEqual(self.sample('scoremate_quota_reservations_total', outcome='expired'), expired + 1)
+    
+    def test_s3_latency_per_operation(self):
+        """S3 calls made through an instrumented client are timed per operation"""
+        import io
+        import boto3
+        from botocore.awsrequest import AWSResponse
+        from urllib3 import HTTPResponse
+        from core.access_log import instrument_boto3_client
+        
+        client = instrument_boto3_client(boto3.client(
+            's3', region_name='us-east-1', aws_access_key_id='x', aws_secret_access_key='x'))
+        # Answer at the HTTP layer so the full call/event sequence still runs
+        client.meta.events.register('before-send', lambda **kwargs: AWSResponse(
+            kwargs['request'].url, 204, {}, HTTPResponse(body=io.BytesIO(), status=204, preload_content=False)))
+        before = self.sample('scoremate_s3_request_duration_seconds_count', operation='DeleteObject', outcome='ok')
+        client.delete_object(Bucket='b', Key='k')
+        self.assertEqual(self.sample('scoremate_s3_request_duration_seconds_count',
+                                     operation='DeleteObject', outcome='ok'), before + 1)
 
 
 class ErrorLoggingTest(TestCase):
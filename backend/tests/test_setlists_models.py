@@ -4,7 +4,8 @@ Tests for setlists models - Order management and statistics
 import pytest
 from django.test import TestCase
 from django.db import IntegrityError
-from setlists.models import Setlist, SetlistItem
+from scores.models import Score
+from setlists.models import Setlist, SetlistItem, ORDER_GAP
 from .factories import UserFactory, ScoreFactory, SetlistFactory, SetlistItemFactory
 
 
@@ -46,21 +47,74 @@ class TestSetlistOrderManagement(TestCase):
         self.assertEqual(item3.order_index, 3)
     
     def test_manual_order_assignment(self):
-        """Test manual order_index assignment"""
-        # Create item with specific order
+        """Test manual order_index assignment is clamped to a dense position"""
+        # Requesting position 5 in an empty setlist places the item first
         item1 = SetlistItem.objects.create(
             setlist=self.setlist,
             score=self.score1,
             order_index=5
         )
-        self.assertEqual(item1.order_index, 5)
+        self.assertEqual(item1.order_index, 1)
         
-        # Next automatic assignment should be 6
+        # Next automatic assignment appends after it
         item2 = SetlistItem.objects.create(
             setlist=self.setlist,
             score=self.score2
         )
-        self.assertEqual(item2.order_index, 6)
+        self.assertEqual(item2.order_index, 2)
+    
+    def test_insert_writes_single_row(self):
+        """Inserting in the middle leaves existing sort keys untouched"""
+        item1 = SetlistItem.objects.create(setlist=self.setlist, score=self.score1)
+        item3 = SetlistItem.objects.create(setlist=self.setlist, score=self.score3)
+        keys_before = list(SetlistItem.objects.values_list('sort_key', flat=True))
+        
+        item2 = SetlistItem.objects.create(setlist=self.setlist, score=self.score2, order_index=2)
+        self.assertEqual(item2.order_index, 2)
+        self.assertEqual(
+            list(SetlistItem.objects.exclude(pk=item2.pk).values_list('sort_key', flat=True)),
+            keys_before
+        )
+        
+        positions = [
+            (item.pk, item.order_index)
+            for item in SetlistItem.objects.filter(setlist=self.setlist).with_positions()
+        ]
+        self.assertEqual(positions, [(item1.pk, 1), (item2.pk, 2), (item3.pk, 3)])
+    
+    def test_move_to(self):
+        """Moving an item rewrites only its own sort key"""
+        items = [
+            SetlistItem.objects.create(setlist=self.setlist, score=score)
+            for score in (self.score1, self.score2, self.score3)
+        ]
+        
+        with self.assertNumQueries(2):
+            items[0].move_to(3)
+        self.assertEqual(items[0].order_index, 3)
+        self.assertEqual(
+            list(self.setlist.items.values_list('pk', flat=True)),
+            [items[1].pk, items[2].pk, items[0].pk]
+        )
+        
+        items[0].move_to(1)
+        self.assertEqual(
+            list(self.setlist.items.values_list('pk', flat=True)),
+            [item.pk for item in items]
+        )
+    
+    def test_rebalance_when_gap_exhausted(self):
+        """Inserting between adjacent keys respaces the setlist first"""
+        item1 = SetlistItem.objects.create(setlist=self.setlist, score=self.score1)
+        item3 = SetlistItem.objects.create(setlist=self.setlist, score=self.score3)
+        SetlistItem.objects.filter(pk=item1.pk).update(sort_key=10)
+        SetlistItem.objects.filter(pk=item3.pk).update(sort_key=11)
+        
+        item2 = SetlistItem.objects.create(setlist=self.setlist, score=self.score2, order_index=2)
+        self.assertEqual(
+            list(self.setlist.items.values_list('pk', 'sort_key')),
+            [(item1.pk, ORDER_GAP), (item2.pk, ORDER_GAP + ORDER_GAP // 2), (item3.pk, 2 * ORDER_GAP)]
+        )
     
     def test_setlist_item_uniqueness(self):
         """Test that same score cannot be added to setlist twice"""
@@ -96,10 +150,18 @@ class TestSetlistOrderManagement(TestCase):
             order_index=2
         )
         
-        # Get items in order
-        ordered_items = self.setlist.items.all()
+        # Get items in order; positions come from with_positions(), never a query per item
+        ordered_items = self.setlist.items.with_positions()
         self.assertEqual(list(ordered_items), [item1, item2, item3])
         self.assertEqual([item.order_index for item in ordered_items], [1, 2, 3])
+        with self.assertNumQueries(1):
+            self.assertEqual([item.order_index for item in self.setlist.items.all()], [None] * 3)
+        
+        # An item loaded on its own computes its position only when asked
+        item = SetlistItem.objects.get(pk=item2.pk)
+        with self.assertNumQueries(1):
+            self.assertEqual(item.load_position(), 2)
+        self.assertEqual(item.order_index, 2)
 
 
 @pytest.mark.django_db
@@ -238,4 +300,82 @@ class TestSetlistItemModel(TestCase):
         )
         
         expected_str = f"{self.setlist.title} - 1: {self.score.title}"
-        self.assertEqual(str(item), expected_str)
\ No newline at end of file
+        self.assertEqual(str(item), expected_str)
+
+@pytest.mark.django_db
+class TestSetlistCounters(TestCase):
+    """Test denormalized setlist counters"""
+    
+    def setUp(self):
+        """Set up test data"""
+        self.user = UserFactory()
+        self.setlist = SetlistFactory(user=self.user)
+        self.score1 = ScoreFactory(user=self.user, pages=4, size_bytes=1024)
+        self.score2 = ScoreFactory(user=self.user, pages=None, size_bytes=2048)
+    
+    def assertCounters(self, setlist, item_count, total_pages, total_size_bytes):
+        setlist = Setlist.objects.get(pk=setlist.pk)
+        self.assertEqual(
+            (setlist.item_count, setlist.total_pages, setlist.total_size_bytes),
+            (item_count, total_pages, total_size_bytes)
+        )
+    
+    def test_counters_follow_item_changes(self):
+        """Adding and removing items updates counters in the database"""
+        item1 = SetlistItem.objects.create(setlist=self.setlist, score=self.score1)
+        SetlistItem.objects.create(setlist=self.setlist, score=self.score2)
+        self.assertCounters(self.setlist, 2, 4, 3072)
+        
+        SetlistItem.objects.get(pk=item1.pk).delete()
+        self.assertCounters(self.setlist, 1, 0, 2048)
+    
+    def test_score_delete_updates_counters(self):
+        """Deleting a score removes it from setlist counters"""
+        SetlistItem.objects.create(setlist=self.setlist, score=self.score1)
+        SetlistItem.objects.create(setlist=self.setlist, score=self.score2)
+        
+        self.score1.delete()
+        self.assertCounters(self.setlist, 1, 0, 2048)
+    
+    def test_score_pages_change(self):
+        """Page count changes propagate to setlists containing the score"""
+        other_setlist = SetlistFactory(user=self.user)
+        SetlistItem.objects.create(setlist=self.setlist, score=self.score1)
+        SetlistItem.objects.create(setlist=other_setlist, score=self.score1)
+        
+        Score.objects.filter(pk=self.score1.pk).update(pages=10)
+        updated = Setlist.objects.recalculate_for_score(self.score1.id)
+        self.assertEqual(updated, 2)
+        self.assertCounters(self.setlist, 1, 10, 1024)
+        self.assertCounters(other_setlist, 1, 10, 1024)
+    
+    def test_full_save_keeps_counters(self):
+        """Saving a stale setlist instance does not write its counters back"""
+        stale = Setlist.objects.get(pk=self.setlist.pk)
+        SetlistItem.objects.create(setlist=self.setlist, score=self.score1)
+        
+        stale.title = 'Renamed'
+        stale.save()
+        self.assertCounters(self.setlist, 1, 4, 1024)
+        self.assertEqual(Setlist.objects.get(pk=self.setlist.pk).title, 'Renamed')
+        
+        stale.item_count = 7
+        stale.save(update_fields=['item_count'])
+        self.assertCounters(self.setlist, 7, 4, 1024)
+    
+    def test_recalculate_counters_command(self):
+        """The repair command recomputes drifted counters"""
+        from io import StringIO
+        from django.core.management import call_command
+        
+        SetlistItem.objects.create(setlist=self.setlist, score=self.score1)
+        SetlistItem.objects.create(setlist=self.setlist, score=self.score2)
+        Setlist.objects.filter(pk=self.setlist.pk).update(item_count=0, total_pages=99, total_size_bytes=0)
+        
+        out = StringIO()
+        call_command('recalculate_setlist_counters', '--check', stdout=out)
+        self.assertIn('1 setlist(s) with drifted counters', out.getvalue())
+        self.assertCounters(self.setlist, 0, 99, 0)
+        
+        call_command('recalculate_setlist_counters', stdout=StringIO())
+        self.assertCounters(self.setlist, 2, 4, 3072)
@@ -150,4 +150,191 @@ class SetlistItemConstraintTest(TestCase):
         
         # Should auto-assign order_index
         self.assertIsNotNone(item.order_index)
-        self.assertEqual(item.order_index, 1)
\ No newline at end of file
+        self.assertEqual(item.order_index, 1)
+
+class SetlistQueryCountTest(APITestCase):
+    """Pin the number of queries used to list setlists"""
+    
+    def setUp(self):
+        self.user = UserFactory()
+        self.scores = ScoreFactory.create_batch(3, user=self.user, pages=10)
+        self.client = APIClient()
+        
+        refresh = RefreshToken.for_user(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {refresh.access_token}')
+        
+        for i in range(20):
+            setlist = Setlist.objects.create(user=self.user, title=f'Setlist {i}')
+            for score in self.scores:
+                SetlistItem.objects.create(setlist=setlist, score=score)
+    
+    def test_list_query_count(self):
+        """Listing setlists does not issue per-setlist queries"""
+        # JWT user lookup + pagination count + annotated page
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/v1/setlists/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        
+        results = response.data['results']
+        self.assertEqual(len(results), 20)
+        for result in results:
+            self.assertEqual(result['item_count'], 3)
+            self.assertEqual(result['total_pages'], 30)
+    
+    def test_detail_query_count(self):
+        """Setlist detail loads items, scores and positions in one prefetch"""
+        setlist = Setlist.objects.filter(user=self.user).first()
+        
+        # JWT user lookup + setlist + items joined with scores
+        with self.assertNumQueries(3):
+            response = self.client.get(f'/api/v1/setlists/{setlist.id}/')
+        self.assertEqual(response.data['item_count'], 3)
+        self.assertEqual(response.data['total_pages'], 30)
+        self.assertEqual(len(response.data['items']), 3)
+    
+    def test_admin_list_item_count(self):
+        """Admin setlist listing exposes the annotated item_count"""
+        self.user.is_staff = True
+        self.user.save()
+        
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/v1/admin/setlists/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(all(r['item_count'] == 3 for r in response.data['results']))
+
+
+class SetlistReorderTest(APITestCase):
+    """Test bulk reordering of setlist items"""
+    
+    def setUp(self):
+        self.user = UserFactory()
+        self.client = APIClient()
+        
+        refresh = RefreshToken.for_user(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {refresh.access_token}')
+        
+        self.setlist = Setlist.objects.create(user=self.user, title='Festival')
+        self.items = [
+            SetlistItem.objects.create(setlist=self.setlist, score=score)
+            for score in ScoreFactory.create_batch(100, user=self.user)
+        ]
+        self.url = f'/api/v1/setlists/{self.setlist.id}/reorder_items/'
+    
+    def test_reorder_uses_constant_queries(self):
+        """Reversing 100 items is a handful of queries and returns the new order"""
+        payload = {'items': [
+            {'id': item.id, 'order_index': len(self.items) - i}
+            for i, item in enumerate(self.items)
+        ]}
+        
+        # JWT user lookup + setlist + current keys + savepoint/update/release
+        # + setlist + items joined with scores
+        with self.assertNumQueries(8):
+            response = self.client.post(self.url, payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        
+        expected = [item.id for item in reversed(self.items)]
+        self.assertEqual([item['id'] for item in response.data['items']], expected)
+        self.assertEqual(
+            [item['order_index'] for item in response.data['items']],
+            list(range(1, 101))
+        )
+        self.assertEqual(list(self.setlist.items.values_list('id', flat=True)), expected)
+    
+    def test_reorder_requires_full_permutation(self):
+        """Partial, duplicated or gapped payloads are rejected without changes"""
+        keys_before = list(self.setlist.items.values_list('id', 'sort_key'))
+        bad_payloads = [
+            [{'id': item.id, 'order_index': i + 1} for i, item in enumerate(self.items[:-1])],
+            [{'id': item.id, 'order_index': 1} for item in self.items],
+            [{'id': item.id, 'order_index': i + 2} for i, item in enumerate(self.items)],
+            [{'id': 999999, 'order_index': 1}],
+            [{'id': self.items[0].id}],
+        ]
+        for items in bad_payloads:
+            response = self.client.post(self.url, {'items': items}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn('error', response.data)
+        
+        self.assertEqual(list(self.setlist.items.values_list('id', 'sort_key')), keys_before)
+
+
+class SetlistBulkAddTest(APITestCase):
+    """Test set-based add_items and duplicate"""
+    
+    def setUp(self):
+        self.user = UserFactory()
+        self.client = APIClient()
+        
+        refresh = RefreshToken.for_user(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {refresh.access_token}')
+        
+        self.setlist = Setlist.objects.create(user=self.user, title='Festival')
+        self.existing = ScoreFactory(user=self.user, pages=2, size_bytes=100)
+        SetlistItem.objects.create(setlist=self.setlist, score=self.existing)
+        self.scores = ScoreFactory.create_batch(50, user=self.user, pages=3, size_bytes=10)
+    
+    def test_add_items_reports_skipped_ids(self):
+        """Valid scores are added in one insert and the rest are reported"""
+        other_score = ScoreFactory(user=UserFactory())
+        score_ids = [s.id for s in self.scores] + [
+            self.scores[0].id, self.existing.id, other_score.id, 'abc'
+        ]
+        
+        # JWT user lookup + setlist + ownership + membership
+        # + savepoint/max key/insert/counters/counter reload/release
+        with self.assertNumQueries(10):
+            response = self.client.post(
+                f'/api/v1/setlists/{self.setlist.id}/add_items/',
+                {'score_ids': score_ids},
+                format='json'
+            )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['created_count'], 50)
+        self.assertEqual(
+            [item['order_index'] for item in response.data['items']],
+            list(range(2, 52))
+        )
+        self.assertEqual(response.data['skipped'], [
+            {'score_id': self.scores[0].id, 'reason': 'duplicate_in_request'},
+            {'score_id': 'abc', 'reason': 'invalid_id'},
+            {'score_id': self.existing.id, 'reason': 'already_in_setlist'},
+            {'score_id': other_score.id, 'reason': 'not_found'},
+        ])
+        
+        self.setlist.refresh_from_db()
+        self.assertEqual(
+            (self.setlist.item_count, self.setlist.total_pages, self.setlist.total_size_bytes),
+            (51, 152, 600)
+        )
+        self.assertEqual(
+            list(self.setlist.items.values_list('score_id', flat=True)),
+            [self.existing.id] + [s.id for s in self.scores]
+        )
+    
+    def test_duplicate_copies_items_in_one_insert(self):
+        """Duplicating copies order, notes and counters"""
+        for score in self.scores:
+            SetlistItem.objects.create(setlist=self.setlist, score=score, notes=f'note {score.id}')
+        SetlistItem.objects.get(setlist=self.setlist, score=self.scores[-1]).move_to(1)
+        
+        # JWT user lookup + setlist + items with scores + savepoint/setlist insert
+        # /item insert/counters/counter reload/release + setlist + items with scores
+        with self.assertNumQueries(11):
+            response = self.client.post(f'/api/v1/setlists/{self.setlist.id}/duplicate/')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        
+        copy = Setlist.objects.get(pk=response.data['id'])
+        self.assertEqual(copy.title, 'Festival (Copy)')
+        self.assertEqual(
+            (copy.item_count, copy.total_pages, copy.total_size_bytes),
+            (51, 152, 600)
+        )
+        self.assertEqual(
+            list(copy.items.values_list('score_id', 'notes')),
+            list(self.setlist.items.values_list('score_id', 'notes'))
+        )
+        self.assertEqual(
+            [item['order_index'] for item in response.data['items']],
+            list(range(1, 52))
+        )